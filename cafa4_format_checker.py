@@ -19,15 +19,23 @@ import csv
 import sys
 import re
 import os
+import time
 
 from cafa_hpo_format_checker import cafa_checker as hpo
 from cafa_go_format_checker import cafa_checker as go
 from cafa_do_format_checker import cafa_checker as do_checker
 from cafa_binding_site_format_checker import cafa_checker as bind
+from cafa_metrics import counted_lines
+from cafa_memory import estimate_file_memory, get_memory_budget, minimum_file_memory, output_bytes, pipeline_buffers
+from cafa_pipeline import pipelined_lines
+from cafa_trace import NULL_TRACER
 
 
 CAFA_VERSION = 4
 
+# How often a submission with a deadline looks at it while waiting for a member validated by a worker
+MEMBER_POLL_SECONDS = 0.5
+
 """
 function go_hpo_predictions((
             None,
@@ -43,7 +51,7 @@ function purpose:
 """
 
 
-def go_hpo_predictions(path, fileName):
+def go_hpo_predictions(path, fileName, checker=None):
     features = (fileName.split(".")[0]).split("_")
     if features[0].lower() == "tc":
         taxon = features[3].lower()
@@ -70,6 +78,8 @@ def go_hpo_predictions(path, fileName):
             % fileName,
         )
 
+    if checker is not None:
+        return checker(path, fileName)
     if taxon == "hpo":
         return hpo(path, fileName)
     if taxon == "do":
@@ -81,6 +91,34 @@ def go_hpo_predictions(path, fileName):
         return go(path, fileName)
 
 
+def prediction_kind(fileName):
+    """
+    Returns which checker file_name_check routes a file to: "binding", "hpo", "do" or "go".
+    Only looks at the filename fields; file_name_check still reports malformed names.
+    """
+    features = fileName.split(".")[0].split("_")
+    if len(features) == 4 and features[0].lower() != "tc":
+        return "binding"
+    taxon = features[-1].lower()
+    if taxon in ("hpo", "do"):
+        return taxon
+    return "go"
+
+
+def submission_team(fileName):
+    """
+    Returns the team field of a submission name (team_model#_taxon, TC_team_model#_taxon or
+    team_model#_taxon_binding).  Names that do not follow the grammar are their own team.
+    """
+    stem = fileName.split("/")[-1].split(".")[0]
+    features = stem.split("_")
+    if len(features) < 3:
+        return stem
+    if len(features) == 4 and features[0].lower() == "tc":
+        return features[1]
+    return features[0]
+
+
 """
 function binding_sites()
 Files are sent here from the main function if there are four fields seperated by '_' in the input filename.
@@ -88,12 +126,13 @@ function purpose:
     1. check that the fourth field is 'binding'.
     2. check that the third field is an integer and is between 1 and 3.
     3. check that the second field is not 'hpo'
-    4. sends file to cafa_binding_site_format_checker.py, function cafa_checker
+    4. sends file to cafa_binding_site_format_checker.py, function cafa_checker (or to checker, e.g. the
+       parallel one of cafa_binding_parallel, which takes the file path)
     5. returned boolean, message is return to file_name_checker
 """
 
 
-def binding_sites(path, filename):
+def binding_sites(path, filename, checker=None):
     features = (filename.split(".")[0]).split("_")
     try:
         model_count = int(features[1][-1:])
@@ -125,7 +164,7 @@ def binding_sites(path, filename):
             ),
         )
     else:
-        return bind(path, filename)
+        return (checker or bind)(path, filename)
         # return True, "Binding site prediction file has been validated!"
 
 
@@ -145,25 +184,29 @@ Function purpose:
 """
 
 
-def file_name_check(infile, fileName):
+def file_name_check(infile, fileName, binding_checker=None, checker=None):
+    """
+    binding_checker, checker: (correct, errmsg) = checker(infile, fileName) used instead of the binding-site
+    and the GO/HPO/DO checkers once the file name is accepted
+    """
 
     features = fileName.split(".")[0].split("_")
     if len(features) == 3:
         if features[2].lower() != "moon":
-            return tuple(["GO/HPO Prediction"]) + go_hpo_predictions(infile, fileName)
+            return tuple(["GO/HPO Prediction"]) + go_hpo_predictions(infile, fileName, checker)
         elif features[2].lower() == "moon":
             return tuple(["Moonlighting Protein Prediction"]) + go_hpo_predictions(
-                infile, fileName
+                infile, fileName, checker
             )
     elif len(features) == 4:
         if features[0].lower() == "tc":
             # print "File %s is being treated as a Term Centric GO and moonlighting proteins prediction\n" % fileName
             # print go_hpo_predictions(infile, fileName)
             return tuple(["Term Centric GO Prediction"]) + go_hpo_predictions(
-                infile, fileName
+                infile, fileName, checker
             )
         else:
-            return tuple(["Binding Site Prediction"]) + binding_sites(infile, fileName)
+            return tuple(["Binding Site Prediction"]) + binding_sites(infile, fileName, binding_checker)
 
     elif len(features) < 3:
         return (
@@ -182,7 +225,84 @@ def file_name_check(infile, fileName):
         )
 
 
-def cafa_checker(input_file):
+def bounded_file_name_check(infile, fileName, kind, deadline=None):
+    """ file_name_check, stopped with an inconclusive (None) result if the deadline passes first """
+    if deadline is None:
+        return file_name_check(infile, fileName)
+    from cafa_deadline import PREDICTION_STATES, DeadlineExceeded, inconclusive_message
+
+    try:
+        return file_name_check(deadline.track(infile, fileName, PREDICTION_STATES[kind]), fileName)
+    except DeadlineExceeded as stopped:
+        return None, None, inconclusive_message(stopped.partial)
+
+
+def archive_members(files):
+    """ The names of the prediction files in an open zipfile.ZipFile: no folders or macOS metadata """
+    return [
+        name
+        for name in files.namelist()
+        if "__MACOSX" not in name
+        and not name.endswith("/")
+        and not name.endswith(".DS_Store")
+    ]
+
+
+def check_file(infile, fileName, nbytes, stripped=True, profiler=None, metrics=None, progress=None,
+               stats=None, columnar=None, deadline=None, tracer=None, sketches=None):
+    """
+    Runs file_name_check on one prediction file (an iterable of lines), with the optional instrumentation
+    of cafa_checker wrapped around its lines.  nbytes is the (uncompressed) size of the file; stripped
+    tells whether the lines come without their newline.  Returns file_name_check's (type, correct, errmsg);
+    correct is None if the cafa_deadline.Deadline passed before the file was validated.
+    """
+    if profiler is not None:
+        infile = profiler.timed_lines(infile)
+    if progress is not None:
+        infile = progress.track(infile, fileName, nbytes, stripped=stripped)
+    kind = prediction_kind(fileName)
+    if stats is not None and kind != "binding":
+        from cafa_stats import SubmissionStats
+
+        collector = stats[fileName] = SubmissionStats()
+        infile = collector.track(infile)
+    if sketches is not None and kind != "binding":
+        from cafa_similarity import PredictionSketch
+
+        sketch = sketches[fileName] = PredictionSketch()
+        infile = sketch.track(infile)
+    writer = None
+    if columnar is not None and kind != "binding":
+        from cafa_columnar import ColumnarWriter
+
+        writer = ColumnarWriter(os.path.join(columnar, fileName.split(".")[0]), fileName)
+        infile = writer.track(infile)
+
+    if tracer is None:
+        tracer = NULL_TRACER
+    with tracer.span("file_name_check", file=fileName, kind=kind) as span, tracer.track_sections(infile) as infile:
+        if metrics is None:
+            file_type, correct, errmsg = bounded_file_name_check(infile, fileName, kind, deadline)
+        else:
+            # lines are counted in C and everything is recorded in one batched update
+            start = time.perf_counter()
+            infile, line_count = counted_lines(infile)
+            file_type, correct, errmsg = bounded_file_name_check(infile, fileName, kind, deadline)
+            metrics.observe_file(file_type, correct, errmsg, line_count(), nbytes, time.perf_counter() - start)
+        span.set(file_type=file_type, correct=correct)
+
+    if writer is not None:
+        if correct:
+            writer.close()
+        else:
+            writer.abort()
+    return file_type, correct, errmsg
+
+
+def cafa_checker(input_file, profiler=None, metrics=None, progress=None, stats=None, columnar=None,
+                 time_budget=None, file_time_budget=None, cancel_event=None, memory_budget=None,
+                 binding_workers=None, tracer=None, precheck=False, sketches=None, member_workers=None,
+                 executor=None, chunk_workers=None):
     """
     function purpose:
         1. Checks to see if the submission is a zipped archive or not.
@@ -190,7 +310,69 @@ def cafa_checker(input_file):
         3. opens files and sends them to the file_name_check function
         4. Builds an error report and prints it out when validation is finished
         5. Checks to see if all the files are the same type of prediction.  Return False
+
+    profiler: optional cafa_profiler.ValidationProfiler; when given, decompression, splitting and the time
+    spent waiting for input lines are charged to it, and reading the zip directory and the precheck are
+    timed as phases.  The caller is responsible for installing it.  It
+    cannot be combined with member_workers, chunk_workers or binding_workers (ValueError).
+    metrics: optional cafa_metrics.ValidationMetrics, updated once per validated file.
+    progress: optional cafa_progress.ProgressReporter, reporting bytes, lines, section, lines/sec and ETA; for
+        files validated by workers, as their results come back.
+    stats: optional dict; when given, a cafa_stats.SubmissionStats profile of every GO/HPO/DO file is
+        collected in the same pass and stored in it under the file name.
+    columnar: optional directory; validated GO/HPO/DO predictions are exported there as memory-mappable
+        columns (see cafa_columnar), one subdirectory per file.
+    time_budget, file_time_budget: optional limits in seconds for the whole submission and for each file.
+    cancel_event: optional threading/multiprocessing Event; setting it stops validation at the next check.
+        A file that runs out of time (or is cancelled) is inconclusive: its lines checked and the sections
+        seen so far are reported, and cafa_checker returns None unless another file failed.
+    memory_budget: optional cafa_memory.MemoryBudget (default: the process-wide one).  Each archive member
+        waits for a reservation before it is inflated: its estimated memory, or whatever is free once the
+        reader's smallest buffers fit, and the reader's buffers are sized to fit the bytes granted.
+    binding_workers: validate a plain binding-site file with cafa_binding_parallel and this many worker
+        processes, within the time budgets and after the precheck.  Its lines are not seen here, so the
+        per-line options above do not apply to it.
+    tracer: optional cafa_trace.Tracer; a sampled submission is recorded as a trace of spans (open, zip
+        directory, members, decompression, file_name_check, sections, report).
+    precheck: validate the header and the END trailer of a plain file first (cafa_quick_check.precheck),
+        reading only its first and last few KB, and fail it at once if they are wrong.
+    sketches: optional dict; when given, a cafa_similarity.PredictionSketch of the predictions of every
+        GO/HPO/DO file is collected in the same pass and stored in it under the file name.
+    member_workers: validate the members of an archive concurrently with this many workers, each once its
+        estimate is reserved from the memory budget.  The per-line options other than progress do not apply to
+        them (main() refuses them together); the report is the same, in archive order.
+    chunk_workers: validate each large GO/HPO/DO member of an archive in byte ranges on this many workers,
+        inflated once into shared memory (cafa_shared); the member's whole size is reserved from the memory
+        budget and the per-line options other than progress do not apply to it (main() refuses them together).
+        Smaller members are validated as usual.  Ignored with member_workers.
+    executor: "thread" or "process", the workers of member_workers, chunk_workers and binding_workers
+        (default: cafa_executor.default_backend(), threads on a free-threaded Python build).
     """
+    if profiler is not None and (member_workers is not None or chunk_workers is not None
+                                 or binding_workers is not None):
+        raise ValueError("a profiler cannot time files validated by workers")
+    options = dict(profiler=profiler, metrics=metrics, progress=progress, stats=stats, columnar=columnar,
+                   sketches=sketches)
+    deadline = None
+    if time_budget is not None or file_time_budget is not None or cancel_event is not None:
+        from cafa_deadline import Deadline
+
+        deadline = Deadline(time_budget, cancel_event)
+    if memory_budget is None:
+        memory_budget = get_memory_budget()
+    if tracer is None:
+        tracer = NULL_TRACER
+
+    with tracer.trace("submission", path=input_file) as submission:
+        result = _check_submission(input_file, options, deadline, file_time_budget, memory_budget, binding_workers,
+                                   tracer, precheck, member_workers, executor, chunk_workers)
+        submission.set(valid=result)
+    return result
+
+
+def _check_submission(input_file, options, deadline, file_time_budget, memory_budget, binding_workers, tracer,
+                      precheck=False, member_workers=None, executor=None, chunk_workers=None):
+    """ The body of cafa_checker: validates every file of the submission and prints the report """
     # holds all returned boolean variables and the error messages.
     REPORT = []
 
@@ -201,22 +383,93 @@ def cafa_checker(input_file):
     TYPES = []
 
     print("____________________________________________")
-    if zipfile.is_zipfile(input_file):
-        files = zipfile.ZipFile(input_file, "r")
-        names = files.namelist()
-        names = [
-            name
-            for name in names
-            if "__MACOSX" not in name
-            and not name.endswith("/")
-            and not name.endswith(".DS_Store")
-        ]
+    with tracer.span("open") as span:
+        is_archive = zipfile.is_zipfile(input_file)
+        span.set(archive=is_archive)
+    if is_archive:
+        with tracer.span("zip_directory") as span, _phase(options["profiler"], "zip_directory"):
+            files = zipfile.ZipFile(input_file, "r")
+            names = archive_members(files)
+            span.set(members=len(names))
+        if member_workers is not None:
+            for file_type, correct, errmsg in _check_members_concurrently(
+                input_file, names, member_workers, executor, deadline, file_time_budget, memory_budget,
+                options["progress"]
+            ):
+                FLAGS.append(correct)
+                REPORT.append((correct, errmsg))
+                TYPES.append(file_type)
+            names = []
         for name in names:
             filename = name.split("/")[-1]
-            infile = files.read(name)
-            infile = infile.strip().split(b"\n")
+            if deadline is not None and deadline.reason() is not None:
+                # out of time: the remaining members are not even decompressed
+                from cafa_deadline import inconclusive_message
+
+                FLAGS.append(None)
+                REPORT.append((None, inconclusive_message(deadline.partial(filename))))
+                TYPES.append(None)
+                continue
+            info = files.getinfo(name)
+            file_size = info.file_size
+            chunked = False
+            if chunk_workers is not None:
+                from cafa_shared import is_chunked
+
+                chunked = is_chunked(filename, file_size)
+            columnar = options["columnar"] is not None
+            if chunked:
+                # the member is held inflated in shared memory while its ranges are validated
+                estimate = minimum = file_size
+            else:
+                # the reader's buffers are sized to what is granted, down to their smallest
+                estimate = estimate_file_memory(file_size, columnar)
+                minimum = minimum_file_memory(file_size, columnar)
+            reservation = memory_budget.reserve(estimate, None if deadline is None else deadline.remaining(), minimum)
+            if reservation is None:
+                # the deadline passed while waiting for memory
+                from cafa_deadline import inconclusive_message
+
+                FLAGS.append(None)
+                REPORT.append((None, inconclusive_message(deadline.partial(filename))))
+                TYPES.append(None)
+                continue
             print("Validating {}".format(filename))
-            file_type, correct, errmsg = file_name_check(infile, filename)
+            if chunked:
+                from cafa_shared import validate_member_in_chunks
+
+                progress = options["progress"]
+                with reservation, tracer.span("member", member=filename, bytes=file_size,
+                                              compressed_bytes=info.compress_size):
+                    progress = None if progress is None else progress.collect(filename, file_size)
+                    try:
+                        file_type, correct, errmsg = validate_member_in_chunks(
+                            input_file, name, chunk_workers, executor,
+                            deadline=None if deadline is None else deadline.child(file_time_budget),
+                            progress=progress,
+                        )
+                    finally:
+                        if progress is not None:
+                            progress.close()
+                FLAGS.append(correct)
+                REPORT.append((correct, errmsg))
+                TYPES.append(file_type)
+                continue
+            with reservation, tracer.span(
+                "member", member=filename, bytes=file_size, compressed_bytes=info.compress_size
+            ), files.open(name) as member, tracer.traced_reader(member) as member:
+                # the member is inflated on a background thread while its lines are validated; with a
+                # profiler, the time spent waiting for it is charged to I/O by profiler.timed_lines
+                block_size, max_blocks = pipeline_buffers(reservation.nbytes - output_bytes(file_size, columnar))
+                infile = pipelined_lines(member, block_size, max_blocks)
+                try:
+                    file_type, correct, errmsg = check_file(
+                        infile, filename, file_size,
+                        deadline=None if deadline is None else deadline.child(file_time_budget), tracer=tracer,
+                        **options
+                    )
+                finally:
+                    infile.close()
             FLAGS.append(correct)
             REPORT.append((correct, errmsg))
             TYPES.append(file_type)
@@ -224,17 +477,149 @@ def cafa_checker(input_file):
         print("\nFolders must be compressed into a zipped archive before submission and validation\n")
         return
     else:
-        infile = open(input_file, "r")
         filename = input_file.split("/")[-1]
         print("Validating {}".format(filename))
-        # print file_name_check(infile, filename)
-        file_type, correct, errmsg = file_name_check(infile, filename)
+        structural_error = None
+        if precheck:
+            from cafa_quick_check import precheck as structural_precheck
+
+            with tracer.span("precheck"), _phase(options["profiler"], "precheck"):
+                structural_error = structural_precheck(input_file, filename)
+        if structural_error is not None:
+            # the file name is still checked first, as it is for a full scan
+            reject = lambda path, fileName: (False, structural_error)
+            file_type, correct, errmsg = file_name_check(None, filename, reject, reject)
+        elif binding_workers is not None and prediction_kind(filename) == "binding":
+            file_type, correct, errmsg = _check_binding_in_parallel(
+                input_file, filename, binding_workers, executor,
+                None if deadline is None else deadline.child(file_time_budget), options["progress"]
+            )
+        else:
+            infile = open(input_file, "r")
+            # print file_name_check(infile, filename)
+            file_type, correct, errmsg = check_file(
+                infile, filename, os.stat(input_file).st_size, stripped=False,
+                deadline=None if deadline is None else deadline.child(file_time_budget), tracer=tracer, **options
+            )
 
         FLAGS.append(correct)
         REPORT.append((correct, errmsg))
         TYPES.append(file_type)
     print("\n")
 
+    with tracer.span("report", files=len(FLAGS)):
+        return print_report(FLAGS, REPORT, TYPES)
+
+
+def _phase(profiler, name):
+    """ profiler.phase(name), timing work done outside the per-line loop; nothing without a profiler """
+    if profiler is None:
+        from contextlib import nullcontext
+
+        return nullcontext()
+    return profiler.phase(name)
+
+
+def _check_binding_in_parallel(input_file, filename, workers, executor, deadline, progress=None):
+    """
+    file_name_check of a plain binding-site file validated by cafa_binding_parallel, within deadline;
+    progress (a cafa_progress.ProgressReporter) follows the batches as they are merged
+    """
+    from cafa_binding_parallel import cafa_checker as parallel_bind
+    from cafa_deadline import DeadlineExceeded, inconclusive_message
+
+    if progress is not None:
+        progress = progress.collect(filename, os.stat(input_file).st_size)
+    checker = lambda path, fileName: parallel_bind(path, fileName, workers, executor=executor, deadline=deadline,
+                                                   progress=progress)
+    try:
+        return file_name_check(input_file, filename, checker)
+    except DeadlineExceeded as stopped:
+        return None, None, inconclusive_message(stopped.partial)
+    finally:
+        if progress is not None:
+            progress.close()
+
+
+def _check_members_concurrently(input_file, names, workers, executor, deadline, file_time_budget, memory_budget,
+                                progress=None):
+    """
+    Validates the archive members names with cafa_async.validate_member on a cafa_executor pool; yields
+    file_name_check's (type, correct, errmsg) of each, in archive order.  A member is only submitted once
+    its estimated memory is reserved from memory_budget, and gives it back when it is done.  When the
+    deadline passes, the running members stop at their next check and the others are not started: all are
+    inconclusive.  progress (a cafa_progress.ProgressReporter) follows the archive a member at a time, with
+    the last member done as its state.
+    """
+    import multiprocessing
+    from concurrent.futures import wait
+    from cafa_async import SlotEvent, _init_worker, validate_member
+    from cafa_deadline import inconclusive_message
+    from cafa_executor import default_backend, make_executor
+
+    backend = executor or default_backend()
+    # one cancel flag for the submission, polled by the Deadline of every member
+    flags = multiprocessing.RawArray("b", 1)
+    if backend == "thread":
+        pool = make_executor(workers, backend, thread_name_prefix="cafa-member")
+        cancel_event = SlotEvent(0, flags)
+    else:
+        pool = make_executor(workers, backend, _init_worker, (flags,))
+        cancel_event = SlotEvent(0)
+    try:
+        # a member that is still running when the submission's deadline passes is stopped by the cancel flag
+        time_budget = file_time_budget
+        if deadline is not None and deadline.remaining() is not None:
+            time_budget = deadline.remaining() if time_budget is None else min(time_budget, deadline.remaining())
+        with zipfile.ZipFile(input_file, "r") as files:
+            sizes = [files.getinfo(name).file_size for name in names]
+        if progress is not None:
+            progress = progress.collect(os.path.basename(input_file), sum(sizes))
+        futures = []
+        for name, file_size in zip(names, sizes):
+            reservation = memory_budget.reserve(
+                estimate_file_memory(file_size), None if deadline is None else deadline.remaining()
+            )
+            if reservation is None:
+                # the deadline passed while waiting for memory
+                futures.append(None)
+                continue
+            future = pool.submit(validate_member, input_file, name, time_budget, cancel_event)
+            future.add_done_callback(lambda done, reservation=reservation: reservation.release())
+            futures.append(future)
+        bytes_done = 0
+        for name, file_size, future in zip(names, sizes, futures):
+            filename = name.split("/")[-1]
+            bytes_done += file_size
+            print("Validating {}".format(filename))
+            if future is None:
+                yield None, None, inconclusive_message(deadline.partial(filename))
+                continue
+            if deadline is not None:
+                while not future.done() and deadline.reason() is None:
+                    remaining = deadline.remaining()
+                    wait([future], MEMBER_POLL_SECONDS if remaining is None else min(remaining, MEMBER_POLL_SECONDS))
+                if not future.done():
+                    flags[0] = 1
+                    for other in futures:
+                        if other is not None:
+                            other.cancel()
+            if future.cancelled():
+                yield None, None, inconclusive_message(deadline.partial(filename))
+                continue
+            result = future.result()
+            if progress is not None:
+                progress.update(bytes_done, progress.lines + result.lines, filename)
+            yield result.file_type, result.correct, result.errmsg
+    finally:
+        flags[0] = 1
+        pool.shutdown(wait=True, cancel_futures=True)
+        if progress is not None:
+            progress.close()
+
+
+def print_report(FLAGS, REPORT, TYPES):
+    """ Prints the files that failed, were not completely validated or passed; returns cafa_checker's result """
     if False in FLAGS:
         print("Files incorrecly formatted:\n")
         for correct, errmsg in REPORT:
@@ -243,6 +628,19 @@ def cafa_checker(input_file):
                 print("\n")
         return False
 
+    if None in FLAGS:
+        print("Files not completely validated:\n")
+        for correct, errmsg in REPORT:
+            if correct is None:
+                print(errmsg)
+                print("\n")
+        if True in FLAGS:
+            print("Files correctly formatted:\n")
+            for correct, errmsg in REPORT:
+                if correct:
+                    print(errmsg)
+        return None
+
     if True in FLAGS:
         print("Files correctly formatted:\n")
         for correct, errmsg in REPORT:
@@ -267,11 +665,145 @@ def cafa_checker(input_file):
 
 
 def usage():
-    print("Usage: cafa4_format_check.py <path to input file or zipped archive>")
+    print("Usage: cafa4_format_check.py <path to input file or zipped archive> [--profile]")
+
+
+def main(argv=None):
+    import argparse
+    from cafa_profiler import add_profile_arguments, profiler_from_args, finish_profile
+
+    parser = argparse.ArgumentParser(usage="%(prog)s <path to input file or zipped archive> [options]")
+    parser.add_argument("input_file", help="path to the prediction file or zipped archive")
+    add_profile_arguments(parser)
+    parser.add_argument("--metrics-textfile", metavar="PATH",
+                        help="write OpenMetrics counters and histograms for this run to PATH")
+    parser.add_argument("--progress", action="store_true",
+                        help="report bytes, lines, current section, lines/sec and ETA on stderr")
+    parser.add_argument("--stats", metavar="PATH",
+                        help="write a JSON profile (distinct targets/terms, score histograms, ...) of each file to PATH")
+    parser.add_argument("--sketches", metavar="PATH",
+                        help="write a MinHash sketch of each file's predictions to PATH (see cafa_similarity.py)")
+    parser.add_argument("--columnar-output", metavar="DIR",
+                        help="export validated GO/HPO/DO predictions as memory-mappable .npy columns under DIR")
+    parser.add_argument("--time-budget", type=float, metavar="SECONDS",
+                        help="stop after SECONDS and report the files not yet validated as inconclusive")
+    parser.add_argument("--file-time-budget", type=float, metavar="SECONDS",
+                        help="time budget for each file of an archive")
+    parser.add_argument("--memory-budget", type=float, metavar="MB",
+                        help="memory the validation may reserve for its input buffers; archive members wait for it")
+    parser.add_argument("--member-workers", type=int, metavar="N",
+                        help="validate the members of an archive concurrently with N workers")
+    parser.add_argument("--chunk-workers", type=int, metavar="N",
+                        help="validate each large GO/HPO/DO archive member in byte ranges on N workers, "
+                             "inflated once into shared memory")
+    parser.add_argument("--executor", choices=("thread", "process"),
+                        help="workers for --member-workers, --chunk-workers and --binding-workers (default: "
+                             "threads on a free-threaded Python build, processes otherwise)")
+    parser.add_argument("--binding-workers", type=int, metavar="N",
+                        help="validate a plain binding-site file with its target blocks checked by N processes")
+    parser.add_argument("--trace", metavar="PATH",
+                        help="append spans of the validation phases to PATH as JSON lines (see cafa_trace.py)")
+    parser.add_argument("--trace-sample-rate", type=float, default=1.0, metavar="RATE",
+                        help="fraction of submissions traced with --trace (default %(default)s)")
+    parser.add_argument("--precheck", action="store_true",
+                        help="reject a plain file with a bad header or no END trailer before scanning its body")
+    parser.add_argument("--quick", action="store_true",
+                        help="check the header and END exactly and only a random sample of prediction lines")
+    parser.add_argument("--sample-size", type=int, default=2000, metavar="N",
+                        help="number of prediction lines sampled per file with --quick (default 2000)")
+    parser.add_argument("--seed", type=int, help="random seed for --quick, for reproducible samples")
+    args = parser.parse_args(argv)
+    # files validated in workers are not seen here line by line; only their progress comes back with the results
+    per_line = {
+        "--profile": args.profile, "--stats": args.stats, "--sketches": args.sketches,
+        "--columnar-output": args.columnar_output, "--metrics-textfile": args.metrics_textfile,
+    }
+    for workers_option, workers, refused in (
+        ("--member-workers", args.member_workers,
+         ("--profile", "--stats", "--sketches", "--columnar-output", "--metrics-textfile")),
+        ("--chunk-workers", args.chunk_workers, ("--stats", "--sketches", "--columnar-output", "--metrics-textfile")),
+        ("--binding-workers", args.binding_workers,
+         ("--stats", "--sketches", "--columnar-output", "--metrics-textfile")),
+    ):
+        used = [option for option in refused if per_line[option]]
+        if workers is not None and used:
+            parser.error("{} cannot be used with {}".format(", ".join(used), workers_option))
+    if args.profile:
+        # the profiler swaps the checkers' module globals for timed wrappers, which worker threads would
+        # share, and worker processes would not be timed at all
+        parallel = [option for option, value in (
+            ("--chunk-workers", args.chunk_workers is not None),
+            ("--binding-workers", args.binding_workers is not None),
+            ("--executor thread", args.executor == "thread"),
+        ) if value]
+        if parallel:
+            parser.error("--profile cannot be used with {}".format(", ".join(parallel)))
+
+    if args.quick:
+        from cafa_quick_check import print_quick_check
+
+        return print_quick_check(args.input_file, args.sample_size, args.seed)
+
+    progress = None
+    if args.progress:
+        from cafa_progress import ProgressReporter
+
+        progress = ProgressReporter()
+
+    metrics = None
+    if args.metrics_textfile:
+        from cafa_metrics import ValidationMetrics
+
+        metrics = ValidationMetrics()
+
+    stats = {} if args.stats else None
+    sketches = {} if args.sketches else None
+
+    profiler = profiler_from_args(args)
+    options = dict(
+        metrics=metrics,
+        progress=progress,
+        stats=stats,
+        sketches=sketches,
+        columnar=args.columnar_output,
+        time_budget=args.time_budget,
+        file_time_budget=args.file_time_budget,
+        binding_workers=args.binding_workers,
+        member_workers=args.member_workers,
+        chunk_workers=args.chunk_workers,
+        executor=args.executor,
+        precheck=args.precheck,
+    )
+    if args.memory_budget is not None:
+        from cafa_memory import MB, MemoryBudget
+
+        options["memory_budget"] = MemoryBudget(int(args.memory_budget * MB))
+    if args.trace:
+        from cafa_trace import Tracer
+
+        options["tracer"] = Tracer(args.trace, args.trace_sample_rate)
+    if profiler is None:
+        result = cafa_checker(args.input_file, **options)
+    else:
+        with profiler:
+            result = cafa_checker(args.input_file, profiler=profiler, **options)
+        finish_profile(profiler, args)
+    if stats is not None:
+        import json
+
+        with open(args.stats, "w") as stats_handle:
+            json.dump(dict((name, collector.summary()) for name, collector in stats.items()), stats_handle, indent=2)
+    if sketches is not None:
+        import json
+
+        with open(args.sketches, "w") as sketches_handle:
+            json.dump(dict((name, sketch.to_dict()) for name, sketch in sketches.items()), sketches_handle)
+    if metrics is not None:
+        metrics.write_textfile(args.metrics_textfile)
+    if args.trace:
+        options["tracer"].close()
+    return result
 
 
 if __name__ == "__main__":
-    try:
-        cafa_checker(sys.argv[1])
-    except IndexError:
-        usage()
+    main()
@@ -0,0 +1,370 @@
+#!/usr/bin/env python
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import asyncio
+import inspect
+import multiprocessing
+import os
+import zipfile
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from cafa4_format_checker import archive_members, check_file, file_name_check
+from cafa_deadline import Deadline
+from cafa_executor import check_backend, default_backend, make_executor
+from cafa_metrics import counted_lines
+from cafa_pipeline import pipelined_lines
+from cafa_push import PushValidator
+from cafa_records import InvalidRecordError
+
+"""
+asyncio API for validating submissions in an intake server.
+
+    async with AsyncValidator(max_workers=4) as validator:
+        async for result in validator.iter_members("ateam.zip"):
+            print(result.filename, result.correct)
+        is_valid, results = await validator.validate("ateam.zip")
+        is_valid, results = await validator.validate(request.content, "ateam_1_9606.txt")
+
+    is_valid, results = await validate_async(path_or_stream)   # with a validator shared by the process
+
+An AsyncValidator keeps one pool of worker processes (or threads, executor="thread") for all the
+submissions it is given, so a request never starts a process of its own.  Every file (a plain file, or one
+member of an archive) is one job; at most max_concurrency jobs are in the pool at a time and the others
+wait in the event loop, not in a blocked thread.  iter_members() yields a MemberResult per member, in
+archive order, as soon as that member and the ones before it are done; members of one archive run
+concurrently.
+
+Cancelling the task that awaits a result (or leaving iter_members early, see contextlib.aclosing) removes
+the jobs still waiting and stops the running ones at their next cafa_deadline check: every job has a slot
+in a shared array of cancel flags that its Deadline polls.  time_budget limits each file in the same way
+and makes it inconclusive (correct None).
+
+A stream (an async iterable of bytes, or an object with a read() method or coroutine, such as
+asyncio.StreamReader) has its file name checked like a file's, then is validated with
+cafa_push.PushValidator as it is received, a piece at a time, so an invalid upload is rejected before it
+has been read to the end.  A stream is a job too and waits for a slot; its pieces run on the pool of
+threads, or on a thread of the validator's own with executor="process", as the validator's state cannot
+move between processes.
+"""
+
+# lines: the number of lines validated, for progress reports (0 where nobody counts them)
+MemberResult = namedtuple("MemberResult", ["filename", "file_type", "correct", "errmsg", "lines"], defaults=(0,))
+
+# Bytes asked of a stream's read() at a time
+STREAM_CHUNK_BYTES = 256 * 1024
+
+FOLDER_MESSAGE = "Folders must be compressed into a zipped archive before submission and validation"
+
+# The cancel flags of the pool this worker process belongs to, set by _init_worker
+_cancel_flags = None
+
+
+def _init_worker(cancel_flags):
+    global _cancel_flags
+    _cancel_flags = cancel_flags
+
+
+class SlotEvent(object):
+    """ The cancel event of a job: one byte of a shared array; flags None means the worker's _cancel_flags """
+
+    def __init__(self, slot, flags=None):
+        self.slot = slot
+        self.flags = flags
+
+    def __getstate__(self):
+        # the array is inherited by worker processes, not sent with every job
+        return {"slot": self.slot, "flags": None}
+
+    def _array(self):
+        return _cancel_flags if self.flags is None else self.flags
+
+    def is_set(self):
+        return self._array()[self.slot] != 0
+
+    def set(self):
+        self._array()[self.slot] = 1
+
+
+def submission_members(path):
+    """ The archive members to validate in path, or [None] for a plain file """
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path, "r") as files:
+            return archive_members(files)
+    return [None]
+
+
+def validate_member(path, name, time_budget=None, cancel_event=None):
+    """
+    Validates the member name of the archive path (the plain file path if name is None) in a worker.
+    Returns a MemberResult; correct is None if the file was cancelled or ran out of time_budget.
+    """
+    filename = (path if name is None else name).split("/")[-1]
+    deadline = None
+    if time_budget is not None or cancel_event is not None:
+        deadline = Deadline(time_budget, cancel_event)
+    try:
+        if name is None:
+            with open(path, "r") as infile:
+                lines, line_count = counted_lines(infile)
+                file_type, correct, errmsg = check_file(
+                    lines, filename, os.path.getsize(path), stripped=False, deadline=deadline
+                )
+        else:
+            with zipfile.ZipFile(path, "r") as files, files.open(name) as member:
+                infile = pipelined_lines(member)
+                try:
+                    lines, line_count = counted_lines(infile)
+                    file_type, correct, errmsg = check_file(
+                        lines, filename, files.getinfo(name).file_size, deadline=deadline
+                    )
+                finally:
+                    infile.close()
+    except Exception as error:
+        return MemberResult(filename, None, False, "Validation failed with {}: {}".format(type(error).__name__, error))
+    return MemberResult(filename, file_type, correct, errmsg, line_count())
+
+
+def submission_verdict(results):
+    """ cafa4_format_checker.cafa_checker's result for a submission with these MemberResults """
+    flags = [result.correct for result in results]
+    if False in flags:
+        return False
+    if None in flags:
+        return None
+    return bool(flags)
+
+
+def _accept(path, fileName):
+    return True, None
+
+
+async def _stream_chunks(stream):
+    if hasattr(stream, "__aiter__"):
+        async for chunk in stream:
+            yield chunk
+    elif hasattr(stream, "read"):
+        while True:
+            chunk = stream.read(STREAM_CHUNK_BYTES)
+            if inspect.isawaitable(chunk):
+                chunk = await chunk
+            if not chunk:
+                break
+            yield chunk
+    else:
+        for chunk in stream:
+            yield chunk
+
+
+class AsyncValidator(object):
+    """
+    max_workers: size of the pool (default: number of CPUs)
+    max_concurrency: jobs in the pool at a time (default: max_workers); more only queue up in the pool
+    executor: "process" or "thread" (default: cafa_executor.default_backend(), threads on a free-threaded build)
+    time_budget: optional limit in seconds for each file
+    """
+
+    def __init__(self, max_workers=None, max_concurrency=None, executor=None, time_budget=None):
+        executor = check_backend(executor) if executor is not None else default_backend()
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_concurrency = max_concurrency or self.max_workers
+        self.executor = executor
+        self.time_budget = time_budget
+        self._flags = multiprocessing.RawArray("b", self.max_concurrency)
+        self._free_slots = list(range(self.max_concurrency))
+        self._pool = None
+        self._threads = None
+        self._semaphore = None
+        self._loop = None
+
+    @property
+    def in_flight(self):
+        """ Jobs submitted to the pool and not finished yet, counting cancelled ones still running """
+        return self.max_concurrency - len(self._free_slots)
+
+    def _start(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # an asyncio.Semaphore belongs to one event loop
+            if self.in_flight:
+                raise RuntimeError("AsyncValidator is in use by another event loop")
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        if self._pool is None:
+            if self.executor == "process":
+                self._pool = make_executor(self.max_workers, "process", _init_worker, (self._flags,))
+            else:
+                self._pool = make_executor(self.max_workers, "thread", thread_name_prefix="cafa-validate")
+            self._threads = ThreadPoolExecutor(self.max_concurrency, thread_name_prefix="cafa-stream")
+        return loop
+
+    def _free_slot(self, slot):
+        self._free_slots.append(slot)
+        self._semaphore.release()
+
+    def _free_when_done(self, loop, slot, future):
+        def finished(_):
+            # the slot is given back when the job has really stopped, so its flag is not reused before that
+            try:
+                loop.call_soon_threadsafe(self._free_slot, slot)
+            except RuntimeError:
+                pass
+
+        future.add_done_callback(finished)
+
+    async def _run(self, path, name):
+        loop = self._start()
+        await self._semaphore.acquire()
+        slot = self._free_slots.pop()
+        self._flags[slot] = 0
+        cancel_event = SlotEvent(slot, self._flags if self.executor == "thread" else None)
+        try:
+            future = self._pool.submit(validate_member, path, name, self.time_budget, cancel_event)
+        except BaseException:
+            self._free_slot(slot)
+            raise
+        self._free_when_done(loop, slot, future)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            if not future.done():
+                self._flags[slot] = 1
+            raise
+
+    async def iter_members(self, path):
+        """ Yields a MemberResult for every file of the submission at path, in archive order """
+        loop = self._start()
+        if os.path.isdir(path):
+            yield MemberResult(os.path.basename(os.path.normpath(path)), None, False, FOLDER_MESSAGE)
+            return
+        names = await loop.run_in_executor(self._threads, submission_members, path)
+        tasks = [asyncio.ensure_future(self._run(path, name)) for name in names]
+        try:
+            for task in tasks:
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def validate_stream(self, stream, fileName, kind=None):
+        """
+        Validates one prediction file read from stream as it arrives; returns its MemberResult.  The file name
+        is checked first, as for a file on disk: a name the filename grammar rejects fails without reading
+        the stream.
+        """
+        file_type, correct, errmsg = file_name_check(None, fileName, _accept, _accept)
+        if not correct:
+            return MemberResult(fileName, file_type, correct, errmsg)
+        loop = self._start()
+        await self._semaphore.acquire()
+        slot = self._free_slots.pop()
+        # the validator keeps its state in this process: with worker processes its pieces run on a thread
+        pool = self._pool if self.executor == "thread" else self._threads
+        validator = PushValidator(fileName, kind)
+        future = None
+        try:
+            async for chunk in _stream_chunks(stream):
+                future = pool.submit(validator.feed, chunk)
+                await asyncio.wrap_future(future)
+            future = pool.submit(validator.close)
+            correct, errmsg = await asyncio.wrap_future(future)
+        except InvalidRecordError as error:
+            correct, errmsg = False, error.errmsg
+        finally:
+            if future is None:
+                self._free_slot(slot)
+            else:
+                self._free_when_done(loop, slot, future)
+        return MemberResult(fileName, file_type, correct, errmsg)
+
+    async def validate(self, source, fileName=None, kind=None):
+        """
+        Validates a submission path, or a stream of the file fileName.  Returns (is_valid, results): the
+        verdict of cafa4_format_checker.cafa_checker and the MemberResult of every file.
+        """
+        if isinstance(source, (str, os.PathLike)):
+            results = [result async for result in self.iter_members(os.fspath(source))]
+        else:
+            if fileName is None:
+                raise ValueError("validating a stream needs its fileName")
+            results = [await self.validate_stream(source, fileName, kind)]
+        return submission_verdict(results), results
+
+    def close(self):
+        """ Stops the running jobs at their next check and shuts the pools down """
+        for slot in range(self.max_concurrency):
+            self._flags[slot] = 1
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._threads.shutdown(wait=False, cancel_futures=True)
+            self._pool = self._threads = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+_validator = None
+
+
+def get_validator():
+    """ The AsyncValidator shared by validate_async, started on first use """
+    global _validator
+    if _validator is None:
+        _validator = AsyncValidator()
+    return _validator
+
+
+async def validate_async(source, fileName=None, kind=None, validator=None):
+    """ AsyncValidator.validate with the shared validator (or validator) """
+    return await (validator or get_validator()).validate(source, fileName, kind)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Validate submissions concurrently, reporting each file as it finishes")
+    parser.add_argument("input_files", nargs="+", help="prediction files or zipped archives")
+    parser.add_argument("--workers", type=int, help="worker processes (default: number of CPUs)")
+    parser.add_argument("--threads", action="store_true",
+                        help="validate on threads (default: on a free-threaded Python build only)")
+    parser.add_argument("--time-budget", type=float, help="seconds allowed for each file")
+    args = parser.parse_args(argv)
+
+    async def run():
+        async with AsyncValidator(
+            args.workers, executor="thread" if args.threads else None, time_budget=args.time_budget
+        ) as validator:
+
+            async def one(path):
+                results = []
+                async for result in validator.iter_members(path):
+                    print("{}: {}: {}".format(path, result.filename, result.correct))
+                    if not result.correct:
+                        print(result.errmsg)
+                    results.append(result)
+                return submission_verdict(results)
+
+            return await asyncio.gather(*(one(path) for path in args.input_files))
+
+    verdicts = asyncio.run(run())
+    for path, is_valid in zip(args.input_files, verdicts):
+        print("{}: Is Valid: {}".format(path, is_valid))
+    return verdicts
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+import zipfile
+
+from cafa_go_format_checker import cafa_checker as go
+from cafa_hpo_format_checker import cafa_checker as hpo
+from cafa_do_format_checker import cafa_checker as do_checker
+from cafa_binding_site_format_checker import cafa_checker as bind
+
+"""
+Allocation benchmark for the per-line loop of the format checkers.
+
+A synthetic valid file of each kind is validated under tracemalloc.  Between handing one line to the
+checker and being asked for the next, the benchmark resets tracemalloc's peak, so for every line it sees
+how far memory rose above where it was while that line was checked: a lower bound of what checking the
+line allocated (objects reused from a free list do not count).  The report gives that per million lines,
+the largest rise on a single line, the memory the checker kept at the end and the time the checker
+takes without tracemalloc.
+
+On the happy path a valid line allocates almost nothing besides the scratch space of the one regular
+expression match that validates it, and nothing that grows with the length of the line.
+
+With --backends it compares the executors of cafa_executor instead: an archive of synthetic files is
+validated serially and with its members on a pool of threads and one of processes (a binding-site file:
+its target batches, with cafa_binding_parallel).  Threads only scale on a free-threaded Python build.
+"""
+
+CHECKERS = {"go": go, "hpo": hpo, "do": do_checker, "binding": bind}
+
+FILE_NAMES = {
+    "go": "bench_1_9606_go.txt",
+    "hpo": "bench_1_hpo.txt",
+    "do": "bench_1_do.txt",
+    "binding": "bench_1_9606_binding.txt",
+}
+
+HEADER = ["AUTHOR bench", "MODEL 1", "KEYWORDS sequence alignment, machine learning."]
+
+
+def synthetic_lines(kind, n_lines, residues=200):
+    """
+    Yields a valid prediction file of kind with about n_lines lines, as str lines with their newline;
+    residues is the length of the binding-site score rows.
+    """
+    for line in HEADER:
+        yield line + "\n"
+    if kind == "binding":
+        scores = ", ".join("0.%02d" % (residue % 100) for residue in range(residues))
+        written = 0
+        target = 0
+        while written < n_lines:
+            target += 1
+            yield ">T%08d\n" % target
+            for binding_type in ("DNA", "RNA", "METAL"):
+                yield binding_type + "\n"
+                yield scores + "\n"
+            written += 7
+    else:
+        prefix = {"go": "GO", "hpo": "HP", "do": "DO"}[kind]
+        for number in range(n_lines):
+            yield "T%08d\t%s:%07d\t0.%02d\n" % (number // 50, prefix, number % 50000 + 1, number % 100)
+    yield "END\n"
+
+
+class AllocationCounter(object):
+    """ Wraps the lines given to a checker and measures, under tracemalloc, what checking each one allocated """
+
+    def __init__(self):
+        self.lines = 0
+        self.allocated_bytes = 0
+        self.max_line_bytes = 0
+
+    def measured(self, lines):
+        get_traced_memory = tracemalloc.get_traced_memory
+        reset_peak = tracemalloc.reset_peak
+        for line in lines:
+            start = get_traced_memory()[0]
+            reset_peak()
+            yield line
+            rise = get_traced_memory()[1] - start
+            self.lines += 1
+            self.allocated_bytes += rise
+            if rise > self.max_line_bytes:
+                self.max_line_bytes = rise
+
+
+def measure(kind, n_lines=100000, checker=None, residues=200):
+    """
+    Validates a synthetic file of kind, once to time it and once under tracemalloc.  Returns a dict with
+    the number of lines, bytes allocated per million lines, the most allocated for one line, bytes kept
+    after validation and seconds (untraced).
+    """
+    if checker is None:
+        checker = CHECKERS[kind]
+    fileName = FILE_NAMES[kind]
+    lines = list(synthetic_lines(kind, n_lines, residues))
+
+    start = time.perf_counter()
+    correct, errmsg = checker(iter(lines), fileName)
+    seconds = time.perf_counter() - start
+    if not correct:
+        raise ValueError(errmsg)
+
+    counter = AllocationCounter()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        checker(counter.measured(lines), fileName)
+        retained = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    return {
+        "kind": kind,
+        "lines": counter.lines,
+        "bytes_per_million_lines": 1e6 * counter.allocated_bytes / counter.lines,
+        "max_line_bytes": counter.max_line_bytes,
+        "retained_bytes": retained,
+        "seconds": seconds,
+    }
+
+
+def _write_backend_input(directory, kind, n_files, n_lines):
+    """ An archive of n_files synthetic files of kind, or for binding sites one plain file of them all """
+    if kind == "binding":
+        path = os.path.join(directory, FILE_NAMES[kind])
+        with open(path, "w") as out_handle:
+            out_handle.writelines(synthetic_lines(kind, n_files * n_lines))
+        return path
+    path = os.path.join(directory, "bench.zip")
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for number in range(n_files):
+            # one GO file per taxon, as a team's model 1 for several species
+            archive.writestr("bench_1_%d.txt" % (9606 + number), "".join(synthetic_lines(kind, n_lines)))
+    return path
+
+
+def compare_backends(kind="go", n_files=8, n_lines=100000, workers=None, backends=("thread", "process")):
+    """
+    Validates n_files synthetic files of kind, "go" (an archive) or "binding" (one file of as many lines),
+    serially and with workers workers of each backend.  Returns a dict per run: backend ("serial" first), workers,
+    seconds, speedup over serial and the verdict, which is the same for every run.
+    """
+    from cafa4_format_checker import cafa_checker
+    from cafa_binding_parallel import cafa_checker as parallel_bind
+
+    if kind not in ("go", "binding"):
+        raise ValueError("backends are compared on go or binding files, not %r" % (kind,))
+    workers = workers or os.cpu_count() or 1
+    directory = tempfile.mkdtemp(prefix="cafa_bench")
+    try:
+        path = _write_backend_input(directory, kind, n_files, n_lines)
+
+        def run(backend):
+            start = time.perf_counter()
+            if kind == "binding":
+                # batches of a fraction of the file, so that every worker has some
+                batch_bytes = max(os.path.getsize(path) // (4 * workers), 64 * 1024)
+                valid = parallel_bind(path, workers=1 if backend is None else workers, batch_bytes=batch_bytes,
+                                      executor=backend)[0]
+            else:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    valid = cafa_checker(path, member_workers=None if backend is None else workers, executor=backend)
+            return valid, time.perf_counter() - start
+
+        results = []
+        valid, serial_seconds = run(None)
+        results.append({"backend": "serial", "workers": 1, "seconds": serial_seconds, "speedup": 1.0, "valid": valid})
+        for backend in backends:
+            valid, seconds = run(backend)
+            results.append({"backend": backend, "workers": workers, "seconds": seconds,
+                            "speedup": serial_seconds / seconds, "valid": valid})
+        return results
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Measure what the format checkers allocate per line")
+    parser.add_argument("--lines", type=int, default=100000, help="lines per synthetic file (default %(default)s)")
+    parser.add_argument("--kind", choices=sorted(CHECKERS), action="append",
+                        help="file kind to measure; repeat for several (default: all)")
+    parser.add_argument("--residues", type=int, default=200,
+                        help="length of the binding-site score rows (default %(default)s)")
+    parser.add_argument("--backends", action="store_true",
+                        help="compare serial, thread and process validation of --files files instead")
+    parser.add_argument("--files", type=int, default=8, help="files in the archive for --backends (default %(default)s)")
+    parser.add_argument("--workers", type=int, help="workers for --backends (default: number of CPUs)")
+    args = parser.parse_args(argv)
+
+    if args.backends:
+        from cafa_executor import free_threaded
+
+        print("free-threaded build: {}".format(free_threaded()))
+        print("{:<8} {:<8} {:>8} {:>10} {:>9} {:>8}".format("kind", "backend", "workers", "seconds", "speedup", "valid"))
+        results = []
+        for kind in [kind for kind in args.kind or ["go", "binding"] if kind in ("go", "binding")]:
+            for result in compare_backends(kind, args.files, args.lines, args.workers):
+                results.append(dict(result, kind=kind))
+                print("{:<8} {backend:<8} {workers:>8} {seconds:>10.2f} {speedup:>9.2f} {valid!s:>8}".format(
+                    kind, **result))
+        return results
+
+    print("{:<8} {:>10} {:>14} {:>10} {:>10} {:>9}".format(
+        "kind", "lines", "MB/1M lines", "max/line", "retained", "seconds"))
+    results = []
+    for kind in args.kind or sorted(CHECKERS):
+        result = measure(kind, args.lines, residues=args.residues)
+        results.append(result)
+        print("{kind:<8} {lines:>10,} {:>14,.1f} {max_line_bytes:>10,} {retained_bytes:>10,} {seconds:>9.2f}".format(
+            result["bytes_per_million_lines"] / 1e6, **result))
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import io
+import os
+from concurrent.futures import wait
+
+import cafa_binding_site_format_checker as binding_module
+from cafa_deadline import DeadlineExceeded
+from cafa_executor import make_executor
+
+"""
+Parallel validation of binding-site prediction files.
+
+The serial checker carries one current_prediction list from line to line, but it is reset by every valid
+">T..." target line: a target block (the target, its binding-site types and their per-residue score rows)
+only depends on the blocks before it through one condition, that the previous block ended with a score
+row.  So:
+    1. the file is indexed into batches of consecutive target blocks of about BATCH_BYTES: only the offset
+       of the first ">" line after every BATCH_BYTES is looked up, so indexing reads a few KB per batch
+    2. workers (processes, or threads on a free-threaded build: see cafa_executor) check the prediction
+       lines of each batch with binding_site_prediction_check, starting from an empty current_prediction.  A batch stops at its first error.  The record lines in it (AUTHOR, MODEL, END
+       ...), which change the checker's other state, are returned with their position rather than checked.
+    3. the results are merged in file order with the serial checker's own state (its CheckerState, see
+       cafa_sections): its step() takes the lines before the first target, the record lines and the first
+       target line of each batch, checked against the real current_prediction (the one condition above),
+       and the first error is reported by line number.  The order of the sections is checked at the end,
+       by the checker's finish().
+
+The result, (correct, errmsg), is the serial checker's for the same file.  Plain files only: a zip member has
+to be inflated in order anyway.
+"""
+
+BATCH_BYTES = 4 << 20
+
+# Read size when looking for the next target line at a batch boundary
+SCAN_BYTES = 64 * 1024
+
+# A file smaller than this is checked in the calling process
+MIN_PARALLEL_BYTES = 2 * BATCH_BYTES
+
+RECORD_WORDS = frozenset(("AUTHOR", "MODEL", "KEYWORDS", "ACCURACY", "END"))
+
+# How often a deadline is looked at while waiting for a batch
+DEADLINE_POLL_SECONDS = 0.1
+
+
+def _first_field(line):
+    # as in the serial checker: a score row is not split or copied to find its first field; None if blank
+    fields = line.lstrip()[:16].split(None, 1)
+    return fields[0] if fields else None
+
+
+def _next_target(in_handle, position):
+    """ Offset of the first line starting with ">" after position (at position too if it is 0), or None """
+    if position == 0:
+        in_handle.seek(0)
+        if in_handle.read(1) == b">":
+            return 0
+    in_handle.seek(position)
+    previous = b""
+    while True:
+        block = in_handle.read(SCAN_BYTES)
+        if not block:
+            return None
+        # with the last byte of the previous block, in case a newline and a ">" straddle the two
+        data = previous + block
+        found = data.find(b"\n>")
+        if found >= 0:
+            return position - len(previous) + found + 1
+        previous = block[-1:]
+        position += len(block)
+
+
+def target_batches(path, batch_bytes=BATCH_BYTES):
+    """
+    Indexes the target blocks of path in batches: (start, end) byte ranges of whole blocks, each about
+    batch_bytes long.  Only the offsets of the batch boundaries are looked up, so the file is not scanned here.
+    """
+    size = os.path.getsize(path)
+    ranges = []
+    with open(path, "rb") as in_handle:
+        start = _next_target(in_handle, 0)
+        while start is not None:
+            end = _next_target(in_handle, start + batch_bytes) if start + batch_bytes < size else None
+            ranges.append((start, size if end is None else end))
+            start = end
+    return ranges
+
+
+def _read_lines(path, start, end):
+    with open(path, "rb") as in_handle:
+        in_handle.seek(start)
+        data = in_handle.read(end - start)
+    # the same decoding and newline handling as iterating over open(path, "r")
+    return io.TextIOWrapper(io.BytesIO(data), newline=None)
+
+
+def check_batch(path, start, end, current_prediction=()):
+    """
+    Checks the prediction lines of path[start:end], which starts at a target line.  Returns (first_line,
+    n_lines, records, error, current_prediction): the record lines as (index in the batch, line), the first
+    error as (index, errmsg) or None, and current_prediction after the last line checked.
+    """
+    prediction_check = binding_module.binding_site_prediction_check
+    current_prediction = list(current_prediction)
+    records = []
+    first_line = None
+    index = -1
+    for index, line in enumerate(_read_lines(path, start, end)):
+        if index == 0:
+            first_line = line
+        field1 = _first_field(line)
+        if field1 is None or field1 in RECORD_WORDS:
+            records.append((index, line))
+            continue
+        correct, errmsg, current_prediction = prediction_check(line, current_prediction)
+        if not correct:
+            return first_line, index + 1, records, (index, errmsg), tuple(current_prediction)
+    return first_line, index + 1, records, None, tuple(current_prediction)
+
+
+class _Stop(Exception):
+    def __init__(self, result):
+        self.result = result
+
+
+def cafa_checker(path, fileName=None, workers=None, batch_bytes=BATCH_BYTES, executor=None, deadline=None,
+                 progress=None):
+    """
+    Validates a plain binding-site prediction file with its target blocks checked in parallel.  Returns
+    (correct, errmsg) as cafa_binding_site_format_checker.cafa_checker does for the same file.
+    workers: number of workers (default: number of CPUs); 1, or a small file, checks in-process.
+    executor: "thread" or "process" (default: cafa_executor.default_backend()).
+    deadline: optional cafa_deadline.Deadline, looked at between batches and while waiting for one.  If it
+    passes (or is cancelled) first, the batches not started are dropped and DeadlineExceeded is raised with
+    the lines merged so far.
+    progress: optional cafa_progress.WorkerProgress, updated as the batches are merged.
+    """
+    if fileName is None:
+        fileName = os.path.basename(path)
+    size = os.path.getsize(path)
+    ranges = target_batches(path, batch_bytes)
+    state = binding_module.CheckerState(fileName)
+    line_num = 0
+    try:
+        for inline in _read_lines(path, 0, ranges[0][0] if ranges else size):
+            line_num += 1
+            _step(state, inline, line_num)
+        if progress is not None:
+            progress.update(ranges[0][0] if ranges else size, line_num)
+        if len(ranges) < 2 or size < MIN_PARALLEL_BYTES or workers == 1:
+            for start, end in ranges:
+                _check_deadline(deadline, state, line_num)
+                line_num = _merge(state, line_num, path, start, end, check_batch(path, start, end))
+                if progress is not None:
+                    progress.update(end, line_num)
+        else:
+            pool = make_executor(workers, executor, thread_name_prefix="cafa-binding")
+            finished = False
+            try:
+                futures = [pool.submit(check_batch, path, start, end) for start, end in ranges]
+                for (start, end), future in zip(ranges, futures):
+                    _check_deadline(deadline, state, line_num)
+                    while deadline is not None and not wait((future,), DEADLINE_POLL_SECONDS).done:
+                        _check_deadline(deadline, state, line_num)
+                    line_num = _merge(state, line_num, path, start, end, future.result())
+                    if progress is not None:
+                        progress.update(end, line_num)
+                finished = True
+            finally:
+                # the batches not started are dropped; after an error or the deadline, the running ones are not
+                # waited for
+                pool.shutdown(wait=finished, cancel_futures=True)
+    except _Stop as stopped:
+        return stopped.result
+    return state.finish()
+
+
+def _check_deadline(deadline, state, line_num):
+    if deadline is not None and deadline.reason() is not None:
+        raise DeadlineExceeded(deadline.partial(state.fileName, line_num, state.visited_states))
+
+
+def _step(state, inline, line_num):
+    error = state.step(inline, line_num)
+    if error is not None:
+        raise _Stop(error)
+
+
+def _merge(state, line_num, path, start, end, result):
+    """
+    Advances state, the serial checker's CheckerState, over a batch checked by check_batch that starts after
+    line line_num.  Returns the number of the batch's last line; a checker error raises _Stop.
+    """
+    first_line, n_lines, records, error, current_prediction = result
+    if error is not None and error[0] == 0:
+        # the batch's target line failed from an empty current_prediction: check the batch line by line from
+        # the real one instead (a ">" line that is not a valid target fails either way, so this is a safeguard)
+        for inline in _read_lines(path, start, end):
+            line_num += 1
+            _step(state, inline, line_num)
+        return line_num
+    # the one thing a batch depends on: whether the target line may follow the lines before it
+    _step(state, first_line, line_num + 1)
+    for index, inline in records:
+        if error is not None and index > error[0]:
+            break
+        _step(state, inline, line_num + index + 1)
+    if error is not None:
+        raise _Stop(binding_module.handle_error(False, error[1], None, line_num + error[0] + 1, state.fileName))
+    state.current_prediction = list(current_prediction)
+    return line_num + n_lines
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Validate a binding-site prediction file in parallel")
+    parser.add_argument("input_file", help="path to the (uncompressed) binding-site prediction file")
+    parser.add_argument("--workers", type=int, help="number of workers (default: number of CPUs)")
+    parser.add_argument("--executor", choices=("thread", "process"),
+                        help="threads or processes (default: threads on a free-threaded Python build)")
+    args = parser.parse_args(argv)
+
+    correct, errmsg = cafa_checker(args.input_file, workers=args.workers, executor=args.executor)
+    print("Is Valid: {}".format(correct))
+    print("Message: {}".format(errmsg))
+    return correct
+
+
+if __name__ == "__main__":
+    main()
@@ -15,33 +15,25 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import re
 import sys
-pr_field = re.compile("^PR=[0,1]\.[0-9][0-9];$")
-rc_field = re.compile("^RC=[0,1]\.[0-9][0-9]$")
+
+from cafa_ruleset import load_ruleset
+from cafa_sections import SectionState
+
+# The CAFA 4 rules (ID grammars, keywords, section orders, score format) are declared in rulesets/cafa4.json
+RULES = load_ruleset("cafa4")
+
+pr_field = RULES.pr_field
+rc_field = RULES.rc_field
 # Fix to add EFI and HP
-target_field = re.compile("^>(T|EFI)[0-9]{5,20}$")
-type_field = re.compile("^[DNA,RNA,METAL]")
-prediction_field = re.compile("^[0,1]\.[0-9][0-9]")
-#target_field = re.compile("^T[0-9]{5,20}$")
-confidence_field = re.compile("^[0,1]\.[0-9][0-9]$")
+target_field = RULES.target_field("binding")
+type_field = RULES.field("binding", "binding_type")
+prediction_field = RULES.score_prefix_field
+confidence_field = RULES.confidence_field
 
-# Legal states: the CAFA prediction records fields, and their order. KEYWORDS and ACCURACY are
-# optional
-legal_states1 = ["author","model","keywords","accuracy","binding_site","end"]
-legal_states2 = ["author","model","keywords","binding_site","end"]
-legal_states3 = ["author","model","binding_site","end"]
+# The legal section orders (KEYWORDS and ACCURACY are optional) and the MODEL and ACCURACY limits are
+# RULES', applied line by line by cafa_sections.SectionState
 
-legal_keywords = [
-"sequence alignment", "sequence-profile alignment", "profile-profile alignment", "phylogeny",
-"sequence properties",
-"physicochemical properties", "predicted properties", "protein interactions", "gene expression",
-"mass spectrometry",
-"genetic interactions", "protein structure", "literature", "genomic context", "synteny", 
-"structure alignment",
-"comparative model", "predicted protein structure", "de novo prediction", "machine learning", 
-"genome environment", 
-"operon", "ortholog", "paralog", "homolog", "hidden Markov model", "clinical data", "genetic data", 
-"natural language processing", "other functional information"
-]
+legal_keywords = RULES.keywords
     
 """
 A collection of modules to check the format of the different records in the CAFA prediction file
@@ -54,7 +46,7 @@ The "correct" and "errmsg" variables then should be passed to the "handle_error"
 def author_check(inrec):
     correct = True
     errmsg = None
-    fields = [i.strip() for i in inrec.split()]
+    fields = inrec.split()
     if len(fields) != 2:
         correct = False
         errmsg = "AUTHOR: invalid number of fields. Should be 2"
@@ -66,7 +58,7 @@ def author_check(inrec):
 def model_check(inrec):
     correct = True
     errmsg = None
-    fields = [i.strip() for i in inrec.split()]
+    fields = inrec.split()
     if len(fields) != 2:
         correct = False
         errmsg = "MODEL: invalid number of fields. Should be 2"
@@ -99,7 +91,7 @@ def keywords_check(inrec):
 def accuracy_check(inrec):
     correct = True
     errmsg = None
-    fields = [i.strip() for i in inrec.split()]
+    fields = inrec.split()
     if len(fields) != 4:
         correct = False
         errmsg = "ACCURACY: error in number of fields. Should be 4"
@@ -121,30 +113,33 @@ def accuracy_check(inrec):
 def binding_site_prediction_check(inrec, current_prediction):
     correct = True
     errmsg = None
-    fields = [i.strip() for i in inrec.split(",")]
-    if target_field.match(fields[0]) and (len(current_prediction) == 0 or prediction_field.match(current_prediction[-1])):
+    # only the first comma separated field decides the kind of line; score rows can be very long, so
+    # the rest is not split (or copied)
+    comma = inrec.find(",")
+    field1 = (inrec if comma < 0 else inrec[:comma]).strip()
+    if target_field.match(field1) and (len(current_prediction) == 0 or prediction_field.match(current_prediction[-1])):
         current_prediction = []
-        current_prediction.append(fields[0])
+        current_prediction.append(field1)
         correct = True
-    elif len(current_prediction) == 0 and not target_field.match(fields[0]):
+    elif len(current_prediction) == 0 and not target_field.match(field1):
         correct = False
         errmsg = "The first line of predictions must be a target ID"
-    elif type_field.match(fields[0]) and (target_field.match(current_prediction[-1]) or prediction_field.match(current_prediction[-1])) and (fields[0] not in current_prediction):
-        current_prediction.append(fields[0])
+    elif type_field.match(field1) and (target_field.match(current_prediction[-1]) or prediction_field.match(current_prediction[-1])) and (field1 not in current_prediction):
+        current_prediction.append(field1)
         correct = True
-    elif prediction_field.match(fields[0]) and type_field.match(current_prediction[-1]):
-        current_prediction.append(fields[0])
+    elif prediction_field.match(field1) and type_field.match(current_prediction[-1]):
+        current_prediction.append(field1)
         correct = True
-    elif target_field.match(fields[0]) and (len(current_prediction) != 0 and not prediction_field.match(current_prediction[-1])):
+    elif target_field.match(field1) and (len(current_prediction) != 0 and not prediction_field.match(current_prediction[-1])):
         correct = False
         errmsg = "Binding site prediction must follow this format\nexample:\n>T123456\n{RNA, DNA, METAL}\n0.00, 0.01, 0.51, 0.81, 0.50"
-    elif type_field.match(fields[0]) and (type_field.match(current_prediction[-1])):
+    elif type_field.match(field1) and (type_field.match(current_prediction[-1])):
         correct = False
         errmsg = "Binding site type specification must be followed by a protein sequence prediction set\nexample:\n{RNA, DNA, METAL}\n0.00, 0.01, 0.51, 0.81, 0.50"
-    elif type_field.match(fields[0]) and (fields[0] in current_prediction):
+    elif type_field.match(field1) and (field1 in current_prediction):
         correct = False
         errmsg = "Only one prediction for each binding site type allowed per target"
-    elif prediction_field.match(fields[0]) and not type_field.match(current_prediction[-1]):
+    elif prediction_field.match(field1) and not type_field.match(current_prediction[-1]):
         correct = False
         errmsg = "Protein sequence predictions must be after a binding site type specification\nexample:\n{RNA, DNA, METAL}\n0.00, 0.01, 0.51, 0.81, 0.50"
     else:
@@ -155,7 +150,7 @@ def binding_site_prediction_check(inrec, current_prediction):
 def end_check(inrec):
     correct = True
     errmsg = None
-    fields = [i.strip() for i in inrec.split()]
+    fields = inrec.split()
     if len(fields) != 1:
         correct = False
         errmsg = "END: wrong number of fields. Should be 1"
@@ -176,108 +171,63 @@ def handle_error(correct, errmsg, inrec, line_num, fileName):
     else:
         return True, None
 
+class CheckerState(SectionState):
+    """
+    What cafa_checker carries from one line of a file to the next (see cafa_sections.SectionState), with
+    the target and binding type the score rows being read belong to
+    """
+
+    prediction_state = "binding_site"
+
+    def __init__(self, fileName, checks=None, rules=None):
+        SectionState.__init__(self, fileName, checks, rules)
+        self.current_prediction = []
+
+    def state(self):
+        return SectionState.state(self) + (tuple(self.current_prediction),)
+
+    def restore(self, state):
+        SectionState.restore(self, state[:-1])
+        self.current_prediction = list(state[-1])
+
+    def check_prediction(self, inrec):
+        correct, errmsg, self.current_prediction = binding_site_prediction_check(inrec, self.current_prediction)
+        return correct, errmsg
+
+    def finish(self):
+        if not self.order_ok():
+            errmsg = "Error in " + self.fileName + "\n"
+            errmsg += "Sections found in the file: [" + ", ".join(self.visited_states) + "]\n"
+            errmsg += "file not formatted according to CAFA 4 specs\n"
+            errmsg += "Check whether all these record types are in your file in the correct order\n"
+            errmsg += "AUTHOR, MODEL, KEYWORDS, ACCURACY (optional), predictions, END"
+            return False, errmsg
+        else:
+            return True, "%s, passed the CAFA 4 binding site format checker" % self.fileName
+
+
 def cafa_checker(infile, fileName):
     """
     Main program that: 1. identifies fields; 2. Calls the proper checker function; 3. calls the
     error handler "handle_error" which builds the error report.  If correct is False, the function returns correct, errmsg
     to the file_name_check function in cafa3_format_checker.
     """
-    visited_states = []
-    s_token = 0
-    n_accuracy = 0
-    first_prediction = True
-    first_accuracy = True
-    first_keywords = True
-    current_line = ""
-    previous_line = ""
-    current_prediction = []
-    n_models = 0
+    state = CheckerState(fileName)
+    step = state.step
     line_num = 0
     for inline in infile:
         line_num += 1
-        inrec = [i.strip() for i in inline.split()]
-        field1 = inrec[0]
-        # Check which field type (state) we are in
-        if field1 == "AUTHOR":
-            state = "author"
-        elif field1 == "MODEL":
-            state = "model"
-        elif field1 == "KEYWORDS":
-            state = "keywords"
-        elif field1 == "ACCURACY":
-            state = "accuracy"
-        elif field1 == "END":
-            state = "end"
-        else: #default to prediction state
-            state = "binding_site"
-#        print "****"
-#        print "FIELD1", field1
-#        print inline, state
-        # Check for errors according to state
-        if state == "author":
-            correct,errmsg = author_check(inline)
-            correct, errmsg = handle_error(correct, errmsg, inline, line_num, fileName)
-            if not correct:
-                return correct, errmsg
-            visited_states.append(state)
-        elif state == "model":
-            n_models += 1
-            n_accuracy = 0
-            if n_models > 3:
-                return False, "Too many models. Only up to 3 allowed"
-            correct,errmsg = model_check(inline)
-            correct, errmsg = handle_error(correct, errmsg, inline, line_num, fileName)
-            if not correct:
-                return correct, errmsg
-            if n_models == 1:
-                visited_states.append(state)
-        elif state == "keywords":
-            if first_keywords:
-                visited_states.append(state)
-                first_keywords = False
-            correct, errmsg = keywords_check(inline)
-            correct, errmsg = handle_error(correct, errmsg, inline, line_num, fileName)
-            if not correct:
-                return correct, errmsg
-        elif state == "accuracy":
-            if first_accuracy:
-                visited_states.append(state)
-                first_accuracy = False
-            n_accuracy += 1
-            if n_accuracy > 3:
-                correct, errmsg = handle_error(False, "ACCURACY: too many ACCURACY records", inline, line_num, fileName)
-                if not correct:
-                    return correct, errmsg
-            else:
-                correct, errmsg = accuracy_check(inline)
-                if not correct:
-                    return correct, errmsg
-                
-        elif state == "binding_site":
-            correct, errmsg, current_prediction = binding_site_prediction_check(inline, current_prediction)
-            correct, errmsg = handle_error(correct, errmsg, inline, line_num, fileName)
-            if not correct:
-                return correct, errmsg
-            if first_prediction:
-                visited_states.append(state)
-                first_prediction = False
-        elif state == "end":
-            correct, errmsg = end_check(inline)
-            correct, errmsg = handle_error(correct, errmsg, inline, line_num, fileName)
-            if not correct:
-                return correct, errmsg
-            visited_states.append(state)
-    # End file forloop
-    if (visited_states != legal_states1 and
-        visited_states != legal_states2 and
-        visited_states != legal_states3):
-        errmsg = "Error in " + fileName + "\n"
-        errmsg += "Sections found in the file: [" + ", ".join(visited_states) + "]\n"
-        errmsg += "file not formatted according to CAFA 4 specs\n"
-        errmsg += "Check whether all these record types are in your file in the correct order\n"
-        errmsg += "AUTHOR, MODEL, KEYWORDS, ACCURACY (optional), predictions, END"
-        return False, errmsg
-    else:
-        return True, "%s, passed the CAFA 4 binding site format checker" % fileName
+        error = step(inline, line_num)
+        if error is not None:
+            return error
+    return state.finish()
+
+
+def main():
+    from cafa_profiler import single_file_main
+
+    single_file_main(cafa_checker)
 
 
+if __name__ == "__main__":
+    main()
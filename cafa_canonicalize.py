@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import heapq
+import io
+import os
+import shutil
+import tempfile
+import zipfile
+
+from cafa4_format_checker import prediction_kind
+from cafa_go_format_checker import cafa_checker as go
+from cafa_hpo_format_checker import cafa_checker as hpo
+from cafa_do_format_checker import cafa_checker as do_checker
+
+"""
+canonicalize: validate a GO / HPO / DO prediction file and write it sorted and normalized.
+
+While the regular cafa_checker validates the file, the prediction lines going by are collected into
+sorted runs of at most memory_budget bytes, which are spilled to temporary files.  The runs are then
+merged (in several passes if there are more than MERGE_FAN_IN of them) into one output file per MODEL:
+    AUTHOR, MODEL n, the KEYWORDS and ACCURACY records of that model, predictions sorted by target then
+    term, END
+with fields separated by single tabs.  Output files are named with the filename grammar, i.e. the model
+field of team_model_taxon.txt is set to the model number.  Nothing is written if validation fails.
+"""
+
+CHECKERS = {"go": go, "hpo": hpo, "do": do_checker}
+
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+
+# Approximate per-record overhead of a str in a Python list, for the memory budget
+RECORD_OVERHEAD = 80
+
+# Maximum number of runs merged at once
+MERGE_FAN_IN = 64
+
+IO_BUFFER = 1 << 20
+
+
+class CanonicalizeError(Exception):
+    pass
+
+
+class ExternalSorter(object):
+    """ Sorts lines (str ending in "\\n") with a memory budget, spilling sorted runs to tmp_dir """
+
+    def __init__(self, tmp_dir, memory_budget=DEFAULT_MEMORY_BUDGET):
+        self.tmp_dir = tmp_dir
+        self.memory_budget = memory_budget
+        self.runs = []
+        self._buffer = []
+        self._buffered_bytes = 0
+
+    def add(self, record):
+        self._buffer.append(record)
+        self._buffered_bytes += len(record) + RECORD_OVERHEAD
+        if self._buffered_bytes >= self.memory_budget:
+            self._spill()
+
+    def _spill(self):
+        if not self._buffer:
+            return
+        self._buffer.sort()
+        self.runs.append(self._write_run(self._buffer))
+        self._buffer = []
+        self._buffered_bytes = 0
+
+    def _write_run(self, records):
+        handle, path = tempfile.mkstemp(dir=self.tmp_dir, prefix="run", suffix=".txt")
+        with io.open(handle, "w", buffering=IO_BUFFER) as run_handle:
+            run_handle.writelines(records)
+        return path
+
+    def sorted_records(self):
+        """ Yields all records in order; the in-memory buffer is used directly if nothing was spilled """
+        if not self.runs:
+            self._buffer.sort()
+            for record in self._buffer:
+                yield record
+            return
+        self._spill()
+        runs = self.runs
+        while len(runs) > MERGE_FAN_IN:
+            merged = []
+            for start in range(0, len(runs), MERGE_FAN_IN):
+                group = runs[start:start + MERGE_FAN_IN]
+                handles = [io.open(path, "r", buffering=IO_BUFFER) for path in group]
+                try:
+                    merged.append(self._write_run(heapq.merge(*handles)))
+                finally:
+                    for handle in handles:
+                        handle.close()
+                for path in group:
+                    os.unlink(path)
+            runs = merged
+        self.runs = runs
+        handles = [io.open(path, "r", buffering=IO_BUFFER) for path in runs]
+        try:
+            for record in heapq.merge(*handles):
+                yield record
+        finally:
+            for handle in handles:
+                handle.close()
+
+
+class Canonicalizer(object):
+    """ Collects header records and prediction lines from a file while it is being validated """
+
+    def __init__(self, sorter):
+        self.sorter = sorter
+        self.author = None
+        # model number -> list of normalized KEYWORDS / ACCURACY records, in file order
+        self.model_headers = {}
+        self._model = None
+
+    def track(self, lines):
+        for line in lines:
+            self.add_line(line)
+            yield line
+
+    def add_line(self, line):
+        fields = line.split()
+        if not fields:
+            return
+        field1 = fields[0]
+        if field1 == "AUTHOR":
+            self.author = "\t".join(fields)
+        elif field1 == "MODEL":
+            self._model = fields[1] if len(fields) > 1 else ""
+            self.model_headers.setdefault(self._model, [])
+        elif field1 == "KEYWORDS":
+            # keywords are a comma separated list that may contain spaces; keep them, squeeze whitespace
+            self.model_headers.setdefault(self._model, []).append(" ".join(fields))
+        elif field1 == "ACCURACY":
+            self.model_headers.setdefault(self._model, []).append("\t".join(fields))
+        elif field1 != "END" and len(fields) == 3:
+            self.sorter.add("{}\t{}\t{}\t{}\n".format(self._model, fields[0], fields[1], fields[2]))
+
+
+def output_name(fileName, model):
+    """ team_1_9606.txt, model "2" -> team_2_9606.txt (tc_team_1_9606.txt -> tc_team_2_9606.txt) """
+    stem, dot, extension = fileName.partition(".")
+    features = stem.split("_")
+    model_index = 2 if features[0].lower() == "tc" else 1
+    if len(features) > model_index:
+        features[model_index] = model
+    else:
+        features.append(model)
+    return "_".join(features) + ".txt"
+
+
+def canonicalize_lines(lines, fileName, out_dir, memory_budget=DEFAULT_MEMORY_BUDGET, tmp_dir=None):
+    """
+    Validates and canonicalizes one prediction file given as an iterable of str lines.
+    Returns the list of written paths; raises CanonicalizeError if validation fails.
+    """
+    kind = prediction_kind(fileName)
+    if kind not in CHECKERS:
+        raise CanonicalizeError("Error in {}\nOnly GO, HPO and DO prediction files can be canonicalized".format(fileName))
+    work_dir = tempfile.mkdtemp(prefix="cafa_canonicalize", dir=tmp_dir)
+    try:
+        sorter = ExternalSorter(work_dir, memory_budget)
+        canonicalizer = Canonicalizer(sorter)
+        correct, errmsg = CHECKERS[kind](canonicalizer.track(lines), fileName)
+        if not correct:
+            raise CanonicalizeError(errmsg)
+        return _write_outputs(canonicalizer, sorter, fileName, out_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _write_outputs(canonicalizer, sorter, fileName, out_dir):
+    os.makedirs(out_dir, exist_ok=True)
+    written = []
+    out_handle = None
+    current_model = None
+    try:
+        for record in sorter.sorted_records():
+            model, prediction = record.split("\t", 1)
+            if model != current_model:
+                if out_handle is not None:
+                    out_handle.write("END\n")
+                    out_handle.close()
+                current_model = model
+                path = os.path.join(out_dir, output_name(fileName, model))
+                out_handle = io.open(path, "w", buffering=IO_BUFFER)
+                written.append(path)
+                out_handle.write(canonicalizer.author + "\n")
+                out_handle.write("MODEL\t{}\n".format(model))
+                for header in canonicalizer.model_headers.get(model, []):
+                    out_handle.write(header + "\n")
+            out_handle.write(prediction)
+        if out_handle is not None:
+            out_handle.write("END\n")
+    finally:
+        if out_handle is not None:
+            out_handle.close()
+    return written
+
+
+def canonicalize(input_file, out_dir, memory_budget=DEFAULT_MEMORY_BUDGET, tmp_dir=None):
+    """ Canonicalizes a plain prediction file or every prediction file of a zip archive """
+    written = []
+    if zipfile.is_zipfile(input_file):
+        with zipfile.ZipFile(input_file, "r") as files:
+            for name in files.namelist():
+                if "__MACOSX" in name or name.endswith("/") or name.endswith(".DS_Store"):
+                    continue
+                with files.open(name) as member:
+                    lines = io.TextIOWrapper(member, encoding="utf-8", errors="replace")
+                    written.extend(canonicalize_lines(lines, name.split("/")[-1], out_dir, memory_budget, tmp_dir))
+    else:
+        with io.open(input_file, "r", buffering=IO_BUFFER) as lines:
+            written.extend(
+                canonicalize_lines(lines, os.path.basename(input_file), out_dir, memory_budget, tmp_dir)
+            )
+    return written
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Validate prediction files and write them sorted by target and term")
+    parser.add_argument("input_file", help="path to the prediction file or zipped archive")
+    parser.add_argument("out_dir", help="directory for the canonical files, one per MODEL")
+    parser.add_argument("--memory-mb", type=int, default=DEFAULT_MEMORY_BUDGET // (1024 * 1024),
+                        help="memory budget for sorting, in MB (default %(default)s)")
+    parser.add_argument("--tmp-dir", help="where sorted runs are spilled (default: system temp directory)")
+    args = parser.parse_args(argv)
+
+    try:
+        written = canonicalize(args.input_file, args.out_dir, args.memory_mb * 1024 * 1024, args.tmp_dir)
+    except CanonicalizeError as error:
+        print(error)
+        return False
+    for path in written:
+        print("Wrote {}".format(path))
+    return True
+
+
+if __name__ == "__main__":
+    main()
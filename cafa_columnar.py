@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import json
+import os
+import shutil
+import sys
+from array import array
+
+"""
+Columnar binary export of validated GO / HPO / DO predictions.
+
+ColumnarWriter.track() wraps the lines handed to a checker and appends every prediction line to four
+columns as the file streams by:
+    model.npy   uint8   MODEL number of the section the prediction is in
+    target.npy  uint32  index into targets.txt
+    term.npy    uint32  index into terms.txt
+    score.npy   uint8   confidence in hundredths (confidence_field fixes two decimals, so this is exact)
+Columns are buffered in typed arrays and appended to the .npy files in blocks; the .npy headers are
+rewritten with the final row count on close().  The files are written without numpy, and numpy.load(...,
+mmap_mode="r") maps them without parsing anything.  Parquet output needs pyarrow and is produced from the
+finished columns.
+
+The writer is a step ahead of validation: if the checker rejects the file, call abort() and the partial
+output is removed.
+"""
+
+COLUMNS = (("model", "B", "|u1"), ("target", "I", "<u4"), ("term", "I", "<u4"), ("score", "B", "|u1"))
+
+# Rows buffered in memory before the columns are appended to disk
+BLOCK_ROWS = 1 << 16
+
+# Fixed size of the .npy header, so it can be rewritten in place once the row count is known
+NPY_HEADER_BYTES = 128
+
+SECTION_WORDS = (b"AUTHOR", b"MODEL", b"KEYWORDS", b"ACCURACY", b"END")
+
+
+def npy_header(descr, rows):
+    """ A version 1.0 .npy header for a 1-d array, padded to NPY_HEADER_BYTES """
+    header = "{{'descr': '{}', 'fortran_order': False, 'shape': ({},), }}".format(descr, rows)
+    padding = NPY_HEADER_BYTES - 10 - len(header) - 1
+    header = header + " " * padding + "\n"
+    return b"\x93NUMPY\x01\x00" + len(header).to_bytes(2, "little") + header.encode("latin1")
+
+
+class ColumnarWriter(object):
+    """
+    out_dir: directory the columns, dictionaries and manifest.json are written to (created if needed)
+    """
+
+    def __init__(self, out_dir, filename=None):
+        self.out_dir = out_dir
+        self.filename = filename
+        os.makedirs(out_dir, exist_ok=True)
+        self.rows = 0
+        self.target_ids = {}
+        self.term_ids = {}
+        self._model = 1
+        self._buffers = dict((name, array(code)) for name, code, descr in COLUMNS)
+        self._handles = {}
+        for name, code, descr in COLUMNS:
+            handle = open(os.path.join(out_dir, name + ".npy"), "wb")
+            handle.write(npy_header(descr, 0))
+            self._handles[name] = handle
+        self.closed = False
+
+    def track(self, lines):
+        """ Yields the lines unchanged while appending the prediction lines to the columns """
+        add_line = self.add_line
+        for line in lines:
+            add_line(line)
+            yield line
+
+    def add_line(self, line):
+        if isinstance(line, str):
+            line = line.encode("utf-8")
+        fields = line.split()
+        if len(fields) != 3:
+            if len(fields) == 2 and fields[0] == b"MODEL" and fields[1].isdigit():
+                self._model = int(fields[1])
+            return
+        if fields[0] in SECTION_WORDS:
+            return
+        self.add_prediction(fields[0], fields[1], fields[2])
+
+    def add_prediction(self, target, term, score):
+        """ target, term: bytes; score: validated b"d.dd" """
+        target_id = self.target_ids.get(target)
+        if target_id is None:
+            target_id = self.target_ids[target] = len(self.target_ids)
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            term_id = self.term_ids[term] = len(self.term_ids)
+        buffers = self._buffers
+        buffers["model"].append(self._model)
+        buffers["target"].append(target_id)
+        buffers["term"].append(term_id)
+        if len(score) == 4 and score[1:2] == b".":
+            buffers["score"].append((score[0] - 48) * 100 + (score[2] - 48) * 10 + score[3] - 48)
+        else:
+            # not a validated score; the checker will reject the file and abort() will discard the output
+            buffers["score"].append(0)
+        self.rows += 1
+        if len(buffers["score"]) >= BLOCK_ROWS:
+            self._flush()
+
+    def _flush(self):
+        for name, code, descr in COLUMNS:
+            buffer = self._buffers[name]
+            if sys.byteorder != "little" and buffer.itemsize > 1:
+                buffer.byteswap()
+            buffer.tofile(self._handles[name])
+            self._buffers[name] = array(code)
+
+    def close(self, fmt="npy"):
+        """ Finishes the columns and writes the dictionaries and manifest.  fmt: "npy" or "parquet" """
+        if self.closed:
+            return
+        self._flush()
+        for name, code, descr in COLUMNS:
+            handle = self._handles[name]
+            handle.seek(0)
+            handle.write(npy_header(descr, self.rows))
+            handle.close()
+        for name, ids in (("targets", self.target_ids), ("terms", self.term_ids)):
+            with open(os.path.join(self.out_dir, name + ".txt"), "wb") as out_handle:
+                # dict order is insertion order, i.e. ID order
+                for value in ids:
+                    out_handle.write(value + b"\n")
+        manifest = {
+            "source": self.filename,
+            "rows": self.rows,
+            "columns": dict((name, descr) for name, code, descr in COLUMNS),
+            "score_scale": 100,
+            "targets": len(self.target_ids),
+            "terms": len(self.term_ids),
+        }
+        with open(os.path.join(self.out_dir, "manifest.json"), "w") as out_handle:
+            json.dump(manifest, out_handle, indent=2)
+        self.closed = True
+        if fmt == "parquet":
+            write_parquet(self.out_dir)
+
+    def abort(self):
+        """ Discards the output of a file that failed validation """
+        for handle in self._handles.values():
+            handle.close()
+        self.closed = True
+        shutil.rmtree(self.out_dir, ignore_errors=True)
+
+
+def load_columns(out_dir, mmap=True):
+    """
+    Loads an exported submission with numpy.  Returns (columns, targets, terms): columns maps a column
+    name to an array (memory-mapped when mmap is True); targets and terms are lists indexed by ID.
+    """
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("numpy is required to load columnar exports (pip install numpy)")
+    columns = {}
+    for name, code, descr in COLUMNS:
+        columns[name] = numpy.load(os.path.join(out_dir, name + ".npy"), mmap_mode="r" if mmap else None)
+    dictionaries = []
+    for name in ("targets", "terms"):
+        with open(os.path.join(out_dir, name + ".txt")) as in_handle:
+            dictionaries.append(in_handle.read().split())
+    return columns, dictionaries[0], dictionaries[1]
+
+
+def write_parquet(out_dir):
+    """ Writes predictions.parquet next to the .npy columns, with target and term as dictionary columns """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("pyarrow is required for Parquet output (pip install pyarrow)")
+    columns, targets, terms = load_columns(out_dir)
+    table = pyarrow.table(
+        {
+            "model": columns["model"],
+            "target": pyarrow.DictionaryArray.from_arrays(columns["target"], pyarrow.array(targets)),
+            "term": pyarrow.DictionaryArray.from_arrays(columns["term"], pyarrow.array(terms)),
+            "score": columns["score"],
+        }
+    )
+    pyarrow.parquet.write_table(table, os.path.join(out_dir, "predictions.parquet"))
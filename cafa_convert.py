@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import gzip
+import io
+import os
+import zipfile
+
+from cafa4_format_checker import prediction_kind
+from cafa_canonicalize import CHECKERS, IO_BUFFER, output_name
+from cafa_go_format_checker import RULES
+from cafa_stats import SECTION_WORDS
+
+"""
+convert: validate a GO / HPO / DO prediction file and convert it to or from the header-less TSV layout
+(target<TAB>term<TAB>score, one prediction per line) in the same pass.
+
+to_tsv() validates a CAFA 4 file (or every file of a zip) with the regular cafa_checker while a TSVExporter
+writes the prediction lines going by to one TSV file per MODEL, named with the filename grammar like
+cafa_canonicalize's outputs (team_2_9606.tsv for MODEL 2 of team_1_9606.txt).  from_tsv() does the
+reverse: it wraps the TSV lines in the AUTHOR, MODEL, KEYWORDS and END records and validates the CAFA 4
+file it writes.  Scores are written with the precision of the ruleset.
+
+Both stream: lines are written through IO_BUFFER sized buffers as they are validated, so memory does not
+grow with the file.  Outputs are written under a .part name and renamed when validation succeeds; nothing
+is left behind if it fails.  TSV files may be compressed with gzip (.gz) or zstd (.zst, with the zstandard
+package); from_tsv() reads them by their extension.
+"""
+
+COMPRESSIONS = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+# gzip's own default; level 9 costs several times the time for a few percent
+GZIP_LEVEL = 6
+
+ZSTD_LEVEL = 3
+
+PART_SUFFIX = ".part"
+
+
+class ConvertError(Exception):
+    pass
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstandard is required for zstd compression (pip install zstandard)")
+    return zstandard
+
+
+def compression_of(path):
+    """ The compression of a TSV file by its extension: "gzip", "zstd" or None """
+    for compression, suffix in COMPRESSIONS.items():
+        if suffix and path.endswith(suffix):
+            return compression
+    return None
+
+
+def open_output(path, compression=None):
+    """ A buffered text file writing to path, compressed with compression (None, "gzip" or "zstd") """
+    if compression is None:
+        return io.open(path, "w", buffering=IO_BUFFER, encoding="utf-8")
+    if compression == "gzip":
+        raw = gzip.open(path, "wb", compresslevel=GZIP_LEVEL)
+    elif compression == "zstd":
+        zstandard = _zstandard()
+        raw = zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(io.open(path, "wb"), closefd=True)
+    else:
+        raise ValueError("compression must be one of gzip, zstd or None, not {!r}".format(compression))
+    return io.TextIOWrapper(io.BufferedWriter(raw, IO_BUFFER), encoding="utf-8")
+
+
+def open_input(path):
+    """ A buffered text file reading path, decompressed according to its extension """
+    compression = compression_of(path)
+    if compression is None:
+        return io.open(path, "r", buffering=IO_BUFFER, encoding="utf-8", errors="replace")
+    if compression == "gzip":
+        raw = gzip.open(path, "rb")
+    else:
+        zstandard = _zstandard()
+        raw = zstandard.ZstdDecompressor().stream_reader(io.open(path, "rb"), closefd=True)
+    return io.TextIOWrapper(io.BufferedReader(raw, IO_BUFFER), encoding="utf-8", errors="replace")
+
+
+def tsv_name(fileName, model, compression=None):
+    """ team_1_9606.txt, model "2" -> team_2_9606.tsv (.tsv.gz, .tsv.zst when compressed) """
+    return output_name(fileName, model)[:-len(".txt")] + ".tsv" + COMPRESSIONS[compression]
+
+
+class TSVExporter(object):
+    """ Writes the prediction lines of a file to one TSV file per MODEL while it is being validated """
+
+    def __init__(self, fileName, out_dir, compression=None):
+        if compression not in COMPRESSIONS:
+            raise ValueError("compression must be one of gzip, zstd or None, not {!r}".format(compression))
+        self.fileName = fileName
+        self.out_dir = out_dir
+        self.compression = compression
+        # model number -> (path, open file), in file order
+        self.outputs = {}
+        self._out_handle = None
+
+    def track(self, lines):
+        """ Yields the lines unchanged while writing the prediction lines to the file of their model """
+        section_words = SECTION_WORDS
+        for line in lines:
+            fields = line.split()
+            if len(fields) == 3 and fields[0] not in section_words:
+                # before any MODEL the checker fails the file; nothing to write it to
+                if self._out_handle is not None:
+                    self._out_handle.write("\t".join(fields) + "\n")
+            elif fields and fields[0] == "MODEL":
+                self._open_model(fields[1] if len(fields) > 1 else "")
+            yield line
+
+    def _open_model(self, model):
+        if model not in self.outputs:
+            os.makedirs(self.out_dir, exist_ok=True)
+            path = os.path.join(self.out_dir, tsv_name(self.fileName, model, self.compression))
+            self.outputs[model] = (path, open_output(path + PART_SUFFIX, self.compression))
+        self._out_handle = self.outputs[model][1]
+
+    def commit(self):
+        """ Closes the outputs and gives them their final names; returns the paths """
+        written = []
+        for path, out_handle in self.outputs.values():
+            out_handle.close()
+            os.replace(path + PART_SUFFIX, path)
+            written.append(path)
+        self.outputs = {}
+        self._out_handle = None
+        return written
+
+    def abort(self):
+        """ Closes and removes the outputs """
+        for path, out_handle in self.outputs.values():
+            try:
+                out_handle.close()
+            finally:
+                try:
+                    os.unlink(path + PART_SUFFIX)
+                except FileNotFoundError:
+                    pass
+        self.outputs = {}
+        self._out_handle = None
+
+
+def _checker(fileName):
+    kind = prediction_kind(fileName)
+    if kind not in CHECKERS:
+        raise ConvertError("Error in {}\nOnly GO, HPO and DO prediction files can be converted".format(fileName))
+    return CHECKERS[kind]
+
+
+def lines_to_tsv(lines, fileName, out_dir, compression=None):
+    """
+    Validates one prediction file given as an iterable of str lines and writes its predictions as TSV, one
+    file per MODEL.  Returns the list of written paths; raises ConvertError if validation fails.
+    """
+    checker = _checker(fileName)
+    exporter = TSVExporter(fileName, out_dir, compression)
+    try:
+        correct, errmsg = checker(exporter.track(lines), fileName)
+        if not correct:
+            raise ConvertError(errmsg)
+        return exporter.commit()
+    finally:
+        exporter.abort()
+
+
+def to_tsv(input_file, out_dir, compression=None):
+    """ Converts a plain prediction file or every prediction file of a zip archive """
+    written = []
+    if zipfile.is_zipfile(input_file):
+        with zipfile.ZipFile(input_file, "r") as files:
+            for name in files.namelist():
+                if "__MACOSX" in name or name.endswith("/") or name.endswith(".DS_Store"):
+                    continue
+                with files.open(name) as member:
+                    lines = io.TextIOWrapper(member, encoding="utf-8", errors="replace")
+                    written.extend(lines_to_tsv(lines, name.split("/")[-1], out_dir, compression))
+    else:
+        with io.open(input_file, "r", buffering=IO_BUFFER) as lines:
+            written.extend(lines_to_tsv(lines, os.path.basename(input_file), out_dir, compression))
+    return written
+
+
+def cafa_lines(tsv_lines, author, model, keywords, precision=None):
+    """
+    The lines of a CAFA 4 file holding the predictions of tsv_lines.  keywords: the KEYWORDS record's
+    comma separated list.  Blank lines are dropped; other lines that are not three fields are passed on
+    for the checker to report.
+    """
+    precision = RULES.score_precision if precision is None else precision
+    yield "AUTHOR {}\n".format(author)
+    yield "MODEL {}\n".format(model)
+    yield "KEYWORDS {}\n".format(keywords if keywords.endswith(".") else keywords + ".")
+    for line in tsv_lines:
+        fields = line.split()
+        if len(fields) == 3:
+            try:
+                score = "{:.{}f}".format(float(fields[2]), precision)
+            except ValueError:
+                score = fields[2]
+            yield "{}\t{}\t{}\n".format(fields[0], fields[1], score)
+        elif fields:
+            yield line if line.endswith("\n") else line + "\n"
+    yield "END\n"
+
+
+def from_tsv(input_file, output_file, author, model="1", keywords="sequence alignment"):
+    """
+    Writes the predictions of a TSV file (plain, .gz or .zst) as the CAFA 4 file output_file, whose name
+    must follow the filename grammar, and validates it as it is written.  Raises ConvertError if it fails
+    validation; line numbers in the error are those of the CAFA 4 file, three more than the TSV's.
+    """
+    fileName = os.path.basename(output_file)
+    checker = _checker(fileName)
+    part = output_file + PART_SUFFIX
+    try:
+        with open_input(input_file) as tsv_lines, io.open(part, "w", buffering=IO_BUFFER) as out_handle:
+            def written(lines):
+                for line in lines:
+                    out_handle.write(line)
+                    yield line
+            correct, errmsg = checker(written(cafa_lines(tsv_lines, author, model, keywords)), fileName)
+        if not correct:
+            raise ConvertError(errmsg)
+        os.replace(part, output_file)
+    finally:
+        try:
+            os.unlink(part)
+        except FileNotFoundError:
+            pass
+    return output_file
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Validate prediction files and convert them to or from TSV")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("to-tsv", help="CAFA 4 file or zip -> target<TAB>term<TAB>score, one file per MODEL")
+    export.add_argument("input_file", help="path to the prediction file or zipped archive")
+    export.add_argument("out_dir", help="directory for the TSV files, one per MODEL")
+    export.add_argument("--compress", choices=["gzip", "zstd"], help="compress the TSV files")
+    reverse = commands.add_parser("from-tsv", help="target<TAB>term<TAB>score -> CAFA 4 file")
+    reverse.add_argument("input_file", help="TSV file (.tsv, .tsv.gz or .tsv.zst)")
+    reverse.add_argument("output_file", help="CAFA 4 file to write, e.g. ateam_1_9606_go.txt")
+    reverse.add_argument("--author", required=True, help="AUTHOR record")
+    reverse.add_argument("--model", default="1", help="MODEL number (default %(default)s)")
+    reverse.add_argument("--keywords", default="sequence alignment",
+                         help="comma separated KEYWORDS (default %(default)r)")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "to-tsv":
+            written = to_tsv(args.input_file, args.out_dir, args.compress)
+        else:
+            written = [from_tsv(args.input_file, args.output_file, args.author, args.model, args.keywords)]
+    except ConvertError as error:
+        print(error)
+        return False
+    for path in written:
+        print("Wrote {}".format(path))
+    return True
+
+
+if __name__ == "__main__":
+    main()
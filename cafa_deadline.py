@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import re
+import time
+from collections import namedtuple
+from itertools import chain, islice, tee
+
+from cafa_sections import SECTION_WORDS, record_section
+
+"""
+Time budgets and cooperative cancellation for validation.
+
+Deadline.track() wraps the lines handed to a checker.  Every check_every lines it looks at the clock and at
+an optional cancel event (a threading.Event or multiprocessing.Event shared with other workers); once the
+budget is spent or the event is set it raises DeadlineExceeded from inside the checker's loop, which stops
+the checker cleanly.  bounded_check() turns that into an inconclusive result: correct is None and a
+PartialResult tells how many lines were checked and which sections (visited_states, named as the checker
+names them) had been seen.  The checkers return at the first error, so a file in which an error was found
+before the deadline is reported as failed, not inconclusive.
+"""
+
+# A header line of a batch joined with "\n": its first word, as cafa_sections.record_section finds it
+RECORD_LINE = re.compile(r"^[^\S\n]*({})(?=\s|$)".format("|".join(SECTION_WORDS)), re.MULTILINE)
+
+PartialResult = namedtuple("PartialResult", ["filename", "lines_checked", "visited_states", "elapsed", "reason"])
+
+# The name each checker gives its prediction section in visited_states, by cafa4_format_checker.prediction_kind
+PREDICTION_STATES = {
+    "go": "go_prediction",
+    "hpo": "hpo_prediction",
+    "do": "do_prediction",
+    "binding": "binding_site",
+}
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, partial):
+        Exception.__init__(self, partial.reason)
+        self.partial = partial
+
+
+class Deadline(object):
+    """
+    seconds: time budget, None for no limit
+    cancel_event: optional Event; setting it stops every validation using this deadline at its next check
+    """
+
+    def __init__(self, seconds=None, cancel_event=None, check_every=1024, clock=time.monotonic):
+        self.clock = clock
+        self.start = clock()
+        self.expires = None if seconds is None else self.start + seconds
+        self.cancel_event = cancel_event
+        self.check_every = check_every
+
+    def remaining(self):
+        if self.expires is None:
+            return None
+        return max(self.expires - self.clock(), 0.0)
+
+    def reason(self):
+        """ Why validation has to stop now, or None """
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            return "cancelled"
+        if self.expires is not None and self.clock() >= self.expires:
+            return "time budget exhausted"
+        return None
+
+    def cancel(self):
+        if self.cancel_event is None:
+            import threading
+
+            self.cancel_event = threading.Event()
+        self.cancel_event.set()
+
+    def child(self, seconds=None):
+        """ A deadline for one member: at most seconds, and never later than this one; shares the cancel event """
+        child = Deadline(seconds, self.cancel_event, self.check_every, self.clock)
+        if self.expires is not None and (child.expires is None or self.expires < child.expires):
+            child.expires = self.expires
+        return child
+
+    def partial(self, filename, lines_checked=0, visited_states=()):
+        """ The PartialResult of a file stopped now """
+        return PartialResult(
+            filename, lines_checked, list(visited_states), self.clock() - self.start, self.reason() or "stopped"
+        )
+
+    def track(self, lines, filename, prediction_state="prediction"):
+        """
+        Yields the lines unchanged until the deadline passes, then raises DeadlineExceeded.  The lines are counted
+        check_every at a time; the sections seen are added up a batch at a time, as the checker adds them to
+        its visited_states: once it has seen a prediction line only header lines change them, and those are
+        found with one regular expression search of the batch.
+        """
+        visited_states = []
+        prediction_seen = False
+        check_every = self.check_every
+        lines_checked = 0
+        lines = iter(lines)
+        for first in lines:
+            if self.reason() is not None:
+                raise DeadlineExceeded(self.partial(filename, lines_checked, visited_states))
+            # the lines are handed on one by one, not read ahead; tee keeps the batch for the sections
+            handed, kept = tee(chain((first,), islice(lines, check_every - 1)))
+            yield from handed
+            batch = list(kept)
+            lines_checked += len(batch)
+            if not prediction_seen:
+                for index, line in enumerate(batch):
+                    section = record_section(line)
+                    if section == "prediction":
+                        prediction_seen = True
+                        visited_states.append(prediction_state)
+                        batch = batch[index + 1:]
+                        break
+                    if section is not None:
+                        _visit(visited_states, section)
+                else:
+                    continue
+            for match in RECORD_LINE.finditer("\n".join(batch)):
+                _visit(visited_states, SECTION_WORDS[match.group(1)])
+
+
+def _visit(visited_states, section):
+    """ The checker's rule (cafa_sections.SectionState.step): AUTHOR and END every time, the others once """
+    if section == "author" or section == "end" or section not in visited_states:
+        visited_states.append(section)
+
+
+def bounded_check(checker, infile, fileName, deadline, prediction_state="prediction"):
+    """
+    Runs checker(lines, fileName) within deadline.  Returns (correct, errmsg, partial): the checker's own
+    result and None if it finished, or (None, message, PartialResult) if the deadline passed first.
+    """
+    if deadline.reason() is not None:
+        partial = deadline.partial(fileName)
+        return None, inconclusive_message(partial), partial
+    try:
+        correct, errmsg = checker(deadline.track(infile, fileName, prediction_state), fileName)
+    except DeadlineExceeded as stopped:
+        return None, inconclusive_message(stopped.partial), stopped.partial
+    return correct, errmsg, None
+
+
+def inconclusive_message(partial):
+    return (
+        "Inconclusive: validation of {} stopped ({}) after {:.1f}s\n"
+        "{:,} lines checked, no error found so far\n"
+        "Sections found so far: [{}]".format(
+            partial.filename, partial.reason, partial.elapsed, partial.lines_checked, ", ".join(partial.visited_states)
+        )
+    )
@@ -0,0 +1,507 @@
+#!/usr/bin/env python
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import json
+import os
+import socket
+import time
+import zipfile
+from contextlib import contextmanager
+
+from cafa4_format_checker import archive_members, file_name_check, prediction_kind, print_report
+from cafa_async import validate_member
+from cafa_queue import DEFAULT_LEASE_SECONDS, new_job_id, open_queue
+from cafa_records import InvalidRecordError, RecordValidator
+from cafa_sections import record_section
+
+"""
+Distributed validation: a coordinator publishes the work of a submission to a cafa_queue.WorkQueue,
+workers on any number of hosts pull it, and the coordinator merges the results into the report
+cafa4_format_checker.cafa_checker prints.  The submission has to be at the same path for every worker
+(a shared filesystem).
+
+    ./cafa_distributed.py work dir:/shared/queue --processes 8        # on every intake node
+    ./cafa_distributed.py coordinate dir:/shared/queue /shared/incoming/ateam.zip
+
+Every archive member (or the plain file) is one task, validated by the worker as cafa_checker validates it.
+A plain GO, HPO or DO file of more than two chunk_bytes is cut into byte ranges instead, one task each.  A range
+task validates the lines that start in its range with cafa_records.RecordValidator.  Once the first
+prediction line has been seen, only the record lines (MODEL, KEYWORDS, ACCURACY, END, ...) change the
+validator state, and a prediction line is valid or not whatever the state.  So every range but the first
+starts from the state after the first prediction line, which the coordinator reads from the head of the
+file, validates its prediction lines and passes its record lines back, as cafa_binding_parallel's batches
+do.  The coordinator merges the ranges in order, feeding each range's record lines to a validator in the
+state the ranges before it ended in.  Only a range with an error, or one that starts before the first
+prediction line, is validated again by the coordinator, from the right state and line number, so the first
+error is reported with the serial checker's message.  A structural error (section order, too many models, blank lines) makes it
+validate the whole file as cafa_checker would, so the report is the same in every case.  Archive members
+always go whole to one worker: a range of a member can only be reached by inflating the member from its
+start, so every range would cost as much as the ones before it.  (On one host, cafa_shared inflates a large
+member once into shared memory and checks its ranges there, with the functions below.)
+"""
+
+CHUNK_BYTES = 64 << 20
+
+# The header and the first prediction line must be within this many bytes for a file to be cut in ranges
+HEAD_BYTES = 1 << 20
+
+BLOCK_SIZE = 1 << 20
+
+# The validator state at the start of a file; states travel through the queue as JSON
+_INITIAL_STATE = None
+
+
+def _jsonable(state):
+    return json.loads(json.dumps(state))
+
+
+def _restored(state):
+    """ A RecordValidator state from its JSON form (lists back to tuples) """
+    if state is None:
+        return None
+    return tuple(tuple(field) if isinstance(field, list) else field for field in state)
+
+
+@contextmanager
+def open_raw(path, member=None):
+    """
+    The binary contents of the plain file path, or of the member of the archive path; path may also be the
+    cafa_shared.SegmentRef of the member inflated into shared memory
+    """
+    from cafa_shared import SegmentRef, SegmentReader
+
+    if isinstance(path, SegmentRef):
+        with SegmentReader(path) as raw:
+            yield raw
+    elif member is None:
+        with open(path, "rb") as raw:
+            yield raw
+    else:
+        with zipfile.ZipFile(path, "r") as files, files.open(member) as raw:
+            yield raw
+
+
+def range_lines(raw, start, end, block_size=BLOCK_SIZE, encoding="utf-8"):
+    """
+    Yields the lines (str, without their newline) of the binary file raw, at offset 0, that start at a byte
+    offset in [start, end).  Every line of the file is yielded by exactly one of a set of adjacent ranges.
+    """
+    position = 0
+    if start > 0:
+        # from the byte before start: the line that starts at start, if any, follows a newline there
+        raw.seek(start - 1)
+        position = start - 1
+    skip_first = start > 0
+    pending = b""
+    while True:
+        block = raw.read(block_size)
+        at_end = not block
+        data = pending + block
+        if at_end:
+            complete, pending = data, b""
+        else:
+            cut = data.rfind(b"\n")
+            if cut < 0:
+                pending = data
+                continue
+            complete, pending = data[:cut + 1], data[cut + 1:]
+        if skip_first:
+            newline = complete.find(b"\n")
+            if newline < 0:
+                return
+            position += newline + 1
+            complete = complete[newline + 1:]
+            skip_first = False
+        stop = at_end
+        if position + len(complete) >= end:
+            limit = end - 1 - position
+            if limit < 0:
+                return
+            newline = complete.find(b"\n", limit)
+            if newline >= 0:
+                complete = complete[:newline + 1]
+                stop = True
+        if complete:
+            lines = complete.decode(encoding, "replace").split("\n")
+            if complete.endswith(b"\n"):
+                lines.pop()
+            yield from lines
+        position += len(complete)
+        if stop:
+            return
+
+
+def prediction_state(path, member, filename, kind, head_bytes=HEAD_BYTES):
+    """
+    The RecordValidator state (as JSON) after the first prediction line of a file, or None if the header
+    and that line are not valid within head_bytes.
+    """
+    validator = RecordValidator(filename, kind)
+    with open_raw(path, member) as raw:
+        for line in range_lines(raw, 0, head_bytes):
+            try:
+                validator.feed(line.lstrip() if validator.line_num == 0 else line)
+            except InvalidRecordError:
+                return None
+            if validator.prediction_seen:
+                return _jsonable(validator.state())
+    return None
+
+
+def check_range(path, member, filename, kind, start, end, state=_INITIAL_STATE, line_num=0, records=False):
+    """
+    Validates the lines of a file that start in [start, end), from the validator state state (None at the
+    start of the file) and line_num lines already read.  Returns a dict: entry (state), exit (state after the
+    last line), lines, blank_tail (blank lines at the end of the range), error: None, or [line number,
+    message], the line number None for an error only the serial checker reports exactly, and records.
+    records: None, or with records=True [[index in the range, counting from 1, line], ...] of the record
+    lines, which are not validated here but left to merge_ranges; exit is then the state the prediction
+    lines leave unchanged.
+    """
+    validator = RecordValidator(filename, kind, state=_restored(state), line_num=line_num)
+    feed = validator.feed
+    blanks = 0
+    result = {"entry": state, "exit": None, "lines": 0, "blank_tail": 0, "error": None, "records": None}
+    record_lines = None
+    if records:
+        result["records"] = record_lines = []
+    with open_raw(path, member) as raw:
+        lines = range_lines(raw, start, end)
+        if start == 0 and member is not None:
+            # as cafa_pipeline.pipelined_lines: the blank lines at the start of a member are dropped
+            lines = _lstripped(lines)
+        try:
+            for line in lines:
+                if record_lines is not None and record_section(line) not in ("prediction", None):
+                    if blanks:
+                        result["error"] = [None, "blank line inside the file"]
+                        return result
+                    validator.line_num += 1
+                    record_lines.append([validator.line_num - line_num, line])
+                    continue
+                try:
+                    feed(line)
+                except InvalidRecordError as error:
+                    if line.strip():
+                        result["error"] = [error.line_num, error.errmsg]
+                        return result
+                    # blank: an error only if a line follows it
+                    validator.line_num -= 1
+                    blanks += 1
+                    continue
+                if blanks:
+                    result["error"] = [None, "blank line inside the file"]
+                    return result
+        finally:
+            result["lines"] = validator.line_num - line_num
+    result["exit"] = _jsonable(validator.state())
+    result["blank_tail"] = blanks
+    return result
+
+
+def _lstripped(lines):
+    started = False
+    for line in lines:
+        if not started:
+            if not line.strip():
+                continue
+            line = line.lstrip()
+            started = True
+        yield line
+
+
+def run_task(task):
+    """ A worker's result for a task published by the coordinator """
+    try:
+        if task["type"] == "range":
+            return check_range(task["path"], task["member"], task["filename"], task["kind"], task["start"],
+                               task["end"], task["state"], records=task["state"] is not None)
+        result = validate_member(task["path"], task["member"])
+        return {"file_type": result.file_type, "correct": result.correct, "errmsg": result.errmsg}
+    except Exception as error:
+        message = "Validation failed with {}: {}".format(type(error).__name__, error)
+        if task["type"] == "range":
+            return {"entry": task["state"], "exit": None, "lines": 0, "blank_tail": 0, "error": [None, message],
+                    "records": None}
+        return {"file_type": None, "correct": False, "errmsg": message}
+
+
+def _accept(path, fileName):
+    return True, None
+
+
+def _file_size(path, member):
+    if member is None:
+        return os.path.getsize(path)
+    with zipfile.ZipFile(path, "r") as files:
+        return files.getinfo(member).file_size
+
+
+def byte_ranges(size, chunk_bytes):
+    count = max(1, -(-size // chunk_bytes))
+    step = -(-size // count)
+    return [(start, min(start + step, size)) for start in range(0, size, step)] or [(0, 0)]
+
+
+def publish(queue, input_file, chunk_bytes=CHUNK_BYTES):
+    """
+    Puts the tasks of the submission input_file on queue.  Returns the plan merge() needs: one dict per
+    file with its filename, member and task ids, or the result if the file name alone decides it.
+    """
+    job = new_job_id()
+    path = os.path.abspath(input_file)
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path, "r") as files:
+            members = archive_members(files)
+    else:
+        members = [None]
+    plan = []
+    n_tasks = 0
+    for member in members:
+        filename = (path if member is None else member).split("/")[-1]
+        entry = {"filename": filename, "member": member, "tasks": []}
+        plan.append(entry)
+        file_type, correct, errmsg = file_name_check(None, filename, _accept, _accept)
+        if not correct:
+            entry["result"] = [file_type, correct, errmsg]
+            continue
+        kind = prediction_kind(filename)
+        size = _file_size(path, member)
+        state = None
+        if kind != "binding" and member is None and size >= 2 * chunk_bytes:
+            state = prediction_state(path, member, filename, kind)
+        if state is None:
+            tasks = [{"type": "file", "path": path, "member": member}]
+        else:
+            entry["kind"] = kind
+            entry["ranges"] = byte_ranges(size, chunk_bytes)
+            tasks = [
+                {"type": "range", "path": path, "member": member, "filename": filename, "kind": kind,
+                 "start": start, "end": end, "state": None if start == 0 else state}
+                for start, end in entry["ranges"]
+            ]
+        for task in tasks:
+            task_id = "%s-%05d" % (job, n_tasks)
+            n_tasks += 1
+            queue.put(task_id, task)
+            entry["tasks"].append(task_id)
+    return {"job": job, "path": path, "files": plan}
+
+
+def merge_ranges(path, entry, results):
+    """ (correct, errmsg) of a file validated in ranges, as the serial checker reports it """
+    filename, member, kind = entry["filename"], entry["member"], entry["kind"]
+    state = _INITIAL_STATE
+    lines = 0
+    blank_tail = 0
+    for (start, end), result in zip(entry["ranges"], results):
+        if result["error"] is None and result["records"] is not None:
+            validator = RecordValidator(filename, kind, state=_restored(state))
+            if not validator.prediction_seen:
+                # checked as if past the first prediction line, which it is not
+                result = None
+        elif result["error"] is not None or result["entry"] != state:
+            result = None
+        if blank_tail and (result is None or result["lines"]):
+            # blank lines before this range's lines
+            return None
+        if result is None:
+            result = check_range(path, member, filename, kind, start, end, state, lines)
+            if result["error"] is not None:
+                line_num, errmsg = result["error"]
+                if line_num is None:
+                    return None
+                return False, errmsg
+            exit_state = result["exit"]
+        elif result["records"] is not None:
+            try:
+                for index, line in result["records"]:
+                    validator.line_num = lines + index - 1
+                    validator.feed(line)
+            except InvalidRecordError as error:
+                return False, error.errmsg
+            exit_state = _jsonable(validator.state())
+        else:
+            exit_state = result["exit"]
+        if result["lines"]:
+            blank_tail = 0
+        blank_tail += result["blank_tail"]
+        state = exit_state
+        lines += result["lines"]
+    if blank_tail and member is None:
+        return None
+    try:
+        return RecordValidator(filename, kind, state=_restored(state)).finish()
+    except InvalidRecordError as error:
+        return False, error.errmsg
+
+
+def merge(plan, results):
+    """ (file_type, correct, errmsg) of every file of the plan; results maps task ids to results """
+    merged = []
+    for entry in plan["files"]:
+        if "result" in entry:
+            merged.append(tuple(entry["result"]))
+            continue
+        task_results = [results.get(task_id) for task_id in entry["tasks"]]
+        if None in task_results:
+            merged.append((None, None, "Inconclusive: no worker finished validating {}".format(entry["filename"])))
+        elif "ranges" not in entry:
+            result = task_results[0]
+            merged.append((result["file_type"], result["correct"], result["errmsg"]))
+        else:
+            outcome = merge_ranges(plan["path"], entry, task_results)
+            if outcome is None:
+                # an error the range checks do not report as the serial checker does: validate it here
+                result = validate_member(plan["path"], entry["member"])
+                merged.append((result.file_type, result.correct, result.errmsg))
+            else:
+                merged.append(file_name_check(None, entry["filename"], checker=lambda path, fileName: outcome))
+    return merged
+
+
+def wait_for_results(queue, task_ids, timeout=None, poll_interval=0.5, worker=None):
+    """
+    Collects the results of task_ids until all are in or timeout seconds have passed; with worker (a name),
+    the caller works on queued tasks meanwhile.
+    """
+    results = {}
+    waiting = list(task_ids)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while waiting:
+        waiting = [task_id for task_id in waiting if not _collect(queue, task_id, results)]
+        if not waiting or (deadline is not None and time.monotonic() >= deadline):
+            break
+        if worker is None or not work_once(queue, worker):
+            time.sleep(poll_interval)
+    return results
+
+
+def _collect(queue, task_id, results):
+    result = queue.result(task_id)
+    if result is None:
+        return False
+    results[task_id] = result
+    return True
+
+
+def distributed_checker(input_file, queue, chunk_bytes=CHUNK_BYTES, timeout=None, work=False):
+    """
+    Validates input_file with the workers pulling from queue (a WorkQueue, or a spec for open_queue) and
+    prints cafa_checker's report.  Returns cafa_checker's result; files no worker finished within timeout
+    seconds are inconclusive.  work: validate queued tasks here too while waiting.
+    """
+    if isinstance(queue, str):
+        queue = open_queue(queue)
+    print("____________________________________________")
+    if os.path.isdir(input_file):
+        print("\nFolders must be compressed into a zipped archive before submission and validation\n")
+        return
+    plan = publish(queue, input_file, chunk_bytes)
+    task_ids = [task_id for entry in plan["files"] for task_id in entry["tasks"]]
+    try:
+        results = wait_for_results(queue, task_ids, timeout, worker=worker_name() if work else None)
+        merged = merge(plan, results)
+    finally:
+        queue.discard(task_ids)
+
+    REPORT = []
+    FLAGS = []
+    TYPES = []
+    for entry, (file_type, correct, errmsg) in zip(plan["files"], merged):
+        print("Validating {}".format(entry["filename"]))
+        FLAGS.append(correct)
+        REPORT.append((correct, errmsg))
+        TYPES.append(file_type)
+    print("\n")
+    return print_report(FLAGS, REPORT, TYPES)
+
+
+def worker_name():
+    return "%s-%d" % (socket.gethostname(), os.getpid())
+
+
+def work_once(queue, worker, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """ Claims and runs one task; returns False if there was none """
+    claimed = queue.claim(worker, lease_seconds)
+    if claimed is None:
+        return False
+    task_id, task = claimed
+    queue.complete(task_id, run_task(task))
+    return True
+
+
+def work(queue, lease_seconds=DEFAULT_LEASE_SECONDS, idle_timeout=None, poll_interval=1.0, stop_event=None):
+    """
+    Runs tasks from queue (a WorkQueue or a spec) until stop_event is set or, with idle_timeout, the queue
+    has been empty for that many seconds.  Returns the number of tasks run.
+    """
+    if isinstance(queue, str):
+        queue = open_queue(queue)
+    worker = worker_name()
+    done = 0
+    idle_since = time.monotonic()
+    while stop_event is None or not stop_event.is_set():
+        if work_once(queue, worker, lease_seconds):
+            done += 1
+            idle_since = time.monotonic()
+            continue
+        if idle_timeout is not None and time.monotonic() - idle_since >= idle_timeout:
+            break
+        time.sleep(poll_interval)
+    return done
+
+
+def main(argv=None):
+    import argparse
+    import multiprocessing
+
+    parser = argparse.ArgumentParser(description="Validate submissions with workers on several processes or hosts")
+    commands = parser.add_subparsers(dest="command", required=True)
+    coordinate = commands.add_parser("coordinate", help="publish a submission and print its report")
+    coordinate.add_argument("queue", help="queue spec: dir:PATH, sqlite:PATH, or a path")
+    coordinate.add_argument("input_file", help="prediction file or zipped archive, at a path the workers share")
+    coordinate.add_argument("--chunk-mb", type=float, default=CHUNK_BYTES / float(1 << 20),
+                            help="size of the ranges large GO/HPO/DO files are cut into (default %(default)s)")
+    coordinate.add_argument("--timeout", type=float, metavar="SECONDS",
+                            help="report the files not validated by then as inconclusive")
+    coordinate.add_argument("--work", action="store_true", help="also validate queued tasks while waiting")
+    worker = commands.add_parser("work", help="run queued tasks")
+    worker.add_argument("queue", help="queue spec: dir:PATH, sqlite:PATH, or a path")
+    worker.add_argument("--processes", type=int, default=1, help="worker processes (default %(default)s)")
+    worker.add_argument("--idle-timeout", type=float, metavar="SECONDS",
+                        help="exit once the queue has been empty this long (default: run until stopped)")
+    worker.add_argument("--lease", type=float, default=DEFAULT_LEASE_SECONDS, metavar="SECONDS",
+                        help="time after which a task claimed by a worker that died is handed out again")
+    args = parser.parse_args(argv)
+
+    if args.command == "coordinate":
+        result = distributed_checker(args.input_file, args.queue, int(args.chunk_mb * (1 << 20)), args.timeout,
+                                     args.work)
+        print("____________________________________________")
+        return result
+
+    options = dict(lease_seconds=args.lease, idle_timeout=args.idle_timeout)
+    if args.processes == 1:
+        return work(args.queue, **options)
+    processes = [multiprocessing.Process(target=work, args=(args.queue,), kwargs=options)
+                 for _ in range(args.processes)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -12,8 +12,8 @@
 #
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
-import re
 from cafa_go_format_checker import (
+    RULES,
     target_field,
     confidence_field,
     author_check,
@@ -23,21 +23,24 @@ from cafa_go_format_checker import (
     end_check,
     handle_error,
 )
+from cafa_sections import SectionState
 
 CAFA_VERSION = 4
 
+do_field = RULES.term_field("do")
+
+# Matches a whole valid DO prediction line in one call; see cafa_go_format_checker.valid_prediction_line
+valid_prediction_line = RULES.prediction_line("do").match
+
 
 def do_prediction_check(input_record):
-    do_field_pattern = re.compile("^DO:[0-9]{5,7}$")
     is_correct = True
     error_msg = None
     error_msg_prefix = "DO prediction: "
     # fields = [i.strip() for i in input_record.split()
 
     try:
-        target_value, do_value, confidence_value = [
-            i.strip() for i in input_record.split()
-        ]
+        target_value, do_value, confidence_value = input_record.split()
     except ValueError:
         # Wrong number of values in the list
         is_correct = False
@@ -50,7 +53,7 @@ def do_prediction_check(input_record):
     if not target_field.match(target_value):
         is_correct = False
         error_msg = "error in first (Target ID) field"
-    elif not do_field_pattern.match(do_value):
+    elif not do_field.match(do_value):
         is_correct = False
         error_msg = "error in second (DO ID) field"
     elif not confidence_field.match(confidence_value):
@@ -66,6 +69,38 @@ def do_prediction_check(input_record):
     return is_correct, error_msg
 
 
+class CheckerState(SectionState):
+    """ What cafa_checker carries from one line of a file to the next (see cafa_sections.SectionState) """
+
+    prediction_state = "do_prediction"
+    line_offset = -1
+
+    def check_prediction(self, input_record):
+        return do_prediction_check(input_record)
+
+    def finish(self):
+        # At this point the various states have been individually validated,
+        # finally, check that the required states are all accounted for:
+        if not self.order_ok():
+            error_msg = "Error in {} filename \n".format(self.fileName)
+            error_msg += "Sections found in the file: [{}]\n".format(", ".join(self.visited_states))
+            error_msg += "file not formatted according to CAFA {cafa_version} specs\n".format(
+                cafa_version=CAFA_VERSION
+            )
+            error_msg += "Check if all these record types are in your file in the correct order\n"
+            error_msg += (
+                "AUTHOR, MODEL, KEYWORDS (optional), ACCURACY (optional), predictions, END"
+            )
+            return False, error_msg
+        else:
+            return (
+                True,
+                "{filename}, passed the CAFA {cafa_version} DO prediction format checker".format(
+                    filename=self.fileName, cafa_version=CAFA_VERSION
+                ),
+            )
+
+
 def cafa_checker(input_file_handle, filename=None):
     """
     Main program that: 1. identifies fields; 2. Calls the proper checker function; 3. calls the
@@ -80,129 +115,27 @@ def cafa_checker(input_file_handle, filename=None):
     if filename is None:
         filename = input_file_handle.name
 
-    visited_states = []
-    accuracy_count = 0
-    model_count = 0
-
-    for line_index, input_line in enumerate(input_file_handle):
-        line_split = [i.strip() for i in input_line.split()]
-        input_state = line_split[0]
+    state = CheckerState(filename)
+    step = state.step
+    prediction_line = valid_prediction_line
+    prediction_seen = False
 
-        states = ("AUTHOR", "MODEL", "KEYWORDS", "ACCURACY", "END")
+    # lines are numbered from 0 in the messages (CheckerState.line_offset)
+    for line_num, input_line in enumerate(input_file_handle, 1):
+        if prediction_seen and prediction_line(input_line):
+            continue
+        error = step(input_line, line_num)
+        if error is not None:
+            return error
+        prediction_seen = state.prediction_seen
 
-        if input_state in states:
-            state = input_state.lower()
-        else:  # default to prediction state
-            state = "do_prediction"
-
-        # Check for errors according to state
-        if state == "author":
-            is_correct, error_msg = author_check(input_line)
-            is_correct, error_msg = handle_error(
-                is_correct, error_msg, input_line, line_index, filename
-            )
-            if not is_correct:
-                return is_correct, error_msg
-            visited_states.append(state)
-        elif state == "model":
-            model_count += 1
-            accuracy_count = 0
-            if model_count > 3:
-                return False, "Too many models. Only up to 3 allowed"
-            is_correct, error_msg = model_check(input_line)
-            is_correct, error_msg = handle_error(
-                is_correct, error_msg, input_line, line_index, filename
-            )
-            if not is_correct:
-                return is_correct, error_msg
-            if model_count == 1:
-                visited_states.append(state)
-        elif state == "keywords":
-
-            if state not in visited_states:
-                visited_states.append(state)
-
-            is_correct, error_msg = keywords_check(input_line)
-            is_correct, error_msg = handle_error(
-                is_correct, error_msg, input_line, line_index, filename
-            )
-            if not is_correct:
-                return is_correct, error_msg
-        elif state == "accuracy":
-            if state not in visited_states:
-                visited_states.append(state)
-
-            accuracy_count += 1
-            if accuracy_count > 3:
-                is_correct, error_msg = handle_error(
-                    False, "ACCURACY: too many ACCURACY records", line_index, filename
-                )
-                return is_correct, error_msg
-            else:
-                is_correct, error_msg = accuracy_check(input_line)
-                if not is_correct:
-                    return is_correct, error_msg
-        elif state == "do_prediction":
-            is_correct, error_msg = do_prediction_check(input_line)
-            if not is_correct:
-                return handle_error(
-                    is_correct, error_msg, input_line, line_index, filename
-                )
-
-            if state not in visited_states:
-                visited_states.append(state)
-
-        elif state == "end":
-            is_correct, error_msg = end_check(input_line)
-            is_correct, error_msg = handle_error(
-                is_correct, error_msg, input_line, line_index, filename
-            )
-            if not is_correct:
-                return is_correct, error_msg
-            visited_states.append(state)
-
-    # End file forloop
-
-    # At this point the various states have been individually validated,
-    # finally, check that the required states are all accounted for:
-    if (
-        visited_states[0] != "author"
-        or visited_states[1] != "model"
-        or visited_states[-2] != "do_prediction"
-        or visited_states[-1] != "end"
-    ):
-
-        error_msg = "Error in {} filename \n".format(filename)
-        error_msg += "Sections found in the file: [{}]\n".format(", ".join(visited_states))
-        error_msg += "file not formatted according to CAFA {cafa_version} specs\n".format(
-            cafa_version=CAFA_VERSION
-        )
-        error_msg += "Check if all these record types are in your file in the correct order\n"
-        error_msg += (
-            "AUTHOR, MODEL, KEYWORDS (optional), ACCURACY (optional), predictions, END"
-        )
-        return False, error_msg
-    else:
-        return (
-            True,
-            "{filename}, passed the CAFA {cafa_version} DO prediction format checker".format(
-                filename=filename, cafa_version=CAFA_VERSION
-            ),
-        )
+    return state.finish()
 
 
 def main():
-    import sys
+    from cafa_profiler import single_file_main
 
-    try:
-        filepath = sys.argv[1]
-
-        with open(filepath, "r") as do_handle:
-            is_valid, error_msg = cafa_checker(do_handle)
-            print("Is Valid: {}".format(is_valid))
-            print("Message: {}".format(error_msg))
-    except IndexError:
-        print("No file specified")
+    single_file_main(cafa_checker)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from cafa_ruleset import load_ruleset, available_editions
+from cafa_go_format_checker import author_check, model_check, end_check, handle_error
+from cafa_sections import SectionState
+
+"""
+Checks GO / HPO / DO style prediction files ("target term score" lines) against any CAFA edition declared
+in rulesets/, using the compiled Ruleset instead of per-edition copies of the checker.
+
+Valid prediction lines are accepted by a single match of the ruleset's combined line pattern; only lines
+that fail it are split up to find out which field is wrong.  Lines go through the same section state
+machine as the CAFA 4 checkers (cafa_sections), with the edition's limits and section orders.
+"""
+
+def keywords_check(inrec, rules):
+    correct = True
+    errmsg = None
+    if inrec[:8] != "KEYWORDS":
+        correct = False
+        errmsg = "KEYWORDS: first field should be KEYWORDS"
+    else:
+        for keyword in inrec[8:].split(","):
+            keyword = keyword.strip()
+            # stupid full stop
+            if keyword[-1:] == ".":
+                keyword = keyword[:-1]
+            if keyword not in rules.keywords:
+                correct = False
+                errmsg = "KEYWORDS: illegal keyword %s" % keyword
+                break
+    return correct, errmsg
+
+
+def accuracy_check(inrec, rules):
+    correct = True
+    errmsg = None
+    fields = inrec.split()
+    if len(fields) != 4:
+        correct = False
+        errmsg = "ACCURACY: error in number of fields. Should be 4"
+    elif fields[0] != "ACCURACY":
+        correct = False
+        errmsg = "ACCURACY: first field should be 'ACCURACY'"
+    elif not fields[1].isdigit() or len(fields[1]) != 1:
+        correct = False
+        errmsg = "ACCURACY: second field should be a single digit"
+    elif not rules.pr_field.match(fields[2]):
+        correct = False
+        errmsg = "ACCURACY: error in PR field"
+    elif not rules.rc_field.match(fields[3]):
+        correct = False
+        errmsg = "ACCURACY: error in RC field"
+    return correct, errmsg
+
+
+def prediction_check(inrec, rules, ontology):
+    """ Validates one 'target term score' line; the slow path is only taken for invalid lines """
+    if rules.prediction_line(ontology).match(inrec):
+        return True, None
+    label = rules.labels[ontology]
+    fields = inrec.split()
+    if len(fields) != 3:
+        errmsg = "wrong number of fields. Should be 3"
+    elif not rules.target_field(ontology).match(fields[0]):
+        errmsg = "error in first (Target ID) field"
+    elif not rules.term_field(ontology).match(fields[1]):
+        errmsg = "error in second (%s) field" % rules.term_labels[ontology]
+    elif not rules.confidence_field.match(fields[2]):
+        errmsg = "error in third (confidence) field"
+    elif float(fields[2]) > rules.score_max:
+        errmsg = "error in third (confidence) field. Cannot be > %s" % rules.score_max
+    else:
+        # fine field by field, e.g. after leading whitespace the one-match pattern does not allow
+        return True, None
+    return False, "%s prediction: %s" % (label, errmsg)
+
+
+def section_order_error(fileName, visited_states, rules):
+    errmsg = "Error in " + fileName + "\n"
+    errmsg += "Sections found in the file: [" + ", ".join(visited_states) + "]\n"
+    errmsg += "file not formatted according to %s specs\n" % rules.edition.upper().replace("CAFA", "CAFA ")
+    errmsg += "Check whether all these record types are in your file in the correct order\n"
+    errmsg += "AUTHOR, MODEL, KEYWORDS, ACCURACY (optional), predictions, END"
+    return errmsg
+
+
+class EditionState(SectionState):
+    """
+    The checker state (see cafa_sections.SectionState) for the rules of an edition: it is its own
+    record checks, the CAFA 4 checks with the edition's keywords, ACCURACY and ID grammars
+    """
+
+    author_check = staticmethod(author_check)
+    model_check = staticmethod(model_check)
+    end_check = staticmethod(end_check)
+    handle_error = staticmethod(handle_error)
+
+    def __init__(self, fileName, ontology, rules):
+        self.ontology = ontology
+        self.prediction_state = "{}_prediction".format(ontology)
+        SectionState.__init__(self, fileName, checks=self, rules=rules)
+
+    def keywords_check(self, inrec):
+        return keywords_check(inrec, self.rules)
+
+    def accuracy_check(self, inrec):
+        return accuracy_check(inrec, self.rules)
+
+    def check_prediction(self, inrec):
+        return prediction_check(inrec, self.rules, self.ontology)
+
+    def finish(self):
+        rules = self.rules
+        if not self.order_ok():
+            return False, section_order_error(self.fileName, self.visited_states, rules)
+        return True, "%s, passed the %s %s prediction format checker" % (
+            self.fileName,
+            rules.edition.upper().replace("CAFA", "CAFA "),
+            rules.labels[self.ontology],
+        )
+
+
+def cafa_checker(infile, fileName, ontology="go", edition="cafa4"):
+    """
+    Validates a prediction file against the rules of a CAFA edition.  Returns (correct, errmsg) like the
+    per-ontology checkers; visited_states uses "<ontology>_prediction" for the prediction section.
+    """
+    rules = load_ruleset(edition)
+    state = EditionState(fileName, ontology, rules)
+    step = state.step
+    prediction_line = rules.prediction_line(ontology).match
+    prediction_seen = False
+    line_num = 0
+    for inline in infile:
+        line_num += 1
+        if prediction_seen and prediction_line(inline):
+            continue
+        error = step(inline, line_num)
+        if error is not None:
+            return error
+        prediction_seen = state.prediction_seen
+    return state.finish()
+
+
+def main(argv=None):
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser(description="Validate a prediction file against a declarative CAFA ruleset")
+    parser.add_argument("input_file", help="path to the prediction file")
+    parser.add_argument("--edition", default="cafa4", choices=available_editions())
+    parser.add_argument("--ontology", default="go", help="ontology section of the ruleset (go, hpo, do, ...)")
+    args = parser.parse_args(argv)
+
+    with open(args.input_file, "r") as handle:
+        is_valid, error_msg = cafa_checker(handle, os.path.basename(args.input_file), args.ontology, args.edition)
+    print("Is Valid: {}".format(is_valid))
+    print("Message: {}".format(error_msg))
+    return is_valid
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+"""
+The executors used for parallel validation: archive members (cafa4_format_checker --member-workers),
+binding-site target batches (cafa_binding_parallel) and the asyncio API (cafa_async).
+
+Validation is pure Python, so threads only run in parallel on a free-threaded (no-GIL) CPython build; there
+they also avoid starting processes and pickling jobs and results.  With the GIL, processes are the
+parallel backend.  default_backend() picks one accordingly; CAFA_EXECUTOR=thread or =process overrides it.
+
+The jobs are module-level functions that open their input by path and share nothing but read-only state:
+the compiled ruleset and regular expressions of the checkers, built at import.  The checkers keep their
+per-file state in local variables, so several files can be checked at once in one process.
+"""
+
+BACKENDS = ("thread", "process")
+
+
+def free_threaded():
+    """ Whether this interpreter runs without the GIL (a free-threaded 3.13+ build with the GIL disabled) """
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    return is_gil_enabled is not None and not is_gil_enabled()
+
+
+def default_backend():
+    """ CAFA_EXECUTOR if set, else "thread" on a free-threaded build and "process" otherwise """
+    backend = os.environ.get("CAFA_EXECUTOR")
+    if backend:
+        return check_backend(backend)
+    return "thread" if free_threaded() else "process"
+
+
+def check_backend(backend):
+    if backend not in BACKENDS:
+        raise ValueError("executor must be one of {}, not {!r}".format(", ".join(BACKENDS), backend))
+    return backend
+
+
+def make_executor(max_workers=None, backend=None, initializer=None, initargs=(), thread_name_prefix="cafa-worker"):
+    """
+    A concurrent.futures executor of backend ("thread" or "process", default default_backend()) with
+    max_workers workers (default: number of CPUs).  initializer(*initargs) runs in every worker.
+    """
+    backend = check_backend(backend) if backend is not None else default_backend()
+    max_workers = max_workers or os.cpu_count() or 1
+    if backend == "thread":
+        return ThreadPoolExecutor(max_workers, thread_name_prefix=thread_name_prefix, initializer=initializer,
+                                  initargs=initargs)
+    return ProcessPoolExecutor(max_workers, initializer=initializer, initargs=initargs)
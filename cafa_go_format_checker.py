@@ -16,32 +16,28 @@
 import re
 import sys
 
-pr_field = re.compile("^PR=[0,1]\.[0-9][0-9];$")
-rc_field = re.compile("^RC=[0,1]\.[0-9][0-9]$")
-go_field = re.compile("^GO:[0-9]{5,7}$")
+from cafa_ruleset import load_ruleset
+from cafa_sections import SectionState
+
+# The CAFA 4 rules (ID grammars, keywords, section orders, score format) are declared in rulesets/cafa4.json
+RULES = load_ruleset("cafa4")
+
+pr_field = RULES.pr_field
+rc_field = RULES.rc_field
+go_field = RULES.term_field("go")
 # Fix to add EFI and HP
-target_field = re.compile("^(M|T|EFI)[0-9]{5,20}$")
-#target_field = re.compile("^T[0-9]{5,20}$")
-confidence_field = re.compile("^[0,1]\.[0-9][0-9]$")
+target_field = RULES.target_field("go")
+confidence_field = RULES.confidence_field
+
+# The legal section orders (KEYWORDS and ACCURACY are optional) and the MODEL and ACCURACY limits are
+# RULES', applied line by line by cafa_sections.SectionState
 
-# Legal states: the CAFA prediction records fields, and their order. KEYWORDS and ACCURACY are
-# optional
-legal_states1 = ["author","model","keywords","accuracy","go_prediction","end"]
-legal_states2 = ["author","model","keywords","go_prediction","end"]
-legal_states3 = ["author","model","go_prediction","end"]
+legal_keywords = RULES.keywords
 
-legal_keywords = [
-"sequence alignment", "sequence-profile alignment", "profile-profile alignment", "phylogeny",
-"sequence properties",
-"physicochemical properties", "predicted properties", "protein interactions", "gene expression",
-"mass spectrometry",
-"genetic interactions", "protein structure", "literature", "genomic context", "synteny", 
-"structure alignment",
-"comparative model", "predicted protein structure", "de novo prediction", "machine learning", 
-"genome environment", 
-"operon", "ortholog", "paralog", "homolog", "hidden Markov model", "clinical data", "genetic data", 
-"natural language processing", "other functional information"
-]
+# Matches a whole valid prediction line in one call, so the per-line loop does not split or allocate for
+# the lines that are fine.  Lines it rejects go through the validators below, which say what is wrong.
+# cafa_profiler times it as its own entry of the prediction record type.
+valid_prediction_line = RULES.prediction_line("go").match
     
 """
 A collection of modules to check the format of the different records in the CAFA prediction file
@@ -54,7 +50,7 @@ The "correct" and "errmsg" variables then should be passed to the "handle_error"
 def author_check(inrec):
     correct = True
     errmsg = None
-    fields = [i.strip() for i in inrec.split()]
+    fields = inrec.split()
     if len(fields) != 2:
         correct = False
         errmsg = "AUTHOR: invalid number of fields. Should be 2"
@@ -66,7 +62,7 @@ def author_check(inrec):
 def model_check(inrec):
     correct = True
     errmsg = None
-    fields = [i.strip() for i in inrec.split()]
+    fields = inrec.split()
     if len(fields) != 2:
         correct = False
         errmsg = "MODEL: invalid number of fields. Should be 2"
@@ -99,7 +95,7 @@ def keywords_check(inrec):
 def accuracy_check(inrec):
     correct = True
     errmsg = None
-    fields = [i.strip() for i in inrec.split()]
+    fields = inrec.split()
     if len(fields) != 4:
         correct = False
         errmsg = "ACCURACY: error in number of fields. Should be 4"
@@ -121,7 +117,7 @@ def accuracy_check(inrec):
 def go_prediction_check(inrec):
     correct = True
     errmsg = None
-    fields = [i.strip() for i in inrec.split()]
+    fields = inrec.split()
     if len(fields) != 3:
         correct = False
         errmsg = "GO prediction: wrong number of fields. Should be 3"
@@ -142,7 +138,7 @@ def go_prediction_check(inrec):
 def end_check(inrec):
     correct = True
     errmsg = None
-    fields = [i.strip() for i in inrec.split()]
+    fields = inrec.split()
     if len(fields) != 1:
         correct = False
         errmsg = "END: wrong number of fields. Should be 1"
@@ -161,7 +157,27 @@ def handle_error(correct, errmsg, inrec, line_num, fileName):
         line = "Error in %s, line %s, " % (fileName, line_num)
         return False,  line + errmsg
     else:
-        return True, "Nothing wrong here"
+        return True, None
+
+class CheckerState(SectionState):
+    """ What cafa_checker carries from one line of a file to the next (see cafa_sections.SectionState) """
+
+    prediction_state = "go_prediction"
+
+    def check_prediction(self, inrec):
+        return go_prediction_check(inrec)
+
+    def finish(self):
+        if not self.order_ok():
+            errmsg = "Error in " + self.fileName + "\n"
+            errmsg += "Sections found in the file: [" + ", ".join(self.visited_states) + "]\n"
+            errmsg += "file not formatted according to CAFA 4 specs\n"
+            errmsg += "Check whether all these record types are in your file in the correct order\n"
+            errmsg += "AUTHOR, MODEL, KEYWORDS, ACCURACY (optional), predictions, END"
+            return False, errmsg
+        else:
+            return True, "%s, passed the CAFA 4 GO prediction format checker" % self.fileName
+
 
 def cafa_checker(infile, fileName):
     """
@@ -169,98 +185,27 @@ def cafa_checker(infile, fileName):
     error handler "handle_error" which builds the error report.  If correct is False, the function returns correct, errmsg
     to the file_name_check function in cafa3_format_checker.
     """
-    visited_states = []
-    s_token = 0
-    n_accuracy = 0
-    first_prediction = True
-    first_accuracy = True
-    first_keywords = True
-    n_models = 0
+    state = CheckerState(fileName)
+    step = state.step
+    prediction_line = valid_prediction_line
+    prediction_seen = False
     line_num = 0
     for inline in infile:
         line_num += 1
-        inrec = [i.strip() for i in inline.split()]
-        field1 = inrec[0]
-        # Check which field type (state) we are in
-        if field1 == "AUTHOR":
-            state = "author"
-        elif field1 == "MODEL":
-            state = "model"
-        elif field1 == "KEYWORDS":
-            state = "keywords"
-        elif field1 == "ACCURACY":
-            state = "accuracy"
-        elif field1 == "END":
-            state = "end"
-        else: #default to prediction state
-            state = "go_prediction"
-#        print "****"
-#        print "FIELD1", field1
-#        print inline, state
-        # Check for errors according to state
-        if state == "author":
-            correct,errmsg = author_check(inline)
-            correct, errmsg = handle_error(correct, errmsg, inline, line_num, fileName)
-            if not correct:
-                return correct, errmsg
-            visited_states.append(state)
-        elif state == "model":
-            n_models += 1
-            n_accuracy = 0
-            if n_models > 3:
-                return False, "Too many models. Only up to 3 allowed"
-            correct,errmsg = model_check(inline)
-            correct, errmsg = handle_error(correct, errmsg, inline, line_num, fileName)
-            if not correct:
-                return correct, errmsg
-            if n_models == 1:
-                visited_states.append(state)
-        elif state == "keywords":
-            if first_keywords:
-                visited_states.append(state)
-                first_keywords = False
-            correct, errmsg = keywords_check(inline)
-            correct, errmsg = handle_error(correct, errmsg, inline, line_num, fileName)
-            if not correct:
-                return correct, errmsg
-        elif state == "accuracy":
-            if first_accuracy:
-                visited_states.append(state)
-                first_accuracy = False
-            n_accuracy += 1
-            if n_accuracy > 3:
-                correct, errmsg = handle_error(False, "ACCURACY: too many ACCURACY records", line_num, fileName)
-                if not correct:
-                    return correct, errmsg
-            else:
-                correct, errmsg = accuracy_check(inline)
-                if not correct:
-                    return correct, errmsg
-        elif state == "go_prediction":
-            correct, errmsg = go_prediction_check(inline)
-            correct, errmsg = handle_error(correct, errmsg, inline, line_num, fileName)
-            if not correct:
-                return correct, errmsg
-            if first_prediction:
-                visited_states.append(state)
-                first_prediction = False
-        elif state == "end":
-            correct, errmsg = end_check(inline)
-            correct, errmsg = handle_error(correct, errmsg, inline, line_num, fileName)
-            if not correct:
-                return correct, errmsg
-            visited_states.append(state)
-    # End file forloop
-    if (visited_states != legal_states1 and
-        visited_states != legal_states2 and
-        visited_states != legal_states3):
-        errmsg = "Error in " + fileName + "\n"
-        errmsg += "Sections found in the file: [" + ", ".join(visited_states) + "]\n"
-        errmsg += "file not formatted according to CAFA 4 specs\n"
-        errmsg += "Check whether all these record types are in your file in the correct order\n"
-        errmsg += "AUTHOR, MODEL, KEYWORDS, ACCURACY (optional), predictions, END"
-        return False, errmsg
-    else:
-        return True, "%s, passed the CAFA 4 GO prediction format checker" % fileName
+        if prediction_seen and prediction_line(inline):
+            continue
+        error = step(inline, line_num)
+        if error is not None:
+            return error
+        prediction_seen = state.prediction_seen
+    return state.finish()
+
+
+def main():
+    from cafa_profiler import single_file_main
+
+    single_file_main(cafa_checker)
 
 
+if __name__ == "__main__":
+    main()
@@ -15,33 +15,31 @@
 import re
 import sys
 
-pr_field = re.compile("^PR=[0,1]\.[0-9][0-9];$")
-rc_field = re.compile("^RC=[0,1]\.[0-9][0-9]$")
-hpo_field = re.compile("^HP:[0-9]{5,7}$")
-target_field = re.compile("^T[0-9]{5,20}$")
-confidence_field = re.compile("^[0,1]\.[0-9][0-9]$")
-legal_states1 = ["author","model","keywords","accuracy","hpo_prediction","end"]
-legal_states2 = ["author","model","keywords","hpo_prediction","end"]
-legal_states3 = ["author","model","hpo_prediction","end"]
-
-legal_keywords = [
-"sequence alignment", "sequence-profile alignment", "profile-profile alignment", "phylogeny",
-"sequence properties",
-"physicochemical properties", "predicted properties", "protein interactions", "gene expression",
-"mass spectrometry",
-"genetic interactions", "protein structure", "literature", "genomic context", "synteny", 
-"structure alignment",
-"comparative model", "predicted protein structure", "de novo prediction", "machine learning", 
-"genome environment", 
-"operon", "ortholog", "paralog", "homolog", "hidden Markov model", "clinical data", "genetic data", 
-"natural language processing", "other functional information"
-]
+from cafa_ruleset import load_ruleset
+from cafa_sections import SectionState
+
+# The CAFA 4 rules (ID grammars, keywords, section orders, score format) are declared in rulesets/cafa4.json
+RULES = load_ruleset("cafa4")
+
+pr_field = RULES.pr_field
+rc_field = RULES.rc_field
+hpo_field = RULES.term_field("hpo")
+target_field = RULES.target_field("hpo")
+confidence_field = RULES.confidence_field
+# The legal section orders and the MODEL and ACCURACY limits are RULES', applied by cafa_sections.SectionState
+
+legal_keywords = RULES.keywords
+
+# Matches a whole valid prediction line in one call, so the per-line loop does not split or allocate for
+# the lines that are fine.  Lines it rejects go through the validators below, which say what is wrong.
+# cafa_profiler times it as its own entry of the prediction record type.
+valid_prediction_line = RULES.prediction_line("hpo").match
     
 
 def author_check(inrec):
     correct = True
     errmsg = None
-    fields = [i.strip() for i in inrec.split()]
+    fields = inrec.split()
     if len(fields) != 2:
         correct = False
         errmsg = "AUTHOR: invalid number of fields. Should be 2"
@@ -53,7 +51,7 @@ def author_check(inrec):
 def model_check(inrec):
     correct = True
     errmsg = None
-    fields = [i.strip() for i in inrec.split()]
+    fields = inrec.split()
     if len(fields) != 2:
         correct = False
         errmsg = "MODEL: invalid number of fields. Should be 2"
@@ -86,7 +84,7 @@ def keywords_check(inrec):
 def accuracy_check(inrec):
     correct = True
     errmsg = None
-    fields = [i.strip() for i in inrec.split()]
+    fields = inrec.split()
     if len(fields) != 4:
         correct = False
         errmsg = "ACCURACY: error in number of fields. Should be 4"
@@ -108,7 +106,7 @@ def accuracy_check(inrec):
 def hpo_prediction_check(inrec):
     correct = True
     errmsg = None
-    fields = [i.strip() for i in inrec.split()]
+    fields = inrec.split()
     if len(fields) != 3:
         correct = False
         errmsg = "HPO prediction: wrong number of fields. Should be 3"
@@ -129,7 +127,7 @@ def hpo_prediction_check(inrec):
 def end_check(inrec):
     correct = True
     errmsg = None
-    fields = [i.strip() for i in inrec.split()]
+    fields = inrec.split()
     if len(fields) != 1:
         correct = False
         errmsg = "END: wrong number of fields. Should be 1"
@@ -148,7 +146,27 @@ def handle_error(correct, errmsg, inrec, line_num, fileName):
         line = "Error in %s, line %s, " % (fileName, line_num)
         return False,  line + errmsg
     else:
-        return True, "Nothing wrong here"
+        return True, None
+
+class CheckerState(SectionState):
+    """ What cafa_checker carries from one line of a file to the next (see cafa_sections.SectionState) """
+
+    prediction_state = "hpo_prediction"
+
+    def check_prediction(self, inrec):
+        return hpo_prediction_check(inrec)
+
+    def finish(self):
+        if not self.order_ok():
+            errmsg = "Error in " + self.fileName + "\n"
+            errmsg += "Sections found in the file: [" + ", ".join(self.visited_states) + "]\n"
+            errmsg += "file not formatted according to CAFA 4 specs\n"
+            errmsg += "Check whether all these record types are in your file in the correct order\n"
+            errmsg += "AUTHOR, MODEL, KEYWORDS, ACCURACY (optional), predictions, END"
+            return False, errmsg
+        else:
+            return True, "%s, passed the CAFA 4 HPO prediction format checker" % self.fileName
+
 
 def cafa_checker(infile, fileName):
     """
@@ -156,98 +174,27 @@ def cafa_checker(infile, fileName):
     error handler "handle_error" which builds the error report.  If correct is False, the function returns correct, errmsg
     to the file_name_check function in cafa3_format_checker.
     """
-    visited_states = []
-    s_token = 0
-    n_accuracy = 0
-    first_prediction = True
-    first_accuracy = True
-    first_keywords = True
-    n_models = 0
+    state = CheckerState(fileName)
+    step = state.step
+    prediction_line = valid_prediction_line
+    prediction_seen = False
     line_num = 0
     for inline in infile:
         line_num += 1
-        inrec = [i.strip() for i in inline.split()]
-        field1 = inrec[0]
-        # Check which field type (state) we are in
-        if field1 == "AUTHOR":
-            state = "author"
-        elif field1 == "MODEL":
-            state = "model"
-        elif field1 == "KEYWORDS":
-            state = "keywords"
-        elif field1 == "ACCURACY":
-            state = "accuracy"
-        elif field1 == "END":
-            state = "end"
-        else: #default to prediction state
-            state = "hpo_prediction"
-#        print "****"
-#        print "FIELD1", field1
-#        print inline, state
-        # Check for errors according to state
-        if state == "author":
-            correct,errmsg = author_check(inline)
-            correct, errmsg = handle_error(correct, errmsg, inline, line_num, fileName)
-            if not correct:
-                return correct, errmsg
-            visited_states.append(state)
-        elif state == "model":
-            n_models += 1
-            n_accuracy = 0
-            if n_models > 3:
-                return False, "Too many models. Only up to 3 allowed"
-            correct,errmsg = model_check(inline)
-            correct, errmsg = handle_error(correct, errmsg, inline, line_num, fileName)
-            if not correct:
-                return correct, errmsg
-            if n_models == 1:
-                visited_states.append(state)
-        elif state == "keywords":
-            if first_keywords:
-                visited_states.append(state)
-                first_keywords = False
-            correct, errmsg = keywords_check(inline)
-            correct, errmsg = handle_error(correct, errmsg, inline, line_num, fileName)
-            if not correct:
-                return correct, errmsg
-        elif state == "accuracy":
-            if first_accuracy:
-                visited_states.append(state)
-                first_accuracy = False
-            n_accuracy += 1
-            if n_accuracy > 3:
-                correct, errmsg = handle_error(False, "ACCURACY: too many ACCURACY records", inline, line_num, fileName)
-                if not correct:
-                    return correct, errmsg
-            else:
-                correct, errmsg = accuracy_check(inline)
-                if not correct:
-                    return correct, errmsg
-        elif state == "hpo_prediction":
-            correct, errmsg = hpo_prediction_check(inline)
-            correct, errmsg = handle_error(correct, errmsg, inline, line_num, fileName)
-            if not correct:
-                return correct, errmsg
-            if first_prediction:
-                visited_states.append(state)
-                first_prediction = False
-        elif state == "end":
-            correct, errmsg = end_check(inline)
-            correct, errmsg = handle_error(correct, errmsg, inline, line_num, fileName)
-            if not correct:
-                return correct, errmsg
-            visited_states.append(state)
-    # End file forloop
-    if (visited_states != legal_states1 and
-        visited_states != legal_states2 and
-        visited_states != legal_states3):
-        errmsg = "Error in " + fileName + "\n"
-        errmsg += "Sections found in the file: [" + ", ".join(visited_states) + "]\n"
-        errmsg += "file not formatted according to CAFA 4 specs\n"
-        errmsg += "Check whether all these record types are in your file in the correct order\n"
-        errmsg += "AUTHOR, MODEL, KEYWORDS, ACCURACY (optional), predictions, END"
-        return False, errmsg
-    else:
-        return True, "%s, passed the CAFA 4 HPO prediction format checker" % fileName
+        if prediction_seen and prediction_line(inline):
+            continue
+        error = step(inline, line_num)
+        if error is not None:
+            return error
+        prediction_seen = state.prediction_seen
+    return state.finish()
+
+
+def main():
+    from cafa_profiler import single_file_main
+
+    single_file_main(cafa_checker)
 
 
+if __name__ == "__main__":
+    main()
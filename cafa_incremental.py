@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import hashlib
+import json
+import os
+import zipfile
+from zlib import crc32
+
+from cafa4_format_checker import archive_members
+from cafa_go_format_checker import RULES
+from cafa_pipeline import pipelined_lines
+from cafa_records import InvalidRecordError, RecordValidator
+
+"""
+Incremental revalidation of resubmitted prediction files.
+
+A file is cut into content-defined chunks: a chunk ends after a line whose CRC-32 has its low
+CHUNK_MASK_BITS bits clear (within MIN_CHUNK_LINES..MAX_CHUNK_LINES lines).  Cut points depend only on the
+lines around them, so editing, inserting or deleting a few lines only changes the chunks around the edit;
+the chunking realigns with the old cut points right after it.  Chunks are whole lines, so the hash works
+per line (in C) rather than per byte in Python.
+
+Each chunk is validated with cafa_records.RecordValidator.  The cache maps (chunk digest, validator state
+on entering the chunk) to (state on leaving it, number of lines), stored as JSON; the state is what the
+checkers carry from line to line (sections seen, model and ACCURACY counts, binding-site
+current_prediction) without the line number.  On resubmission a chunk is only validated again if its
+content or its entry state changed, so an edit costs the changed chunks plus those successors whose entry
+state it changed, usually none.
+"""
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "CAFA_INCREMENTAL_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "cafa_format_checker")
+)
+
+CHUNK_MASK_BITS = 13
+MIN_CHUNK_LINES = 1024
+MAX_CHUNK_LINES = 1 << 16
+
+CHUNK_MASK = (1 << CHUNK_MASK_BITS) - 1
+
+
+def iter_chunks(lines, min_lines=MIN_CHUNK_LINES, max_lines=MAX_CHUNK_LINES, mask=CHUNK_MASK):
+    """ Groups bytes lines into content-defined chunks (lists of lines) """
+    chunk = []
+    append = chunk.append
+    for line in lines:
+        append(line)
+        if len(chunk) >= min_lines and (not crc32(line) & mask or len(chunk) >= max_lines):
+            yield chunk
+            chunk = []
+            append = chunk.append
+    if chunk:
+        yield chunk
+
+
+def chunk_digest(chunk):
+    return hashlib.blake2b(b"".join(chunk), digest_size=16).digest()
+
+
+def _state_key(state):
+    """ A validator state read back from JSON: its lists as tuples again, so it can be a dict key """
+    return tuple(tuple(field) if isinstance(field, list) else field for field in state)
+
+
+class ChunkCache(object):
+    """
+    Per-file chunk results, stored as JSON (data only: a cache file can never run code) in cache_dir/chunks.
+    Only the chunks of the latest version of a file are kept, so the cache does not grow with resubmissions.
+    A cache file that cannot be read or is malformed is a cache miss.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = os.path.join(cache_dir, "chunks")
+
+    def _path(self, filename):
+        # the ruleset digest is part of the key: a changed rule invalidates every cached chunk
+        key = hashlib.sha256("{}\0{}".format(filename, RULES.digest).encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def load(self, filename):
+        try:
+            with open(self._path(filename), "r") as cache_handle:
+                rows = json.load(cache_handle)
+            return dict(
+                ((bytes.fromhex(digest), _state_key(entry_state)), (_state_key(exit_state), int(n_lines)))
+                for digest, entry_state, exit_state, n_lines in rows
+            )
+        except (OSError, IOError, ValueError, TypeError):
+            return {}
+
+    def save(self, filename, entries):
+        """ Best effort: a read-only cache directory must not stop validation """
+        path = self._path(filename)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = "{}.{}.tmp".format(path, os.getpid())
+            rows = [
+                [digest.hex(), entry_state, exit_state, n_lines]
+                for (digest, entry_state), (exit_state, n_lines) in entries.items()
+            ]
+            with open(tmp_path, "w") as cache_handle:
+                json.dump(rows, cache_handle)
+            os.replace(tmp_path, path)
+        except (OSError, IOError):
+            pass
+
+
+def validate_incremental(lines, filename, cache, metrics=None):
+    """
+    Validates one file given as bytes lines, reusing the cached results of unchanged chunks.  Returns
+    (correct, errmsg, counts) where counts has the number of chunks, reused chunks and validated lines.
+    """
+    validator = RecordValidator(filename)
+    old_entries = cache.load(filename)
+    entries = {}
+    counts = {"chunks": 0, "reused": 0, "lines_validated": 0}
+    try:
+        for chunk in iter_chunks(lines, MIN_CHUNK_LINES, MAX_CHUNK_LINES, CHUNK_MASK):
+            counts["chunks"] += 1
+            entry_state = validator.state()
+            key = (chunk_digest(chunk), entry_state)
+            entry = old_entries.get(key) or entries.get(key)
+            if entry is not None:
+                exit_state, n_lines = entry
+                try:
+                    validator.restore(exit_state)
+                except (TypeError, ValueError):
+                    # a malformed cache entry: validate the chunk
+                    validator.restore(entry_state)
+                    entry = None
+            if metrics is not None:
+                metrics.observe_cache("chunks", entry is not None)
+            if entry is not None:
+                validator.line_num += n_lines
+                counts["reused"] += 1
+            else:
+                feed = validator.feed
+                for line in chunk:
+                    feed(line.decode("utf-8", "replace"))
+                entry = (validator.state(), len(chunk))
+                counts["lines_validated"] += len(chunk)
+            entries[key] = entry
+        correct, errmsg = validator.finish()
+    except InvalidRecordError as error:
+        # the chunks before the error are still good for the corrected resubmission
+        cache.save(filename, entries)
+        return False, error.errmsg, counts
+    cache.save(filename, entries)
+    return correct, errmsg, counts
+
+
+def incremental_checker(input_file, cache_dir=DEFAULT_CACHE_DIR, metrics=None):
+    """ Validates a plain prediction file or every file of a zip archive; returns a list of (filename, correct, errmsg, counts) """
+    cache = ChunkCache(cache_dir)
+    results = []
+    if zipfile.is_zipfile(input_file):
+        with zipfile.ZipFile(input_file, "r") as files:
+            for name in archive_members(files):
+                filename = name.split("/")[-1]
+                # the checker's line source, which drops the blank lines around a member
+                with files.open(name) as member:
+                    lines = pipelined_lines(member)
+                    try:
+                        encoded = ((line + "\n").encode("utf-8") for line in lines)
+                        results.append((filename,) + validate_incremental(encoded, filename, cache, metrics))
+                    finally:
+                        lines.close()
+    else:
+        filename = os.path.basename(input_file)
+        with open(input_file, "rb") as in_handle:
+            results.append((filename,) + validate_incremental(in_handle, filename, cache, metrics))
+    return results
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Validate a prediction file, reusing results for unchanged chunks")
+    parser.add_argument("input_file", help="path to the prediction file or zipped archive")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR,
+                        help="where chunk results are kept (default %(default)s)")
+    args = parser.parse_args(argv)
+
+    is_valid = True
+    for filename, correct, errmsg, counts in incremental_checker(args.input_file, args.cache_dir):
+        print("{}: {} of {} chunks reused, {:,} lines validated".format(
+            filename, counts["reused"], counts["chunks"], counts["lines_validated"]))
+        print("Is Valid: {}".format(correct))
+        print("Message: {}".format(errmsg))
+        is_valid = is_valid and correct
+    return is_valid
+
+
+if __name__ == "__main__":
+    main()
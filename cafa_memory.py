@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import threading
+import zipfile
+
+import cafa_pipeline
+
+"""
+Memory budget and admission control for concurrent validations.
+
+A MemoryBudget holds a number of bytes.  Before a file is validated, reserve() takes an estimate of what
+validating it will hold in memory (estimate_file_memory: the pipelined reader's buffers, bounded by the
+file size, plus what the chosen outputs keep); if the budget is exhausted the caller waits until other
+validations give their reservations back.  A request larger than the whole budget is reduced to the whole
+budget, so it still runs, alone.  A caller that can make do with less passes a minimum (minimum_file_memory:
+the reader's smallest buffers) and is granted whatever is free above it rather than waiting for the whole
+estimate.  The reader's block size and queue length are then chosen to fit the bytes actually granted
+(pipeline_buffers), so a job admitted into little headroom uses smaller buffers.
+
+The process-wide budget is set with set_memory_budget() or the CAFA_MEMORY_BUDGET_MB environment variable
+and is unlimited by default.  The intake scheduler keeps its own budget in the parent process and admits
+jobs into the worker pool against it, which bounds the memory of all the workers together.
+"""
+
+MB = 1 << 20
+
+# What any validation holds besides its input buffers: the checker state, a line or two, compiled regexes
+BASE_BYTES = 4 * MB
+
+# Smallest reader buffers pipeline_buffers() goes down to
+MIN_BLOCK_SIZE = 64 * 1024
+MIN_QUEUE_BLOCKS = 1
+
+# Bytes of columnar output kept per input byte: the target and term dictionaries, roughly
+COLUMNAR_BYTES_PER_INPUT_BYTE = 0.25
+
+
+class Reservation(object):
+    def __init__(self, budget, nbytes):
+        self.budget = budget
+        self.nbytes = nbytes
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.budget._release(self.nbytes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class MemoryBudget(object):
+    """ total_bytes: the budget; None for no limit (reservations are still granted and counted) """
+
+    def __init__(self, total_bytes=None):
+        self.total_bytes = total_bytes
+        self.reserved = 0
+        self._condition = threading.Condition()
+
+    def available(self):
+        if self.total_bytes is None:
+            return None
+        with self._condition:
+            return self.total_bytes - self.reserved
+
+    def _grant(self, nbytes):
+        if self.total_bytes is not None:
+            nbytes = min(nbytes, self.total_bytes)
+        return nbytes
+
+    def try_reserve(self, nbytes):
+        """ Returns a Reservation, or None if the budget does not have nbytes free now """
+        nbytes = self._grant(nbytes)
+        with self._condition:
+            if self.total_bytes is not None and self.reserved + nbytes > self.total_bytes:
+                return None
+            self.reserved += nbytes
+        return Reservation(self, nbytes)
+
+    def reserve(self, nbytes, timeout=None, minimum=None):
+        """
+        Waits until nbytes are free and reserves them; returns None if timeout passes first.  minimum: wait
+        only until that many bytes are free and reserve up to nbytes of what is free then; the Reservation's
+        nbytes is what was granted
+        """
+        nbytes = self._grant(nbytes)
+        minimum = nbytes if minimum is None else min(minimum, nbytes)
+        with self._condition:
+            if self.total_bytes is not None:
+                fits = self._condition.wait_for(lambda: self.reserved + minimum <= self.total_bytes, timeout)
+                if not fits:
+                    return None
+                nbytes = min(nbytes, self.total_bytes - self.reserved)
+            self.reserved += nbytes
+        return Reservation(self, nbytes)
+
+    def _release(self, nbytes):
+        with self._condition:
+            self.reserved -= nbytes
+            self._condition.notify_all()
+
+
+_budget = None
+_budget_lock = threading.Lock()
+
+
+def get_memory_budget():
+    """ The process-wide budget; CAFA_MEMORY_BUDGET_MB sets its size when it is first used """
+    global _budget
+    if _budget is None:
+        # members validated on threads at once must not each make a budget of their own
+        with _budget_lock:
+            if _budget is None:
+                size = os.environ.get("CAFA_MEMORY_BUDGET_MB")
+                _budget = MemoryBudget(int(float(size) * MB) if size else None)
+    return _budget
+
+
+def set_memory_budget(total_bytes):
+    global _budget
+    _budget = MemoryBudget(total_bytes)
+    return _budget
+
+
+def reader_bytes(file_size):
+    """ Most the pipelined reader holds for a file: its full queue and the block being split, or the file itself """
+    return min(file_size, (cafa_pipeline.QUEUE_BLOCKS + 2) * cafa_pipeline.BLOCK_SIZE)
+
+
+def output_bytes(file_size, columnar=False):
+    """ What the chosen outputs keep for a file of file_size bytes, whatever the reader's buffers """
+    if columnar:
+        return int(file_size * COLUMNAR_BYTES_PER_INPUT_BYTE)
+    return 0
+
+
+def estimate_file_memory(file_size, columnar=False):
+    """ Bytes to reserve for validating one file of file_size (uncompressed) bytes """
+    return BASE_BYTES + reader_bytes(file_size) + output_bytes(file_size, columnar)
+
+
+def minimum_file_memory(file_size, columnar=False):
+    """ The least estimate_file_memory's validation runs in: the reader's smallest buffers (pipeline_buffers) """
+    return BASE_BYTES + min(file_size, (MIN_QUEUE_BLOCKS + 2) * MIN_BLOCK_SIZE) + output_bytes(file_size, columnar)
+
+
+def estimate_submission_memory(path, columnar=False):
+    """ Bytes to reserve for validating a submission: members are validated one at a time, so the largest one """
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path, "r") as files:
+            sizes = [info.file_size for info in files.infolist() if not info.is_dir()]
+        return max([estimate_file_memory(size, columnar) for size in sizes] or [BASE_BYTES])
+    return estimate_file_memory(os.path.getsize(path), columnar)
+
+
+def pipeline_buffers(granted_bytes):
+    """ (block_size, max_blocks) for pipelined_lines that fit the reader's share of granted_bytes """
+    block_size = cafa_pipeline.BLOCK_SIZE
+    max_blocks = cafa_pipeline.QUEUE_BLOCKS
+    headroom = granted_bytes - BASE_BYTES
+    while (max_blocks + 2) * block_size > headroom and max_blocks > MIN_QUEUE_BLOCKS:
+        max_blocks -= 1
+    while (max_blocks + 2) * block_size > headroom and block_size > MIN_BLOCK_SIZE:
+        block_size //= 2
+    return block_size, max_blocks
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import bisect
+import functools
+import itertools
+import operator
+import os
+import tempfile
+import threading
+
+"""
+OpenMetrics / Prometheus text format metrics for intake monitoring.
+
+The per-line loop never touches the registry: lines are counted with a C-level itertools.count zipped
+onto the input (see counted_lines), and everything about a file is added to the registry in one
+locked update once the file has been validated (see ValidationMetrics.observe_file).
+"""
+
+# Upper bounds (seconds) of the validation latency histogram buckets
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+# Upper bounds (bytes) of the file size histogram buckets
+SIZE_BUCKETS = (1e4, 1e5, 1e6, 1e7, 1e8, 1e9, 1e10, 1e11)
+
+# Error classes, in the order their messages are tested by classify_error
+ERROR_CLASSES = ("AUTHOR", "MODEL", "KEYWORDS", "ACCURACY", "END", "section-order", "filename", "prediction")
+
+
+def classify_error(errmsg):
+    """ Maps an error message returned by a checker to one of ERROR_CLASSES """
+    if errmsg is None:
+        return None
+    for record_type in ("AUTHOR", "MODEL", "KEYWORDS", "ACCURACY", "END"):
+        if "{}:".format(record_type) in errmsg:
+            return record_type
+    if "Too many models" in errmsg:
+        return "MODEL"
+    if "Sections found in the file" in errmsg:
+        return "section-order"
+    if "filename" in errmsg or "file name" in errmsg:
+        return "filename"
+    return "prediction"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(key, str(value).replace('"', '\\"')) for key, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Histogram(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class MetricsRegistry(object):
+    """
+    A minimal counter / histogram registry that renders the OpenMetrics text format.
+    All updates go through update(), which takes one lock for a whole batch of changes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # name -> (type, help)
+        self._meta = {}
+        # (name, labels) -> value
+        self._counters = {}
+        # (name, labels) -> _Histogram
+        self._histograms = {}
+        self._buckets = {}
+
+    def counter(self, name, help_text):
+        self._meta[name] = ("counter", help_text)
+
+    def histogram(self, name, help_text, buckets):
+        self._meta[name] = ("histogram", help_text)
+        self._buckets[name] = tuple(buckets)
+
+    def update(self, increments=(), observations=()):
+        """
+        increments: iterable of (name, labels, amount) for counters
+        observations: iterable of (name, labels, value) for histograms
+        labels are tuples of (key, value) pairs
+        """
+        with self._lock:
+            for name, labels, amount in increments:
+                key = (name, tuple(labels))
+                self._counters[key] = self._counters.get(key, 0) + amount
+            for name, labels, value in observations:
+                key = (name, tuple(labels))
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = _Histogram(self._buckets[name])
+                histogram.observe(value)
+
+    def value(self, name, labels=()):
+        """ Returns the current value of a counter """
+        with self._lock:
+            return self._counters.get((name, tuple(labels)), 0)
+
+    def render(self):
+        """ Returns the metrics in the OpenMetrics text exposition format """
+        out = []
+        with self._lock:
+            for name in sorted(self._meta):
+                metric_type, help_text = self._meta[name]
+                out.append("# HELP {} {}".format(name, help_text))
+                out.append("# TYPE {} {}".format(name, metric_type))
+                if metric_type == "counter":
+                    for (key_name, labels), value in sorted(self._counters.items()):
+                        if key_name == name:
+                            out.append("{}_total{} {}".format(name, _format_labels(labels), _format_value(value)))
+                else:
+                    for (key_name, labels), histogram in sorted(self._histograms.items()):
+                        if key_name != name:
+                            continue
+                        cumulative = 0
+                        for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                            cumulative += count
+                            bucket_labels = labels + (("le", "+Inf" if bound == float("inf") else repr(float(bound))),)
+                            out.append("{}_bucket{} {}".format(name, _format_labels(bucket_labels), cumulative))
+                        out.append("{}_sum{} {}".format(name, _format_labels(labels), repr(histogram.total)))
+                        out.append("{}_count{} {}".format(name, _format_labels(labels), histogram.count))
+        out.append("# EOF")
+        return "\n".join(out) + "\n"
+
+
+def counted_lines(lines):
+    """
+    Wraps an iterable of lines so the number of lines consumed can be read afterwards without any
+    Python-level work per line.  Returns (lines, count); call count() once, after the lines have been
+    consumed, to get the number of lines taken.
+    """
+    counter = itertools.count()
+    # zip() pulls from lines first, so the counter only advances for lines actually handed out
+    wrapped = map(operator.itemgetter(0), zip(lines, counter))
+    return wrapped, functools.partial(next, counter)
+
+
+class ValidationMetrics(object):
+    """
+    The intake metrics: files validated per type and result, lines, bytes read, validation latency,
+    error classes and cache hits.
+    """
+
+    def __init__(self, registry=None):
+        if registry is None:
+            registry = MetricsRegistry()
+        self.registry = registry
+        registry.counter("cafa_files_validated", "Prediction files validated, by file type and result")
+        registry.counter("cafa_lines_validated", "Prediction file lines read by the checkers")
+        registry.counter("cafa_bytes_read", "Bytes of prediction data read, after decompression")
+        registry.counter("cafa_validation_errors", "Rejected prediction files, by error class")
+        registry.counter("cafa_validation_seconds", "Total time spent validating prediction files")
+        registry.counter("cafa_cache_hits", "Cache lookups that found a reusable result, by cache")
+        registry.counter("cafa_cache_misses", "Cache lookups that did not find a reusable result, by cache")
+        registry.histogram("cafa_validation_latency_seconds", "Time to validate one prediction file", LATENCY_BUCKETS)
+        registry.histogram("cafa_file_size_bytes", "Size of validated prediction files", SIZE_BUCKETS)
+
+    def observe_file(self, file_type, correct, errmsg, lines, nbytes, seconds):
+        """ Records everything about one validated file in a single registry update; correct is None if inconclusive """
+        if correct is None:
+            result = "inconclusive"
+        else:
+            result = "passed" if correct else "failed"
+        file_type = file_type or "unknown"
+        increments = [
+            ("cafa_files_validated", (("type", file_type), ("result", result)), 1),
+            ("cafa_lines_validated", (("type", file_type),), lines),
+            ("cafa_bytes_read", (("type", file_type),), nbytes),
+            ("cafa_validation_seconds", (("type", file_type),), seconds),
+        ]
+        if correct is False:
+            increments.append(("cafa_validation_errors", (("class", classify_error(errmsg)),), 1))
+        self.registry.update(
+            increments,
+            [
+                ("cafa_validation_latency_seconds", (("type", file_type),), seconds),
+                ("cafa_file_size_bytes", (("type", file_type),), nbytes),
+            ],
+        )
+
+    def observe_cache(self, cache, hit):
+        name = "cafa_cache_hits" if hit else "cafa_cache_misses"
+        self.registry.update([(name, (("cache", cache),), 1)])
+
+    def replay(self, recorder):
+        """ Applies the observations a MetricsRecorder kept in a worker process """
+        for method, args in recorder.calls:
+            getattr(self, method)(*args)
+
+    def write_textfile(self, path):
+        """
+        Writes the metrics for the node_exporter textfile collector.  The file is replaced atomically so the
+        collector never reads a partial file.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        handle, tmp_path = tempfile.mkstemp(dir=directory, prefix=".cafa_metrics")
+        try:
+            with os.fdopen(handle, "w") as out_handle:
+                out_handle.write(self.registry.render())
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    def serve(self, port, host=""):
+        """
+        Serves the metrics at http://host:port/metrics from a daemon thread, for service mode.
+        Returns the HTTP server; call shutdown() on it to stop serving.
+        """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        registry = self.registry
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/openmetrics-text; version=1.0.0; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        thread = threading.Thread(target=server.serve_forever, name="cafa-metrics", daemon=True)
+        thread.start()
+        return server
+
+
+class MetricsRecorder(object):
+    """
+    Stands in for ValidationMetrics where the registry is in another process: the observations are kept,
+    pickled back with the result, and applied to the registry with ValidationMetrics.replay().
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def observe_file(self, *args):
+        self.calls.append(("observe_file", args))
+
+    def observe_cache(self, *args):
+        self.calls.append(("observe_cache", args))
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import codecs
+import queue
+import threading
+
+"""
+Pipelined reading of zip members.
+
+pipelined_lines() starts a background thread that reads (and so inflates) a member in BLOCK_SIZE blocks
+into a queue of at most QUEUE_BLOCKS blocks, while the calling thread decodes the blocks and hands
+complete lines to the checker.  zlib and the zip CRC check release the GIL, so inflating the next blocks
+overlaps with validating the current one.  The queue bound is the backpressure: when the checker falls
+behind the reader thread blocks, and at most about (QUEUE_BLOCKS + 2) * BLOCK_SIZE of decompressed data is
+held at once, whatever the member size.
+
+Lines are str without their newline, and like the old read().strip().split() the blank lines at the start
+and at the end of the member are dropped.  If the checker stops early (first error) the reader thread is
+stopped as well.
+"""
+
+BLOCK_SIZE = 1 << 20
+QUEUE_BLOCKS = 8
+
+_END = object()
+
+
+class _ReadFailure(object):
+    def __init__(self, error):
+        self.error = error
+
+
+def _blank(line):
+    return not line or line.isspace()
+
+
+def pipelined_lines(raw, block_size=BLOCK_SIZE, max_blocks=QUEUE_BLOCKS, encoding="utf-8"):
+    """ Yields the lines of the binary file object raw (e.g. ZipFile.open()) while it is read on another thread """
+    blocks = queue.Queue(max_blocks)
+    stop = threading.Event()
+
+    def put(item):
+        # a bounded put that gives up once the consumer has gone away
+        while not stop.is_set():
+            try:
+                blocks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def read_blocks():
+        try:
+            while not stop.is_set():
+                block = raw.read(block_size)
+                if not block:
+                    break
+                put(block)
+        except Exception as error:
+            put(_ReadFailure(error))
+        put(_END)
+
+    reader = threading.Thread(target=read_blocks, name="cafa-inflate", daemon=True)
+    reader.start()
+    try:
+        decode = codecs.getincrementaldecoder(encoding)("replace").decode
+        tail = ""
+        started = False
+        # blank lines at the end of the previous block: dropped if the member ends there
+        held = []
+        while True:
+            item = blocks.get()
+            if item is _END:
+                text = tail + decode(b"", True)
+                lines = text.split("\n")
+                tail = None
+            elif isinstance(item, _ReadFailure):
+                raise item.error
+            else:
+                lines = (tail + decode(item)).split("\n")
+                tail = lines.pop()
+
+            if not started:
+                while lines and _blank(lines[0]):
+                    del lines[0]
+                if not lines:
+                    if tail is None:
+                        return
+                    continue
+                lines[0] = lines[0].lstrip()
+                started = True
+            end = len(lines)
+            while end and _blank(lines[end - 1]):
+                end -= 1
+            if end:
+                if held:
+                    yield from held
+                    held = []
+                if end == len(lines):
+                    yield from lines
+                else:
+                    yield from lines[:end]
+                    held.extend(lines[end:])
+            else:
+                held.extend(lines)
+            if tail is None:
+                return
+    finally:
+        stop.set()
+        reader.join()
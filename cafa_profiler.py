@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import cProfile
+import sys
+import time
+from contextlib import contextmanager
+
+import cafa_go_format_checker
+import cafa_hpo_format_checker
+import cafa_do_format_checker
+import cafa_binding_site_format_checker
+
+"""
+Profiling support for the CAFA format checkers.
+
+The per-ontology cafa_checker functions look up their validators (author_check, go_prediction_check, ...),
+their regular expressions (target_field, go_field, ...), handle_error and float() through the module globals
+at call time.  ValidationProfiler temporarily replaces those globals with timed wrappers while it is
+installed, and restores the originals afterwards.  The valid_prediction_line shortcut stays on, so the
+profile is of the path validation really takes: the prediction lines it accepts are counted as its own
+entry of the prediction record type, and the lines it rejects (header lines, errors) as
+valid_prediction_line.miss before they go on to their validators.  Nothing in the checkers changes, so
+when profiling is not requested there is no cost at all.
+"""
+
+CHECKER_MODULES = (
+    cafa_go_format_checker,
+    cafa_hpo_format_checker,
+    cafa_do_format_checker,
+    cafa_binding_site_format_checker,
+)
+
+# validator function name -> record type (state) it is called for
+VALIDATOR_STATES = {
+    "author_check": "author",
+    "model_check": "model",
+    "keywords_check": "keywords",
+    "accuracy_check": "accuracy",
+    "go_prediction_check": "prediction",
+    "hpo_prediction_check": "prediction",
+    "do_prediction_check": "prediction",
+    "binding_site_prediction_check": "prediction",
+    "valid_prediction_line": "prediction",
+    "end_check": "end",
+}
+
+# marks globals that did not exist before install(), such as float
+_MISSING = object()
+
+REPORT_STATES = ("author", "model", "keywords", "accuracy", "prediction", "end")
+
+REGEX_NAMES = (
+    "pr_field",
+    "rc_field",
+    "go_field",
+    "hpo_field",
+    "do_field",
+    "target_field",
+    "type_field",
+    "prediction_field",
+    "confidence_field",
+)
+
+
+class _TimedPattern(object):
+    """ Stands in for a compiled regular expression and times its match() calls """
+
+    def __init__(self, profiler, name, pattern):
+        self._profiler = profiler
+        self._name = name + ".match"
+        self._pattern = pattern
+
+    def match(self, *args, **kwargs):
+        return self._profiler.call(self._name, self._pattern.match, args, kwargs)
+
+    def __getattr__(self, attr):
+        return getattr(self._pattern, attr)
+
+
+class ValidationProfiler(object):
+    """
+    Collects cumulative time and call counts per record type, per validator and per regular expression,
+    plus the time spent waiting for input lines (reading / decompressing) versus validating them.
+
+    Usage:
+        profiler = ValidationProfiler()
+        with profiler:
+            cafa4_format_checker.cafa_checker(path, profiler=profiler)
+        profiler.report()
+
+    cprofile_path: if set, a cProfile run is recorded for the same period and dumped to this path
+    modules: checker modules to instrument, CHECKER_MODULES by default
+    """
+
+    def __init__(self, cprofile_path=None, modules=CHECKER_MODULES):
+        self.cprofile_path = cprofile_path
+        self.modules = []
+        for module in modules:
+            if module not in self.modules:
+                self.modules.append(module)
+        # call path (tuple of names) -> [calls, inclusive seconds]
+        self.timings = {}
+        # phase name (zip_directory, precheck) -> [calls, seconds]
+        self.phases = {}
+        self.io_time = 0.0
+        self.lines = 0
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self._stack = []
+        self._saved = []
+        self._cprofile = None
+        self._wall_start = None
+        self._cpu_start = None
+
+    def call(self, name, function, args, kwargs):
+        """ Runs function(*args, **kwargs) and charges the elapsed time to name under the current call path """
+        self._stack.append(name)
+        path = tuple(self._stack)
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            self._stack.pop()
+            self._record(path, elapsed)
+
+    def _record(self, path, elapsed):
+        entry = self.timings.get(path)
+        if entry is None:
+            self.timings[path] = [1, elapsed]
+        else:
+            entry[0] += 1
+            entry[1] += elapsed
+
+    def _wrap(self, name, function):
+        def timed(*args, **kwargs):
+            return self.call(name, function, args, kwargs)
+
+        timed.__name__ = getattr(function, "__name__", name)
+        timed.__wrapped__ = function
+        return timed
+
+    def _wrap_fast_path(self, function):
+        """ Times valid_prediction_line, charging the lines it accepts and those it rejects separately """
+
+        def timed(line):
+            start = time.perf_counter()
+            matched = function(line)
+            elapsed = time.perf_counter() - start
+            name = "valid_prediction_line" if matched else "valid_prediction_line.miss"
+            self._record(tuple(self._stack) + (name,), elapsed)
+            return matched
+
+        timed.__wrapped__ = function
+        return timed
+
+    def install(self):
+        """ Replaces validators, regular expressions, handle_error and float() in the checker modules """
+        if self._saved:
+            return
+        for module in self.modules:
+            namespace = vars(module)
+            replacements = {}
+            for name in VALIDATOR_STATES:
+                if name in namespace:
+                    replacements[name] = self._wrap(name, namespace[name])
+            if "handle_error" in namespace:
+                replacements["handle_error"] = self._wrap("handle_error", namespace["handle_error"])
+            for name in REGEX_NAMES:
+                if name in namespace:
+                    replacements[name] = _TimedPattern(self, name, namespace[name])
+            if "valid_prediction_line" in namespace:
+                replacements["valid_prediction_line"] = self._wrap_fast_path(namespace["valid_prediction_line"])
+            # Shadow the float builtin for the module so confidence parsing shows up separately
+            replacements["float"] = self._wrap("float()", float)
+            for name, replacement in replacements.items():
+                self._saved.append((namespace, name, namespace.get(name, _MISSING)))
+                namespace[name] = replacement
+
+    def uninstall(self):
+        """ Restores everything replaced by install() """
+        while self._saved:
+            namespace, name, original = self._saved.pop()
+            if original is _MISSING:
+                del namespace[name]
+            else:
+                namespace[name] = original
+
+    def __enter__(self):
+        self.install()
+        if self.cprofile_path:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.wall_time += time.perf_counter() - self._wall_start
+        self.cpu_time += time.process_time() - self._cpu_start
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(self.cprofile_path)
+            self._cprofile = None
+        self.uninstall()
+        return False
+
+    @contextmanager
+    def phase(self, name):
+        """ Times a block of work outside the per-line loop, e.g. reading a zip directory or the precheck """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry = self.phases.setdefault(name, [0, 0.0])
+            entry[0] += 1
+            entry[1] += time.perf_counter() - start
+
+    def timed_lines(self, lines):
+        """ Wraps an iterable of input lines, charging the time spent producing each line to I/O """
+        iterator = iter(lines)
+        while True:
+            start = time.perf_counter()
+            try:
+                line = next(iterator)
+            except StopIteration:
+                self.io_time += time.perf_counter() - start
+                return
+            self.io_time += time.perf_counter() - start
+            self.lines += 1
+            yield line
+
+    def top_level(self):
+        """ Returns {name: [calls, seconds]} for calls made directly by the checkers """
+        totals = {}
+        for path, (calls, seconds) in self.timings.items():
+            if len(path) == 1:
+                entry = totals.setdefault(path[0], [0, 0.0])
+                entry[0] += calls
+                entry[1] += seconds
+        return totals
+
+    def by_name(self):
+        """ Returns {name: [calls, seconds]} summed over every call path the name appears at the end of """
+        totals = {}
+        for path, (calls, seconds) in self.timings.items():
+            entry = totals.setdefault(path[-1], [0, 0.0])
+            entry[0] += calls
+            entry[1] += seconds
+        return totals
+
+    def state_totals(self):
+        """ Returns {state: [calls, seconds]} for the record types in REPORT_STATES """
+        totals = dict((state, [0, 0.0]) for state in REPORT_STATES)
+        for name, (calls, seconds) in self.top_level().items():
+            state = VALIDATOR_STATES.get(name)
+            if state is not None:
+                totals[state][0] += calls
+                totals[state][1] += seconds
+        return totals
+
+    def report(self, out=None):
+        """ Prints the collected timings """
+        if out is None:
+            out = sys.stderr
+        io_time = self.io_time + sum(seconds for calls, seconds in self.phases.values())
+        out.write("____________________________________________\n")
+        out.write("Profile\n")
+        out.write("Wall time: {:.4f}s  CPU time: {:.4f}s  lines: {}\n".format(self.wall_time, self.cpu_time, self.lines))
+        out.write("I/O (read, decompress, split): {:.4f}s  validation: {:.4f}s\n".format(
+            io_time, max(self.wall_time - io_time, 0.0)))
+        for name in sorted(self.phases):
+            calls, seconds = self.phases[name]
+            out.write("  {:<30} {:>10} calls {:>10.4f}s\n".format(name, calls, seconds))
+        out.write("\nPer record type:\n")
+        for state, (calls, seconds) in self.state_totals().items():
+            out.write("  {:<30} {:>10} calls {:>10.4f}s\n".format(state, calls, seconds))
+        out.write("\nPer validator / regular expression:\n")
+        totals = self.by_name()
+        for name in sorted(totals, key=lambda name: -totals[name][1]):
+            calls, seconds = totals[name]
+            out.write("  {:<30} {:>10} calls {:>10.4f}s\n".format(name, calls, seconds))
+
+    def dump_collapsed(self, path):
+        """
+        Writes the call paths as collapsed stacks ("a;b;c <microseconds>"), the input format of
+        flamegraph.pl and speedscope.  Each line carries the self time of its innermost frame.
+        """
+        self_times = dict((path, seconds) for path, (calls, seconds) in self.timings.items())
+        for call_path, (calls, seconds) in self.timings.items():
+            if len(call_path) > 1:
+                self_times[call_path[:-1]] = self_times.get(call_path[:-1], 0.0) - seconds
+        with open(path, "w") as out_handle:
+            out_handle.write("io {}\n".format(int(self.io_time * 1e6)))
+            for name, (calls, seconds) in sorted(self.phases.items()):
+                out_handle.write("{} {}\n".format(name, int(seconds * 1e6)))
+            for call_path in sorted(self_times):
+                micros = int(max(self_times[call_path], 0.0) * 1e6)
+                out_handle.write("cafa_checker;{} {}\n".format(";".join(call_path), micros))
+
+
+def add_profile_arguments(parser):
+    """ Adds the --profile options to an argparse parser """
+    parser.add_argument("--profile", action="store_true", help="report time spent per record type and validator")
+    parser.add_argument("--cprofile-output", metavar="PATH", help="with --profile, also dump cProfile stats to PATH")
+    parser.add_argument("--collapsed-output", metavar="PATH",
+                        help="with --profile, also write collapsed flame graph stacks to PATH")
+
+
+def profiler_from_args(args, modules=CHECKER_MODULES):
+    """ Returns a ValidationProfiler for parsed --profile arguments, or None if profiling was not requested """
+    if not args.profile:
+        return None
+    return ValidationProfiler(cprofile_path=args.cprofile_output, modules=modules)
+
+
+def finish_profile(profiler, args):
+    """ Prints the report and writes the collapsed stacks requested on the command line """
+    profiler.report()
+    if args.collapsed_output:
+        profiler.dump_collapsed(args.collapsed_output)
+
+
+def single_file_main(cafa_checker, argv=None):
+    """
+    Command line entry point shared by the per-ontology checkers: validates one plain prediction file
+    with cafa_checker(handle, filename) and prints the result.
+    """
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input_file", help="path to the prediction file")
+    add_profile_arguments(parser)
+    parser.add_argument("--time-budget", type=float, metavar="SECONDS",
+                        help="stop after SECONDS and report the partial result as inconclusive")
+    args = parser.parse_args(argv)
+
+    # When a checker is run as a script its module is __main__, not the imported copy in CHECKER_MODULES
+    checker_module = sys.modules[cafa_checker.__module__]
+    profiler = profiler_from_args(args, modules=CHECKER_MODULES + (checker_module,))
+    check = cafa_checker
+    if args.time_budget is not None:
+        from cafa_deadline import Deadline, bounded_check
+
+        deadline = Deadline(args.time_budget)
+
+        def check(lines, filename):
+            return bounded_check(cafa_checker, lines, filename, deadline)[:2]
+
+    with open(args.input_file, "r") as handle:
+        filename = os.path.basename(args.input_file)
+        if profiler is None:
+            is_valid, error_msg = check(handle, filename)
+        else:
+            with profiler:
+                is_valid, error_msg = check(profiler.timed_lines(handle), filename)
+    print("Is Valid: {}".format(is_valid))
+    print("Message: {}".format(error_msg))
+    if profiler is not None:
+        finish_profile(profiler, args)
+    return is_valid
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import sys
+import time
+from collections import namedtuple
+
+from cafa_sections import SECTION_WORDS
+
+"""
+Live progress reporting for large prediction files.
+
+ProgressReporter.track() wraps the lines handed to a checker.  It only counts lines and bytes per line;
+the clock is looked at once every check_every lines, and a snapshot is passed to the callback at most
+once per interval.  Bytes are counted encoded (UTF-8), so they add up to the file size the ETA is based
+on: ZipInfo.file_size for zip members and os.stat for plain files.
+
+Files validated by workers (--member-workers, --chunk-workers, --binding-workers) are not read here:
+ProgressReporter.collect() reports them from the counts that come back with each worker's result (a
+member, a byte range, a batch of target blocks), in the thread that collects the results.
+"""
+
+ProgressSnapshot = namedtuple(
+    "ProgressSnapshot",
+    ["filename", "bytes_done", "bytes_total", "lines", "state", "lines_per_sec", "eta_seconds"],
+)
+
+def section_of(line):
+    """ Returns the record type (state) of a line, the same way the checkers decide it """
+    fields = line.split(None, 1)
+    if not fields:
+        return "prediction"
+    field1 = fields[0]
+    if isinstance(field1, bytes):
+        field1 = field1.decode("utf-8", "replace")
+    return SECTION_WORDS.get(field1, "prediction")
+
+
+def format_snapshot(snapshot):
+    """ One status line, e.g. 'big_1_9606.txt  1200.0/20000.0 MB (6%)  3,000,000 lines  prediction  850,000 lines/s  ETA 6m12s' """
+    if snapshot.bytes_total:
+        done = "{:.1f}/{:.1f} MB ({:.0%})".format(
+            snapshot.bytes_done / 1e6, snapshot.bytes_total / 1e6, min(snapshot.bytes_done / float(snapshot.bytes_total), 1.0)
+        )
+    else:
+        done = "{:.1f} MB".format(snapshot.bytes_done / 1e6)
+    if snapshot.eta_seconds is None:
+        eta = "ETA --"
+    else:
+        minutes, seconds = divmod(int(snapshot.eta_seconds), 60)
+        eta = "ETA {}m{:02d}s".format(minutes, seconds)
+    return "{}  {}  {:,} lines  {}  {:,.0f} lines/s  {}".format(
+        snapshot.filename, done, snapshot.lines, snapshot.state, snapshot.lines_per_sec, eta
+    )
+
+
+def stderr_callback(snapshot, final=False):
+    """ Default callback: keeps one status line updated on stderr """
+    sys.stderr.write("\r" + format_snapshot(snapshot).ljust(100))
+    if final:
+        sys.stderr.write("\n")
+    sys.stderr.flush()
+
+
+def _make_snapshot(filename, bytes_done, bytes_total, lines, state, elapsed):
+    lines_per_sec = lines / elapsed if elapsed > 0 else 0.0
+    eta = None
+    if bytes_total and bytes_done and elapsed > 0:
+        eta = max(bytes_total - bytes_done, 0) * elapsed / float(bytes_done)
+    return ProgressSnapshot(filename, bytes_done, bytes_total, lines, state, lines_per_sec, eta)
+
+
+class ProgressReporter(object):
+    """
+    callback: called as callback(snapshot, final=False); stderr_callback by default
+    interval: minimum seconds between two callbacks
+    check_every: number of lines between two looks at the clock
+    """
+
+    def __init__(self, callback=stderr_callback, interval=1.0, check_every=8192):
+        self.callback = callback
+        self.interval = interval
+        self.check_every = check_every
+
+    def track(self, lines, filename, bytes_total, stripped=True):
+        """
+        Yields the lines unchanged while reporting progress through the callback.
+        stripped: the lines come without their newline (zip members split on b"\n"), so count one byte for it
+        """
+        newline = 1 if stripped else 0
+        callback = self.callback
+        check_every = self.check_every
+        start = time.monotonic()
+        next_report = start + self.interval
+        bytes_done = 0
+        line_count = 0
+        countdown = check_every
+        line = ""
+        try:
+            for line in lines:
+                # str.isascii() is a flag lookup; only other lines are encoded to count their bytes
+                bytes_done += (len(line) if line.isascii() else len(line.encode("utf-8"))) + newline
+                line_count += 1
+                countdown -= 1
+                if not countdown:
+                    countdown = check_every
+                    now = time.monotonic()
+                    if callback is not None and now >= next_report:
+                        next_report = now + self.interval
+                        callback(
+                            _make_snapshot(filename, bytes_done, bytes_total, line_count, section_of(line), now - start)
+                        )
+                yield line
+        finally:
+            # Also reached when a checker stops at the first error and the generator is closed
+            if callback is not None:
+                elapsed = time.monotonic() - start
+                callback(
+                    _make_snapshot(filename, bytes_done, bytes_total, line_count, section_of(line), elapsed), final=True
+                )
+
+
+    def collect(self, filename, bytes_total):
+        """ A WorkerProgress reporting through this reporter's callback """
+        return WorkerProgress(self.callback, self.interval, filename, bytes_total)
+
+
+class WorkerProgress(object):
+    """
+    Progress of a file (or of the members of an archive) validated by workers.  update() is called with the
+    running totals as the workers' results are collected, close() once they all are.
+    """
+
+    def __init__(self, callback, interval, filename, bytes_total):
+        self.callback = callback
+        self.interval = interval
+        self.filename = filename
+        self.bytes_total = bytes_total
+        self.start = time.monotonic()
+        self.next_report = self.start + interval
+        self.bytes_done = 0
+        self.lines = 0
+        self.state = "prediction"
+
+    def update(self, bytes_done, lines, state=None):
+        """ bytes_done and lines: the totals so far; state: the section reached, unchanged if None """
+        self.bytes_done = bytes_done
+        self.lines = lines
+        if state is not None:
+            self.state = state
+        now = time.monotonic()
+        if self.callback is not None and now >= self.next_report:
+            self.next_report = now + self.interval
+            self.callback(self._snapshot(now))
+
+    def close(self):
+        if self.callback is not None:
+            self.callback(self._snapshot(time.monotonic()), final=True)
+
+    def _snapshot(self, now):
+        return _make_snapshot(self.filename, self.bytes_done, self.bytes_total, self.lines, self.state, now - self.start)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
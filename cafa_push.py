@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import codecs
+
+from cafa_records import InvalidRecordError, RecordValidator
+
+"""
+Push-style validation of a prediction file that arrives in pieces, e.g. an upload being received.
+
+    validator = PushValidator("ateam_1_9606.txt")
+    for chunk in request_body:
+        validator.feed(chunk)        # raises InvalidRecordError at the first error
+    correct, errmsg = validator.close()
+
+feed() takes bytes in pieces of any size: it decodes them incrementally (a character split between two
+pieces is fine), validates every line completed by the piece with cafa_records.RecordValidator (the GO,
+HPO, DO or binding-site checker, chosen from the file name) and keeps the incomplete last line for the
+next piece.  An error in a line is raised by the feed() that completes it, so a broken upload can be
+rejected before the transfer finishes.  Once an error was raised, every later feed() and close() raises
+it again.  close() validates the last line and returns the checker's (True, message), or raises its error,
+e.g. for sections out of order.
+
+As for zip members, blank lines at the start and at the end of the file are ignored; line numbers in the
+messages count every line received.
+"""
+
+
+class PushValidator(object):
+    def __init__(self, fileName, kind=None, encoding="utf-8"):
+        self.fileName = fileName
+        self.validator = RecordValidator(fileName, kind)
+        self.error = None
+        self.closed = False
+        self.result = None
+        self._decode = codecs.getincrementaldecoder(encoding)("replace").decode
+        self._tail = ""
+        self._started = False
+        # blank lines seen since the last line validated: an error only if a line follows them
+        self._blank_lines = 0
+
+    @property
+    def kind(self):
+        return self.validator.kind
+
+    @property
+    def line_num(self):
+        """ Lines validated so far """
+        return self.validator.line_num
+
+    def feed(self, data):
+        """ Validates the lines completed by data (bytes) """
+        if self.error is not None:
+            raise self.error
+        if self.closed:
+            raise ValueError("feed() after close()")
+        lines = (self._tail + self._decode(data)).split("\n")
+        self._tail = lines.pop()
+        self._validate(lines)
+
+    def close(self):
+        """ Validates the rest of the file; returns (True, message) or raises InvalidRecordError """
+        if self.error is not None:
+            raise self.error
+        if not self.closed:
+            self.closed = True
+            last = self._tail + self._decode(b"", True)
+            self._tail = ""
+            self._validate(last.split("\n"))
+            try:
+                self.result = self.validator.finish()
+            except InvalidRecordError as error:
+                self.error = error
+                raise
+        return self.result
+
+    def _validate(self, lines):
+        validator = self.validator
+        feed = validator.feed
+        try:
+            for line in lines:
+                if not line or line.isspace():
+                    self._blank_lines += 1
+                    continue
+                if not self._started:
+                    # leading blank lines only move the line numbers
+                    validator.line_num += self._blank_lines
+                    self._blank_lines = 0
+                    line = line.lstrip()
+                    self._started = True
+                elif self._blank_lines:
+                    # a blank line inside the file: RecordValidator reports it
+                    feed("")
+                feed(line)
+        except InvalidRecordError as error:
+            self.error = error
+            raise
+
+
+def check_chunks(chunks, fileName, kind=None):
+    """ Validates a file given as an iterable of bytes pieces; returns (correct, errmsg) like the checkers """
+    validator = PushValidator(fileName, kind)
+    try:
+        for chunk in chunks:
+            validator.feed(chunk)
+        return validator.close()
+    except InvalidRecordError as error:
+        return False, error.errmsg
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import uuid
+
+"""
+Work queues for distributed validation (cafa_distributed).
+
+A WorkQueue holds tasks (JSON-able dicts) until a worker claims one, and their results until the
+coordinator has collected them.  A claim is a lease: a task whose worker dies is handed out again once
+lease_seconds have passed, so a result may be computed twice; complete() keeps the first one.
+
+    DirectoryQueue(path)   a directory on a local or shared filesystem: one JSON file per task and per result,
+                           claims hard-linked into place, leases taken over with an atomic rename
+    SQLiteQueue(path)      one SQLite database file, claims made in an IMMEDIATE transaction
+
+open_queue("dir:/srv/cafa-queue") or open_queue("sqlite:/srv/cafa-queue.db") picks a backend by scheme;
+another backend (a message broker, a cloud queue) subclasses WorkQueue and is added to QUEUE_BACKENDS.
+"""
+
+DEFAULT_LEASE_SECONDS = 3600
+
+
+class WorkQueue(object):
+    """ The interface of a queue backend """
+
+    def put(self, task_id, task):
+        """ Adds task under task_id; task ids sort in the order tasks should be handed out """
+        raise NotImplementedError
+
+    def claim(self, worker, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """ Leases the first unclaimed (or expired) task without a result: (task_id, task), or None """
+        raise NotImplementedError
+
+    def complete(self, task_id, result):
+        """ Stores the result of task_id (a JSON-able dict); the first result stored is kept """
+        raise NotImplementedError
+
+    def result(self, task_id):
+        """ The result of task_id, or None if it is not done """
+        raise NotImplementedError
+
+    def discard(self, task_ids):
+        """ Removes the tasks and their results """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+def new_job_id():
+    """ A job id that sorts after the ones made before it, so older submissions are handed out first """
+    return "%013d-%s" % (int(time.time() * 1000), uuid.uuid4().hex[:8])
+
+
+def _write_json(directory, name, data):
+    handle, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp")
+    try:
+        with os.fdopen(handle, "w") as out_handle:
+            json.dump(data, out_handle)
+        os.replace(tmp_path, os.path.join(directory, name))
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def _read_json(path):
+    try:
+        with open(path) as in_handle:
+            return json.load(in_handle)
+    except FileNotFoundError:
+        return None
+
+
+class DirectoryQueue(WorkQueue):
+    """
+    path/tasks/<id>.json     the task
+    path/claims/<id>         the lease: worker and expiry time; written to a temporary file and linked to
+                             this name, which fails if it exists
+    path/results/<id>.json   the result
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.tasks_dir = os.path.join(path, "tasks")
+        self.claims_dir = os.path.join(path, "claims")
+        self.results_dir = os.path.join(path, "results")
+        for directory in (self.tasks_dir, self.claims_dir, self.results_dir):
+            os.makedirs(directory, exist_ok=True)
+
+    def put(self, task_id, task):
+        _write_json(self.tasks_dir, task_id + ".json", task)
+
+    def _try_claim(self, task_id, worker, lease_seconds):
+        claim_path = os.path.join(self.claims_dir, task_id)
+        while True:
+            now = time.time()
+            # the lease is written whole under a temporary name and linked into place: link() fails if there is
+            # a claim already, and a claim is never seen half written
+            handle, tmp_path = tempfile.mkstemp(dir=self.claims_dir, prefix=".tmp")
+            try:
+                with os.fdopen(handle, "w") as out_handle:
+                    json.dump({"worker": worker, "expires": now + lease_seconds}, out_handle)
+                os.link(tmp_path, claim_path)
+                return True
+            except FileExistsError:
+                pass
+            finally:
+                os.unlink(tmp_path)
+            lease = _read_json(claim_path)
+            if lease is None:
+                # taken over or discarded meanwhile
+                continue
+            if lease["expires"] > now:
+                return False
+            # expired: whoever renames it away takes the task over
+            expired_path = "%s.expired-%s" % (claim_path, uuid.uuid4().hex)
+            try:
+                os.rename(claim_path, expired_path)
+            except FileNotFoundError:
+                return False
+            taken = _read_json(expired_path)
+            if taken["expires"] > now:
+                # another worker took the expired lease over between the read and the rename: this is its live
+                # lease, put it back.  If a third worker has claimed the task in the meantime, the task is
+                # computed twice, which complete() allows for.
+                try:
+                    os.link(expired_path, claim_path)
+                except FileExistsError:
+                    pass
+                os.unlink(expired_path)
+                return False
+
+    def claim(self, worker, lease_seconds=DEFAULT_LEASE_SECONDS):
+        done = set(os.listdir(self.results_dir))
+        for name in sorted(os.listdir(self.tasks_dir)):
+            if not name.endswith(".json") or name in done:
+                continue
+            task_id = name[:-len(".json")]
+            if not self._try_claim(task_id, worker, lease_seconds):
+                continue
+            task = _read_json(os.path.join(self.tasks_dir, name))
+            if task is None or os.path.exists(os.path.join(self.results_dir, name)):
+                # discarded or completed by another worker meanwhile
+                continue
+            return task_id, task
+        return None
+
+    def complete(self, task_id, result):
+        if not os.path.exists(os.path.join(self.results_dir, task_id + ".json")):
+            _write_json(self.results_dir, task_id + ".json", result)
+
+    def result(self, task_id):
+        return _read_json(os.path.join(self.results_dir, task_id + ".json"))
+
+    def discard(self, task_ids):
+        for task_id in task_ids:
+            for path in (os.path.join(self.tasks_dir, task_id + ".json"), os.path.join(self.claims_dir, task_id),
+                         os.path.join(self.results_dir, task_id + ".json")):
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+        for name in os.listdir(self.claims_dir):
+            if ".expired-" in name and name.split(".expired-")[0] in task_ids:
+                os.unlink(os.path.join(self.claims_dir, name))
+
+
+class SQLiteQueue(WorkQueue):
+    def __init__(self, path, timeout=60.0):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS tasks (id TEXT PRIMARY KEY, task TEXT NOT NULL, worker TEXT, "
+            "expires REAL, result TEXT)"
+        )
+
+    def put(self, task_id, task):
+        self.connection.execute("INSERT OR REPLACE INTO tasks (id, task) VALUES (?, ?)", (task_id, json.dumps(task)))
+
+    def claim(self, worker, lease_seconds=DEFAULT_LEASE_SECONDS):
+        now = time.time()
+        connection = self.connection
+        # IMMEDIATE takes the write lock before reading, so two workers cannot pick the same task
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT id, task FROM tasks WHERE result IS NULL AND (expires IS NULL OR expires <= ?) "
+                "ORDER BY id LIMIT 1", (now,)
+            ).fetchone()
+            if row is not None:
+                connection.execute(
+                    "UPDATE tasks SET worker = ?, expires = ? WHERE id = ?", (worker, now + lease_seconds, row[0])
+                )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def complete(self, task_id, result):
+        self.connection.execute(
+            "UPDATE tasks SET result = ? WHERE id = ? AND result IS NULL", (json.dumps(result), task_id)
+        )
+
+    def result(self, task_id):
+        row = self.connection.execute("SELECT result FROM tasks WHERE id = ?", (task_id,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return json.loads(row[0])
+
+    def discard(self, task_ids):
+        self.connection.executemany("DELETE FROM tasks WHERE id = ?", [(task_id,) for task_id in task_ids])
+
+    def close(self):
+        self.connection.close()
+
+
+QUEUE_BACKENDS = {
+    "dir": DirectoryQueue,
+    "sqlite": SQLiteQueue,
+}
+
+
+def open_queue(spec):
+    """
+    The queue named by spec: "<backend>:<location>" with a backend of QUEUE_BACKENDS; a bare path is a
+    SQLite database if it ends in .db or .sqlite, a directory queue otherwise.
+    """
+    scheme, sep, location = spec.partition(":")
+    if sep and scheme in QUEUE_BACKENDS:
+        return QUEUE_BACKENDS[scheme](location)
+    if spec.endswith((".db", ".sqlite")):
+        return SQLiteQueue(spec)
+    return DirectoryQueue(spec)
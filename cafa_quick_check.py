@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import io
+import math
+import os
+import random
+import zipfile
+from collections import namedtuple
+
+from cafa_go_format_checker import (
+    author_check,
+    model_check,
+    keywords_check,
+    accuracy_check,
+    end_check,
+    go_prediction_check,
+)
+from cafa_hpo_format_checker import hpo_prediction_check
+from cafa_do_format_checker import do_prediction_check
+from cafa_binding_site_format_checker import binding_site_prediction_check
+from cafa4_format_checker import archive_members, prediction_kind
+
+"""
+Sampling quick-check mode.
+
+The header (AUTHOR, MODEL, KEYWORDS, ACCURACY) and the END trailer are validated exactly.  The body is
+validated on a random sample of lines: sample offsets are drawn uniformly over the body bytes, sorted, and
+for each one the reader seeks there, skips to the next newline and checks the line that starts after it.
+Plain files are seeked directly.  Zip members are read through ZipFile.open(), whose seek() only has to
+inflate forward (offsets are visited in increasing order) and never validates the skipped data.  The END
+trailer is read last, with one more forward seek to the last TRAILER_BYTES (or to where the sample stopped,
+if that is later), so a member is still inflated at most once.
+
+Sampling by byte offset favours long lines slightly; prediction lines have near-constant length, so the
+estimated error rate is close to the line error rate.  The result carries a 95% Wilson score interval.
+"""
+
+QuickCheckResult = namedtuple(
+    "QuickCheckResult",
+    [
+        "filename", "correct", "header_error", "trailer_error", "sampled", "failed", "rate", "low", "high", "examples",
+    ],
+)
+
+HEADER_CHECKS = {
+    "AUTHOR": ("author", author_check),
+    "MODEL": ("model", model_check),
+    "KEYWORDS": ("keywords", keywords_check),
+    "ACCURACY": ("accuracy", accuracy_check),
+}
+
+# How many bytes at the end of a file are read to find the END trailer
+TRAILER_BYTES = 4096
+
+# How many bytes at the start of a file precheck() reads to get past the header
+PRECHECK_HEAD_BYTES = 64 * 1024
+
+DEFAULT_SAMPLE_SIZE = 2000
+
+
+def wilson_interval(failed, sampled, z=1.96):
+    """ Returns (low, high) of the Wilson score interval for failed / sampled """
+    if sampled == 0:
+        return 0.0, 1.0
+    p = failed / float(sampled)
+    denominator = 1 + z * z / sampled
+    centre = (p + z * z / (2 * sampled)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / sampled + z * z / (4 * sampled * sampled)) / denominator
+    return max(0.0, centre - margin), min(1.0, centre + margin)
+
+
+def _binding_site_line_check(inrec):
+    """
+    binding_site_prediction_check needs the block the line belongs to.  A sampled line is checked against the
+    context a well formed line of its kind would have: nothing before a target, a target before a type
+    line, a target and a type before a score row.
+    """
+    first = inrec.split(",")[0].strip()
+    if first.startswith(">"):
+        context = []
+    elif first[:1].isdigit():
+        context = [">T00000", "DNA"]
+    else:
+        context = [">T00000"]
+    correct, errmsg, current_prediction = binding_site_prediction_check(inrec, context)
+    return correct, errmsg
+
+
+PREDICTION_CHECKS = {
+    "binding": _binding_site_line_check,
+    "hpo": hpo_prediction_check,
+    "do": do_prediction_check,
+    "go": go_prediction_check,
+}
+
+
+def prediction_check_for(filename):
+    """ Picks the prediction validator the same way cafa4_format_checker.file_name_check routes files """
+    return PREDICTION_CHECKS[prediction_kind(filename)]
+
+
+def _decode(line):
+    return line.decode("utf-8", "replace").rstrip("\r\n")
+
+
+def _check_header(handle, filename):
+    """
+    Reads and validates the header lines with the line checks and section order of the file's own checker
+    (cafa_records.RecordValidator), as precheck() does.  Returns (errmsg, body_offset); body_offset is where
+    the first prediction line starts.
+    """
+    from cafa_records import InvalidRecordError, RecordValidator
+
+    validator = RecordValidator(filename)
+    offset = 0
+    while True:
+        raw = handle.readline()
+        if not raw:
+            correct, errmsg = validator.checker.finish()
+            return (None if correct else errmsg), offset
+        try:
+            validator.feed(_decode(raw))
+        except InvalidRecordError as error:
+            return error.errmsg, offset
+        if validator.prediction_seen:
+            break
+        offset += len(raw)
+    checker = validator.checker
+    if not checker.order_possible():
+        return checker.finish()[1], offset
+    return None, offset
+
+
+def _check_trailer(tail):
+    """ Validates that the last non-empty line of tail (the last bytes of the file) is END.  Returns the error or None """
+    stripped = tail.rstrip()
+    last_line = _decode(stripped[stripped.rfind(b"\n") + 1:])
+    correct, errmsg = end_check(last_line)
+    if not correct:
+        return "Error in trailer, last line: {}".format(errmsg)
+    return None
+
+
+class _Tail(object):
+    """ The last bytes of a file, read once, seeked by file offset like the handle they were read from """
+
+    def __init__(self, data, start):
+        self.data = data
+        self.start = start
+        self.buffer = io.BytesIO(data)
+
+    def seek(self, offset):
+        self.buffer.seek(offset - self.start)
+
+    def readline(self):
+        return self.buffer.readline()
+
+
+def _sample_body(handle, body_start, body_end, sample_size, prediction_check, rng):
+    """
+    Checks up to sample_size lines starting in [body_start, body_end), body_end being the end of the file.
+    The last TRAILER_BYTES (from where the sample has got to, if that is later) are read once, when the
+    sample gets there, and the lines sampled in them come from that read.  Returns (sampled, failed,
+    examples, tail), tail being those last bytes, for _check_trailer
+    """
+    if body_end <= body_start:
+        # the file is all header: a few KB to read again
+        start = max(body_end - TRAILER_BYTES, 0)
+        handle.seek(start)
+        return 0, 0, [], handle.read(body_end - start)
+    tail_start = max(body_end - TRAILER_BYTES, body_start)
+    tail = None
+    offsets = sorted(rng.randrange(body_start, body_end) for _ in range(sample_size))
+    sampled = 0
+    failed = 0
+    examples = []
+    # Only ever seek forward, so zip members are inflated at most once
+    position = body_start
+    handle.seek(position)
+    for offset in offsets:
+        if offset < position or (offset == position and sampled):
+            # inside (or right after) the line sampled last time
+            continue
+        if tail is None and offset >= tail_start:
+            # from the byte before tail_start, so that the resync below finds a line starting right at it
+            tail = handle = _read_tail(handle, max(tail_start - 1, position), body_end)
+        if offset == body_start:
+            line_start = body_start
+        else:
+            # resync: the line containing offset - 1 is skipped, the next one is sampled
+            handle.seek(offset - 1)
+            line_start = offset - 1 + len(handle.readline())
+        if line_start >= body_end:
+            break
+        raw = handle.readline()
+        position = line_start + len(raw)
+        line = _decode(raw)
+        fields = line.split()
+        if not fields or fields[0] == "END":
+            # the END trailer is validated exactly by _check_trailer
+            continue
+        if fields[0] in HEADER_CHECKS:
+            # later MODEL sections have their own MODEL / KEYWORDS / ACCURACY records
+            correct, errmsg = HEADER_CHECKS[fields[0]][1](line)
+        else:
+            correct, errmsg = prediction_check(line)
+        sampled += 1
+        if not correct:
+            failed += 1
+            if len(examples) < 5:
+                examples.append("byte {}: {}".format(line_start, errmsg))
+    if tail is None:
+        tail = _read_tail(handle, max(tail_start, position), body_end)
+    return sampled, failed, examples, tail.data
+
+
+def _read_tail(handle, start, end):
+    """ The bytes from start to end as a _Tail; start is never before where handle is """
+    handle.seek(start)
+    return _Tail(handle.read(end - start), start)
+
+
+def quick_check_handle(handle, size, filename, sample_size=DEFAULT_SAMPLE_SIZE, seed=None):
+    """ Quick-checks one seekable binary handle of size bytes, only ever seeking forward.  Returns a QuickCheckResult """
+    rng = random.Random(seed)
+    header_error, body_start = _check_header(handle, filename)
+    sampled, failed, examples, tail = _sample_body(
+        handle, body_start, size, sample_size, prediction_check_for(filename), rng
+    )
+    trailer_error = _check_trailer(tail)
+    low, high = wilson_interval(failed, sampled)
+    rate = failed / float(sampled) if sampled else 0.0
+    correct = header_error is None and trailer_error is None and failed == 0
+    return QuickCheckResult(filename, correct, header_error, trailer_error, sampled, failed, rate, low, high, examples)
+
+
+def quick_check(input_file, sample_size=DEFAULT_SAMPLE_SIZE, seed=None):
+    """ Quick-checks a plain prediction file or every prediction file of a zip archive.  Returns a list of results """
+    results = []
+    if zipfile.is_zipfile(input_file):
+        with zipfile.ZipFile(input_file, "r") as files:
+            for name in archive_members(files):
+                info = files.getinfo(name)
+                with files.open(info) as handle:
+                    results.append(quick_check_handle(handle, info.file_size, name.split("/")[-1], sample_size, seed))
+    else:
+        with open(input_file, "rb") as handle:
+            results.append(
+                quick_check_handle(handle, os.stat(input_file).st_size, os.path.basename(input_file), sample_size, seed)
+            )
+    return results
+
+
+def precheck(path, filename=None, head_bytes=PRECHECK_HEAD_BYTES):
+    """
+    Structural pre-check of a plain prediction file, before the full scan: validates the header up to the
+    first prediction line and the END trailer, reading only the first head_bytes and the last TRAILER_BYTES.
+    Uses the line checks and section order of the file's own checker (cafa_records.RecordValidator).
+    Returns an error message if the file is certainly invalid, None otherwise; a file the pre-check cannot
+    judge (blank lines, a header longer than head_bytes, a last line longer than TRAILER_BYTES) is left to
+    the full scan.  A bad header line gets the message the checker gives it; a header out of order gets the
+    checker's section order message with the sections up to the first prediction line; a missing END
+    trailer gets it as for a file whose body holds only predictions.
+    """
+    from cafa_records import InvalidRecordError, RecordValidator
+
+    if filename is None:
+        filename = os.path.basename(path)
+    size = os.path.getsize(path)
+    validator = RecordValidator(filename)
+    with open(path, "rb") as handle:
+        head = handle.read(head_bytes)
+        lines = head.split(b"\n")
+        # the last piece is a partial line unless the whole file was read
+        lines.pop()
+        for raw in lines:
+            line = raw.decode("utf-8", "replace")
+            if not line.strip():
+                return None
+            try:
+                validator.feed(line)
+            except InvalidRecordError as error:
+                return error.errmsg
+            if validator.prediction_seen:
+                break
+        else:
+            return None
+        checker = validator.checker
+        if not checker.order_possible():
+            return checker.finish()[1]
+
+        start = max(size - TRAILER_BYTES, 0)
+        handle.seek(start)
+        tail = handle.read(size - start)
+    if tail.endswith(b"\n"):
+        tail = tail[:-1]
+    newline = tail.rfind(b"\n")
+    if newline < 0 and start > 0:
+        return None
+    last_line = _decode(tail[newline + 1:])
+    fields = last_line.split()
+    if not fields:
+        return None
+    if fields[0] != "END":
+        return checker.finish()[1]
+    correct, errmsg = checker.checks.end_check(last_line)
+    if not correct:
+        return "Error in {}, last line, {}".format(filename, errmsg)
+    return None
+
+
+def format_result(result):
+    lines = ["{}: {}".format(result.filename, "no errors found" if result.correct else "errors found")]
+    lines.append("  header: {}".format(result.header_error or "OK"))
+    lines.append("  END trailer: {}".format(result.trailer_error or "OK"))
+    lines.append(
+        "  sampled {} body lines, {} failed; estimated error rate {:.2%} (95% CI {:.2%} - {:.2%})".format(
+            result.sampled, result.failed, result.rate, result.low, result.high
+        )
+    )
+    for example in result.examples:
+        lines.append("    " + example)
+    return "\n".join(lines)
+
+
+def print_quick_check(input_file, sample_size=DEFAULT_SAMPLE_SIZE, seed=None):
+    """ Runs quick_check and prints the report.  Returns True if no errors were found """
+    print("____________________________________________")
+    print("Quick check (sampled, not a full validation)\n")
+    results = quick_check(input_file, sample_size, seed)
+    for result in results:
+        print(format_result(result))
+        print("")
+    print("____________________________________________")
+    return all(result.correct for result in results)
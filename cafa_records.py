@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import zipfile
+
+import cafa_binding_site_format_checker as binding_module
+import cafa_do_format_checker as do_module
+import cafa_go_format_checker as go_module
+import cafa_hpo_format_checker as hpo_module
+from cafa4_format_checker import archive_members, prediction_kind
+from cafa_pipeline import pipelined_lines
+from cafa_sections import SECTION_WORDS
+
+"""
+Streaming access to the data of validated prediction files.
+
+iter_records(path) validates a plain prediction file or every file of a zip archive with the GO, HPO, DO
+and binding-site checkers and yields one record per line as it goes:
+    HeaderRecord       AUTHOR, MODEL, KEYWORDS, ACCURACY and END lines
+    PredictionRecord   "target term score" lines of GO / HPO / DO files
+    BindingSiteRecord  score lines of binding-site files, with the target and binding type they belong to
+Records use __slots__ and keep the raw line; fields are only split and converted when they are accessed,
+and scores are ints in hundredths (0.87 -> 87).  Nothing is kept between lines except the checker state,
+so memory use does not grow with the file.
+
+Each line goes through the step of the file's own checker (cafa_sections), so errors are found and
+reported exactly as the checker finds and reports them, a section out of order once the file ends.  The
+first error raises InvalidRecordError with the checker's message; records yielded before that were valid
+on their own, so a consumer that needs a fully valid file should only commit its output once the iterator
+is exhausted.
+"""
+
+
+class InvalidRecordError(Exception):
+    """ errmsg: the checker's error message; line_num: 1-based line of the error, None for section order """
+
+    def __init__(self, errmsg, filename=None, line_num=None):
+        Exception.__init__(self, errmsg)
+        self.errmsg = errmsg
+        self.filename = filename
+        self.line_num = line_num
+
+
+class HeaderRecord(object):
+    __slots__ = ("kind", "filename", "line_num", "model", "_line")
+
+    def __init__(self, kind, filename, line_num, model, line):
+        self.kind = kind
+        self.filename = filename
+        self.line_num = line_num
+        self.model = model
+        self._line = line
+
+    @property
+    def fields(self):
+        return self._line.split()
+
+    @property
+    def value(self):
+        """ author name, model number, list of keywords, (index, pr, rc) for ACCURACY, None for END """
+        if self.kind == "author":
+            return self.fields[1]
+        if self.kind == "model":
+            return int(self.fields[1])
+        if self.kind == "keywords":
+            return [keyword.strip().rstrip(".") for keyword in self._line.strip()[8:].split(",")]
+        if self.kind == "accuracy":
+            fields = self.fields
+            return int(fields[1]), fields[2], fields[3]
+        return None
+
+    def __repr__(self):
+        return "HeaderRecord({!r}, {!r})".format(self.kind, self._line.strip())
+
+
+def score_hundredths(score):
+    """ "0.87" -> 87; scores are validated with two decimals, so no float is involved """
+    if len(score) == 4 and score[1] == ".":
+        return (ord(score[0]) - 48) * 100 + (ord(score[2]) - 48) * 10 + ord(score[3]) - 48
+    return int(round(float(score) * 100))
+
+
+class PredictionRecord(object):
+    __slots__ = ("filename", "line_num", "model", "_line", "_fields")
+
+    def __init__(self, filename, line_num, model, line):
+        self.filename = filename
+        self.line_num = line_num
+        self.model = model
+        self._line = line
+        self._fields = None
+
+    def _split(self):
+        if self._fields is None:
+            self._fields = self._line.split()
+        return self._fields
+
+    @property
+    def target(self):
+        return self._split()[0]
+
+    @property
+    def term(self):
+        return self._split()[1]
+
+    @property
+    def score(self):
+        """ confidence in hundredths """
+        return score_hundredths(self._split()[2])
+
+    def __repr__(self):
+        return "PredictionRecord({!r}, {!r}, {!r})".format(self.target, self.term, self.score)
+
+
+class BindingSiteRecord(object):
+    __slots__ = ("filename", "line_num", "model", "target", "binding_type", "_line")
+
+    def __init__(self, filename, line_num, model, target, binding_type, line):
+        self.filename = filename
+        self.line_num = line_num
+        self.model = model
+        self.target = target
+        self.binding_type = binding_type
+        self._line = line
+
+    @property
+    def scores(self):
+        """ per-residue confidences in hundredths """
+        return [score_hundredths(score.strip()) for score in self._line.split(",")]
+
+    def __repr__(self):
+        return "BindingSiteRecord({!r}, {!r}, {} scores)".format(self.target, self.binding_type, len(self.scores))
+
+
+# The checker module of each prediction_kind; RecordValidator drives its CheckerState
+CHECKER_MODULES = {
+    "go": go_module,
+    "hpo": hpo_module,
+    "do": do_module,
+    "binding": binding_module,
+}
+
+
+class RecordValidator(object):
+    """
+    The checker for one file, fed a line at a time.  feed() validates a line with the step of the file's
+    own checker (cafa_sections.SectionState) and returns its record (None for binding-site target and type
+    lines); finish() returns the checker's (True, message) for a file that ends there.  state() is
+    everything carried from one line to the next except the line number, as a hashable tuple, and a
+    validator can be resumed from it, e.g. at a chunk boundary.
+    """
+
+    def __init__(self, filename, kind=None, state=None, line_num=0):
+        self.filename = filename
+        self.kind = kind or prediction_kind(filename)
+        module = CHECKER_MODULES[self.kind]
+        self.checker = module.CheckerState(filename)
+        self.prediction_state = self.checker.prediction_state
+        # after the first prediction line, valid ones are accepted with one match, as the checkers accept them
+        self._valid_line = getattr(module, "valid_prediction_line", None)
+        self.line_num = line_num
+        # the model of the lines being read, and for binding-site files their target and binding type
+        self.model = None
+        self.target = None
+        self.binding_type = None
+        if state is not None:
+            self.restore(state)
+
+    @property
+    def visited_states(self):
+        return self.checker.visited_states
+
+    @property
+    def prediction_seen(self):
+        return self.checker.prediction_seen
+
+    def state(self):
+        return self.checker.state() + (self.model, self.target, self.binding_type)
+
+    def restore(self, state):
+        self.checker.restore(state[:-3])
+        self.model, self.target, self.binding_type = state[-3:]
+
+    def feed(self, line):
+        self.line_num += 1
+        filename = self.filename
+        line_num = self.line_num
+        checker = self.checker
+        valid_line = self._valid_line
+        if valid_line is not None and checker.prediction_seen and valid_line(line):
+            return PredictionRecord(filename, line_num, self.model, line)
+        error = checker.step(line, line_num)
+        if error is not None:
+            raise InvalidRecordError(error[1], filename, line_num)
+
+        fields = line.split(None, 1)
+        section = SECTION_WORDS.get(fields[0], "prediction")
+        if section == "prediction":
+            if self.kind != "binding":
+                return PredictionRecord(filename, line_num, self.model, line)
+            if line.startswith(">"):
+                self.target = line.strip()[1:]
+            elif binding_module.type_field.match(fields[0]) and "," not in line:
+                self.binding_type = line.strip()
+            else:
+                return BindingSiteRecord(filename, line_num, self.model, self.target, self.binding_type, line)
+            return None
+        if section == "model":
+            self.model = int(fields[1])
+        return HeaderRecord(section, filename, line_num, self.model, line)
+
+    def finish(self):
+        """ The checker's (True, message) for a file that ends here; raises InvalidRecordError if it fails """
+        correct, errmsg = self.checker.finish()
+        if not correct:
+            raise InvalidRecordError(errmsg, self.filename)
+        return correct, errmsg
+
+
+def iter_file_records(lines, filename, kind=None):
+    """ Validates one file given as an iterable of str lines and yields its records """
+    validator = RecordValidator(filename, kind)
+    feed = validator.feed
+    for line in lines:
+        record = feed(line)
+        if record is not None:
+            yield record
+    validator.finish()
+
+
+def iter_records(path):
+    """
+    Yields the records of a prediction file or of every prediction file in a zip archive, validating as it
+    goes; raises InvalidRecordError at the first error.
+    """
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path, "r") as files:
+            for name in archive_members(files):
+                # the checker's line source, which drops the blank lines around a member
+                with files.open(name) as member:
+                    lines = pipelined_lines(member)
+                    try:
+                        for record in iter_file_records(lines, name.split("/")[-1]):
+                            yield record
+                    finally:
+                        lines.close()
+    else:
+        with open(path, "r") as lines:
+            for record in iter_file_records(lines, os.path.basename(path)):
+                yield record
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import hashlib
+import json
+import os
+import re
+
+"""
+Declarative CAFA rulesets.
+
+The rules of a CAFA edition (target and term ID grammars, legal keywords, legal section orders, model and
+ACCURACY limits, score precision) live in rulesets/<edition>.json.  load_ruleset() compiles a spec once into
+a Ruleset:
+    - keywords become a frozenset
+    - the legal section orders become a single DFA, so a section out of order is detected as soon as it appears
+    - ID and score grammars become compiled regular expressions, plus one combined regular expression per
+      ontology that accepts a whole valid prediction line in a single match
+Compiled rulesets are memoized in the process, keyed by the digest of the spec, so an edited spec is
+compiled again.  They are not cached on disk: compiling one takes about a millisecond, and a pickled
+regular expression is compiled again when it is loaded anyway.
+
+Adding a CAFA edition means adding a spec file; cafa_edition_checker validates files against any of them.
+"""
+
+RULESET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rulesets")
+
+# Part of the digest: bump when the compiled representation changes
+COMPILER_VERSION = 1
+
+_loaded = {}
+
+
+class Ruleset(object):
+    """ A compiled CAFA edition spec.  Build with load_ruleset() rather than directly. """
+
+    def __init__(self, spec, digest):
+        self.edition = spec["edition"]
+        self.spec_version = spec["spec_version"]
+        self.digest = digest
+        self.keywords = frozenset(spec["keywords"])
+        self.max_models = spec["max_models"]
+        self.max_accuracy_records = spec["max_accuracy_records"]
+        self.pr_field = re.compile(spec["accuracy"]["pr"])
+        self.rc_field = re.compile(spec["accuracy"]["rc"])
+
+        self.score_precision = spec["score"]["precision"]
+        self.score_max = spec["score"]["max"]
+        score = r"[01]\.[0-9]{%d}" % self.score_precision
+        self.confidence_field = re.compile("^" + score + "$")
+        # start of a score, for comma separated score rows (binding sites)
+        self.score_prefix_field = re.compile("^" + score)
+        # a score that also respects the maximum, so the combined line pattern needs no float()
+        bounded_score = _bounded_score_pattern(self.score_precision, self.score_max)
+
+        self.section_orders = tuple(tuple(order) for order in spec["section_orders"])
+        self.section_dfa, self.accepting_states = _build_section_dfa(self.section_orders)
+
+        self.labels = {}
+        self.term_labels = {}
+        self._target_fields = {}
+        self._term_fields = {}
+        self._prediction_lines = {}
+        self._extra_fields = {}
+        for ontology, rules in spec["ontologies"].items():
+            target_pattern = rules.get("target_id", spec["target_id"])
+            self.labels[ontology] = rules["label"]
+            self.term_labels[ontology] = rules.get("term_label")
+            self._target_fields[ontology] = re.compile(target_pattern)
+            if "term_id" in rules:
+                self._term_fields[ontology] = re.compile(rules["term_id"])
+                self._prediction_lines[ontology] = re.compile(
+                    r"^(%s)[ \t]+(%s)[ \t]+(%s)\s*$"
+                    % (_strip_anchors(target_pattern), _strip_anchors(rules["term_id"]), bounded_score)
+                )
+            for key, pattern in rules.items():
+                if key not in ("label", "term_label", "target_id", "term_id"):
+                    self._extra_fields[(ontology, key)] = re.compile(pattern)
+
+    def ontologies(self):
+        return sorted(self.labels)
+
+    def target_field(self, ontology):
+        return self._target_fields[ontology]
+
+    def term_field(self, ontology):
+        return self._term_fields[ontology]
+
+    def field(self, ontology, name):
+        """ Any other ID grammar declared for an ontology, e.g. field("binding", "binding_type") """
+        return self._extra_fields[(ontology, name)]
+
+    def prediction_line(self, ontology):
+        """ Combined pattern matching a whole valid 'target term score' line; groups are the three fields """
+        return self._prediction_lines[ontology]
+
+    def legal_states(self, prediction_state):
+        """ The legal section orders as state lists, with "prediction" named as the checker module names it """
+        return [
+            [prediction_state if section == "prediction" else section for section in order]
+            for order in self.section_orders
+        ]
+
+    def next_section_state(self, dfa_state, section):
+        """ DFA transition; returns None if section cannot follow the sections seen so far """
+        return self.section_dfa[dfa_state].get(section)
+
+    def section_order_ok(self, sections):
+        """ True if the list of sections (in order of first appearance) is one of the legal orders """
+        dfa_state = 0
+        for section in sections:
+            dfa_state = self.section_dfa[dfa_state].get(section)
+            if dfa_state is None:
+                return False
+        return dfa_state in self.accepting_states
+
+
+def _strip_anchors(pattern):
+    if pattern.startswith("^"):
+        pattern = pattern[1:]
+    if pattern.endswith("$"):
+        pattern = pattern[:-1]
+    return "(?:%s)" % pattern
+
+
+def _bounded_score_pattern(precision, maximum):
+    if maximum == 1.0:
+        return r"(?:0\.[0-9]{%d}|1\.0{%d})" % (precision, precision)
+    return r"[01]\.[0-9]{%d}" % precision
+
+
+def _build_section_dfa(orders):
+    """
+    Builds a DFA (a trie, which is deterministic for a finite set of orders) over section names.
+    Returns (transitions, accepting): transitions[state] maps a section to the next state, state 0 is
+    the start state.
+    """
+    transitions = [{}]
+    accepting = set()
+    for order in orders:
+        state = 0
+        for section in order:
+            next_state = transitions[state].get(section)
+            if next_state is None:
+                next_state = len(transitions)
+                transitions.append({})
+                transitions[state][section] = next_state
+            state = next_state
+        accepting.add(state)
+    return tuple(transitions), frozenset(accepting)
+
+
+def spec_path(edition):
+    return os.path.join(RULESET_DIR, "{}.json".format(edition))
+
+
+def available_editions():
+    return sorted(name[:-5] for name in os.listdir(RULESET_DIR) if name.endswith(".json"))
+
+
+def load_ruleset(edition):
+    """ Returns the compiled Ruleset for an edition (e.g. "cafa4"), compiled once per process """
+    with open(spec_path(edition), "rb") as spec_handle:
+        raw_spec = spec_handle.read()
+    digest = hashlib.sha256(raw_spec + str(COMPILER_VERSION).encode("ascii")).hexdigest()
+    ruleset = _loaded.get(digest)
+    if ruleset is None:
+        ruleset = Ruleset(json.loads(raw_spec.decode("utf-8")), digest)
+        _loaded[digest] = ruleset
+    return ruleset
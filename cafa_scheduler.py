@@ -0,0 +1,412 @@
+#!/usr/bin/env python
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import heapq
+import io
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import tempfile
+import time
+import zipfile
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import redirect_stdout
+
+from cafa4_format_checker import cafa_checker, submission_team
+from cafa_memory import MB, MemoryBudget, estimate_file_memory, estimate_submission_memory
+
+"""
+Watch-folder intake: validates the submissions dropped into a directory with a pool of worker processes
+and writes one JSON result per submission to a results directory.
+
+Jobs are ordered by start-time fair queueing over teams, with the job size as its cost:
+    - each team has a queue of its jobs, shortest first, and a virtual time that advances by the size of
+      every job dispatched for it
+    - the next job is the head of the team queue with the smallest virtual time + head size
+So small files go ahead of large ones, and a team with one 50 GB archive or a thousand small files only
+delays the other teams by its fair share.  A team that was idle starts at the current virtual time rather
+than at the credit it would have built up.
+
+A file is only queued once its size and mtime are unchanged between two polls, so uploads in progress
+are not picked up.  Submissions whose result was written for the same size and mtime are skipped, so the
+scheduler can be restarted; a file replaced by a new upload under the same name is validated again.
+
+A worker process that dies (killed for memory, a crash in an extension) breaks the whole pool: the jobs
+that were running in it get a failed result saying so, and a new pool takes the next jobs.
+
+With a time budget, a submission that runs out of time gets an inconclusive result ("valid": null).  The
+workers share a cancel event: stop() sets it, the running validations return at their next check with the
+lines and sections seen so far, and queued jobs are left for the next run.
+
+With a memory budget, a job is only dispatched once the estimate of what its largest member needs
+(cafa_memory.estimate_submission_memory) can be reserved; otherwise the scheduler waits for running jobs
+to finish, so the workers together stay within the budget.  The worker sizes its read buffers to the
+bytes granted.
+
+With metrics (a cafa_metrics.ValidationMetrics, served over HTTP by --metrics-port), each worker records
+the observations of its files and the scheduler adds them to the registry when the job's result arrives.
+"""
+
+SUBMISSION_SUFFIXES = (".zip", ".txt")
+
+# mtime: of the submission when it was queued, stored with its result to recognise a new upload
+Job = namedtuple("Job", ["path", "name", "size", "team", "mtime"], defaults=(None,))
+
+# The report of a job whose worker process died
+BROKEN_WORKER_REPORT = "Validation failed: the worker process validating this submission terminated abruptly\n"
+
+
+class FairScheduler(object):
+    def __init__(self):
+        # team -> heap of (size, name, job)
+        self._queues = {}
+        # team -> virtual time
+        self._finish = {}
+        self._virtual_time = 0
+
+    def __len__(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def add(self, job):
+        queue = self._queues.get(job.team)
+        if queue is None:
+            queue = self._queues[job.team] = []
+            # an idle team does not keep the credit from the time it had nothing queued
+            self._finish[job.team] = max(self._finish.get(job.team, 0), self._virtual_time)
+        heapq.heappush(queue, (job.size, job.name, job))
+
+    def pop(self):
+        """ Returns the next job to dispatch, or None if nothing is queued """
+        best_team = None
+        best_key = None
+        for team, queue in self._queues.items():
+            key = (self._finish[team] + queue[0][0], queue[0][0], team)
+            if best_key is None or key < best_key:
+                best_team, best_key = team, key
+        if best_team is None:
+            return None
+        queue = self._queues[best_team]
+        size, name, job = heapq.heappop(queue)
+        self._virtual_time = self._finish[best_team]
+        self._finish[best_team] += size
+        if not queue:
+            del self._queues[best_team]
+        return job
+
+
+def result_path(results_dir, name):
+    return os.path.join(results_dir, name + ".json")
+
+
+# Cancel event shared by the worker processes and their cafa_trace.Tracer, set by _init_worker
+_cancel_event = None
+_tracer = None
+
+
+def _init_worker(cancel_event, tracer=None):
+    global _cancel_event, _tracer
+    _cancel_event = cancel_event
+    _tracer = tracer
+    # Ctrl-C reaches the whole process group; the workers stop through the cancel event instead
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def validate_job(path, time_budget=None, memory_bytes=None, sketch=False, metrics=False):
+    """
+    Runs the format checker on one submission in a worker; returns (is_valid, report, seconds, sketches,
+    recorder), is_valid None if the submission was not completely validated within time_budget or the pool
+    was stopped.
+    memory_bytes: what the scheduler reserved for the job; the checker's buffers are sized to fit it.
+    sketch: also return the cafa_similarity sketches of the files ({file: sketch dict}), else None.
+    metrics: also return a cafa_metrics.MetricsRecorder of the files validated, else None.
+    """
+    report = io.StringIO()
+    sketches = {} if sketch else None
+    recorder = None
+    if metrics:
+        from cafa_metrics import MetricsRecorder
+
+        recorder = MetricsRecorder()
+    start = time.perf_counter()
+    with redirect_stdout(report):
+        try:
+            is_valid = cafa_checker(
+                path, time_budget=time_budget, cancel_event=_cancel_event, memory_budget=MemoryBudget(memory_bytes),
+                tracer=_tracer, sketches=sketches, metrics=recorder,
+            )
+        except Exception as error:
+            print("Validation failed with {}: {}".format(type(error).__name__, error))
+            is_valid = False
+    if is_valid is not None:
+        is_valid = bool(is_valid)
+    if sketches is not None:
+        sketches = dict((name, file_sketch.to_dict()) for name, file_sketch in sketches.items())
+    return is_valid, report.getvalue(), time.perf_counter() - start, sketches, recorder
+
+
+def write_result(results_dir, job, is_valid, report, seconds, sketches=None):
+    """ Writes results_dir/<name>.json, replaced atomically so a result is never read half written """
+    result = {
+        "file": job.name,
+        "team": job.team,
+        "bytes": job.size,
+        "mtime": job.mtime,
+        "valid": is_valid,
+        "seconds": seconds,
+        "report": report,
+    }
+    if sketches is not None:
+        result["sketches"] = sketches
+    handle, tmp_path = tempfile.mkstemp(dir=results_dir, prefix=".cafa_result")
+    try:
+        with os.fdopen(handle, "w") as out_handle:
+            json.dump(result, out_handle, indent=2)
+        os.replace(tmp_path, result_path(results_dir, job.name))
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+    return result
+
+
+class IntakeWatcher(object):
+    """
+    watch_dir: where submissions are dropped
+    results_dir: where <submission>.json results are written (created if needed)
+    memory_budget: optional bytes the running jobs may reserve together
+    tracer: optional cafa_trace.Tracer; the workers append the spans of the sampled submissions to its file
+    sketch: store a cafa_similarity sketch of every GO/HPO/DO file with the result, for cafa_similarity.py
+    metrics: optional cafa_metrics.ValidationMetrics, updated with the files of every finished job
+    """
+
+    def __init__(self, watch_dir, results_dir, workers=None, poll_interval=5.0, time_budget=None,
+                 memory_budget=None, tracer=None, sketch=False, metrics=None):
+        self.watch_dir = watch_dir
+        self.results_dir = results_dir
+        self.workers = workers or os.cpu_count() or 1
+        self.poll_interval = poll_interval
+        self.time_budget = time_budget
+        self.cancel_event = multiprocessing.Event()
+        self.scheduler = FairScheduler()
+        self.memory_budget = MemoryBudget(memory_budget)
+        self.tracer = tracer
+        self.sketch = sketch
+        self.metrics = metrics
+        # the job popped from the scheduler that is waiting for memory
+        self._admitting = None
+        os.makedirs(results_dir, exist_ok=True)
+        # name -> (size, mtime) seen at the last poll, for files that are not queued yet
+        self._pending = {}
+        self._queued = set()
+        # name -> (mtime of the result file, size, mtime of the submission it was written for)
+        self._done = {}
+
+    def poll(self, settle=True):
+        """ Queues the submissions that are complete; returns how many were added """
+        added = 0
+        for entry in os.scandir(self.watch_dir):
+            name = entry.name
+            if name in self._queued or not entry.is_file() or not name.lower().endswith(SUBMISSION_SUFFIXES):
+                continue
+            status = entry.stat()
+            signature = (status.st_size, status.st_mtime)
+            if self._has_result(name, signature):
+                continue
+            if settle and self._pending.get(name) != signature:
+                # new or still growing; look again at the next poll
+                self._pending[name] = signature
+                continue
+            self._pending.pop(name, None)
+            self._queued.add(name)
+            self.scheduler.add(Job(entry.path, name, status.st_size, submission_team(name), status.st_mtime))
+            added += 1
+        return added
+
+    def _has_result(self, name, signature):
+        """ Whether the result of name was written for the submission of this (size, mtime) """
+        path = result_path(self.results_dir, name)
+        try:
+            written = os.stat(path).st_mtime
+            done = self._done.get(name)
+            if done is None or done[0] != written:
+                with open(path) as result_handle:
+                    result = json.load(result_handle)
+                done = self._done[name] = (written, result.get("bytes"), result.get("mtime"))
+        except (OSError, ValueError):
+            return False
+        written, size, mtime = done
+        if mtime is None:
+            # written before results kept the mtime: good for a submission of its size no newer than it
+            return size == signature[0] and signature[1] <= written
+        return (size, mtime) == signature
+
+    def _admit(self):
+        """ The next job and its memory reservation, or None if there is no job or it does not fit yet """
+        job = self._admitting or self.scheduler.pop()
+        if job is None:
+            return None
+        try:
+            estimate = estimate_submission_memory(job.path)
+        except (OSError, zipfile.BadZipFile):
+            # gone or unreadable: the checker reports it, reserve for a file of its size
+            estimate = estimate_file_memory(job.size)
+        reservation = self.memory_budget.try_reserve(estimate)
+        if reservation is None:
+            self._admitting = job
+            return None
+        self._admitting = None
+        return job, reservation
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(
+            max_workers=self.workers, initializer=_init_worker, initargs=(self.cancel_event, self.tracer)
+        )
+
+    def run(self, once=False, on_result=None):
+        """
+        Dispatches queued jobs to the worker pool, keeping at most one job per worker in flight so the
+        scheduler, not the pool, decides the order, and only as many as fit in the memory budget (a job
+        larger than the whole budget runs alone).  once: process what is in watch_dir and return.
+        Ctrl-C stops the pool cooperatively, as stop() does.  A pool broken by a dying worker is replaced.
+        """
+        results = []
+        pool = self._new_pool()
+        try:
+            running = {}
+            self.poll(settle=not once)
+            while True:
+                try:
+                    while len(running) < self.workers and not self.cancel_event.is_set():
+                        admitted = self._admit()
+                        if admitted is None:
+                            break
+                        job, reservation = admitted
+                        args = (validate_job, job.path, self.time_budget, reservation.nbytes, self.sketch,
+                                self.metrics is not None)
+                        try:
+                            future = pool.submit(*args)
+                        except BrokenProcessPool:
+                            # broken since the last results came in; its running jobs fail below
+                            pool.shutdown(wait=True)
+                            pool = self._new_pool()
+                            future = pool.submit(*args)
+                        running[future] = job, reservation, pool
+                    if not running:
+                        if once or self.cancel_event.is_set():
+                            break
+                        self.cancel_event.wait(self.poll_interval)
+                        self.poll()
+                        continue
+                    done, not_done = wait(running, timeout=None if once else self.poll_interval,
+                                          return_when=FIRST_COMPLETED)
+                except KeyboardInterrupt:
+                    self.stop()
+                    continue
+                broken = False
+                for future in done:
+                    job, reservation, job_pool = running.pop(future)
+                    reservation.release()
+                    self._queued.discard(job.name)
+                    try:
+                        is_valid, report, seconds, sketches, recorder = future.result()
+                    except BrokenProcessPool:
+                        # every job running in the pool fails with it; which one killed its worker is not known
+                        broken = broken or job_pool is pool
+                        is_valid, report, seconds, sketches, recorder = False, BROKEN_WORKER_REPORT, 0.0, None, None
+                    if recorder is not None:
+                        self.metrics.replay(recorder)
+                    if is_valid is None and self.cancel_event.is_set():
+                        # stopped, not out of time: no result, so it is validated again after a restart
+                        continue
+                    result = write_result(self.results_dir, job, is_valid, report, seconds, sketches)
+                    results.append(result)
+                    if on_result is not None:
+                        on_result(result)
+                if broken:
+                    pool.shutdown(wait=True)
+                    pool = self._new_pool()
+                if not once and not self.cancel_event.is_set():
+                    self.poll()
+        finally:
+            pool.shutdown(wait=True)
+        return results
+
+    def stop(self):
+        """ Asks the running validations to stop at their next check; run() returns once they have """
+        self.cancel_event.set()
+
+
+def print_result(result):
+    if result["valid"] is None:
+        status = "inconclusive"
+    else:
+        status = "valid" if result["valid"] else "INVALID"
+    print("{}\t{}\t{}\t{:.1f}s".format(result["team"], result["file"], status, result["seconds"]))
+    sys.stdout.flush()
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Validate submissions dropped into a directory")
+    parser.add_argument("watch_dir", help="directory submissions are dropped into")
+    parser.add_argument("results_dir", help="directory for the <submission>.json results")
+    parser.add_argument("--workers", type=int, help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--poll-interval", type=float, default=5.0, metavar="SECONDS",
+                        help="how often watch_dir is scanned (default %(default)s)")
+    parser.add_argument("--once", action="store_true",
+                        help="validate the submissions currently in watch_dir and exit (e.g. from cron)")
+    parser.add_argument("--time-budget", type=float, metavar="SECONDS",
+                        help="mark a submission inconclusive if it is not validated within SECONDS")
+    parser.add_argument("--memory-budget", type=float, metavar="MB",
+                        help="memory the running validations may reserve together; jobs wait for it")
+    parser.add_argument("--trace", metavar="PATH", help="append spans of the validation phases to PATH")
+    parser.add_argument("--trace-sample-rate", type=float, default=1.0, metavar="RATE",
+                        help="fraction of submissions traced with --trace (default %(default)s)")
+    parser.add_argument("--sketches", action="store_true",
+                        help="store a MinHash sketch of each file with its result, for cafa_similarity.py")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT",
+                        help="serve OpenMetrics counters and histograms of the validated files at "
+                             "http://<host>:PORT/metrics")
+    args = parser.parse_args(argv)
+
+    memory_budget = None if args.memory_budget is None else int(args.memory_budget * MB)
+    tracer = None
+    if args.trace:
+        from cafa_trace import Tracer
+
+        tracer = Tracer(args.trace, args.trace_sample_rate)
+    metrics = None
+    server = None
+    if args.metrics_port is not None:
+        from cafa_metrics import ValidationMetrics
+
+        metrics = ValidationMetrics()
+        server = metrics.serve(args.metrics_port)
+    watcher = IntakeWatcher(
+        args.watch_dir, args.results_dir, args.workers, args.poll_interval, args.time_budget, memory_budget,
+        tracer, args.sketches, metrics
+    )
+    try:
+        watcher.run(once=args.once, on_result=print_result)
+    finally:
+        if server is not None:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import sys
+
+"""
+The section state machine of the prediction file checkers.
+
+A SectionState is what a checker carries from one line of a file to the next: the sections seen
+(visited_states), the MODEL and ACCURACY counts, and whether a prediction line was seen.  step() validates
+one line with the record checks of the checker module and advances the state; finish() gives the
+checker's verdict once the file has been read.  Each checker module (GO, HPO, DO, binding site) subclasses it
+with its prediction check and its messages, and its cafa_checker is a loop over step().  Everything else
+that follows a file a line at a time drives the same step: cafa_records.RecordValidator (and through it
+the push, distributed, incremental and pre-check validators), cafa_binding_parallel and
+cafa_edition_checker.  So they all report what the checker reports.
+
+The limits and the section orders come from the ruleset: at most rules.max_models MODEL records, at most
+rules.max_accuracy_records ACCURACY records per model, and the sections in order of first appearance
+(AUTHOR and END every time they appear) must lead the ruleset's section DFA to an accepting state.  As
+the checkers always have, a section out of order is only reported once the whole file was read without an
+error in any line.
+"""
+
+SECTION_WORDS = {
+    "AUTHOR": "author",
+    "MODEL": "model",
+    "KEYWORDS": "keywords",
+    "ACCURACY": "accuracy",
+    "END": "end",
+}
+
+# The record check of each header section, by its name in the checker module
+RECORD_CHECKS = {
+    "author": "author_check",
+    "model": "model_check",
+    "keywords": "keywords_check",
+    "accuracy": "accuracy_check",
+    "end": "end_check",
+}
+
+
+def record_section(line):
+    """ The section of a line, decided by its first word as the checkers decide it; None for a blank line """
+    # the section words are short: a long binding-site score row is not split or copied to find its first word
+    words = line.lstrip()[:16].split(None, 1)
+    if not words:
+        return None
+    return SECTION_WORDS.get(words[0], "prediction")
+
+
+class SectionState(object):
+    """
+    One file's checker state.  Subclasses set prediction_state (the name visited_states gives the
+    prediction section) and define check_prediction(line) and finish().
+    checks: where the record checks (author_check, ...) and handle_error are looked up when they are
+    called, so that cafa_profiler can time them; the subclass's module by default
+    rules: the compiled ruleset, by default the RULES of checks
+    """
+
+    prediction_state = "prediction"
+
+    # Added to the line numbers in the messages: the DO checker has always counted lines from 0
+    line_offset = 0
+
+    def __init__(self, fileName, checks=None, rules=None):
+        if checks is None:
+            checks = sys.modules[type(self).__module__]
+        self.fileName = fileName
+        self.checks = checks
+        self.rules = rules if rules is not None else checks.RULES
+        self.visited_states = []
+        self.dfa_state = 0
+        self.n_models = 0
+        self.n_accuracy = 0
+        self.prediction_seen = False
+
+    def state(self):
+        """ Everything carried from one line to the next, as a hashable tuple; restore() resumes from it """
+        return (tuple(self.visited_states), self.dfa_state, self.n_models, self.n_accuracy, self.prediction_seen)
+
+    def restore(self, state):
+        visited_states, self.dfa_state, self.n_models, self.n_accuracy, self.prediction_seen = state
+        self.visited_states = list(visited_states)
+
+    def step(self, inline, line_num):
+        """
+        Validates the line numbered line_num (counting from 1) and advances the state.  Returns None, or the
+        (False, errmsg) the checker returns for the file.
+        """
+        section = record_section(inline)
+        checks = self.checks
+        if section == "prediction":
+            correct, errmsg = self.check_prediction(inline)
+            if not correct:
+                return checks.handle_error(correct, errmsg, inline, line_num + self.line_offset, self.fileName)
+            if not self.prediction_seen:
+                self.prediction_seen = True
+                self._visit(self.prediction_state, section)
+            return None
+        if section is None:
+            return checks.handle_error(False, "empty line", inline, line_num + self.line_offset, self.fileName)
+
+        rules = self.rules
+        if section == "model":
+            self.n_models += 1
+            self.n_accuracy = 0
+            if self.n_models > rules.max_models:
+                return False, "Too many models. Only up to %d allowed" % rules.max_models
+        elif section == "accuracy":
+            self.n_accuracy += 1
+            if self.n_accuracy > rules.max_accuracy_records:
+                return checks.handle_error(
+                    False, "ACCURACY: too many ACCURACY records", inline, line_num + self.line_offset, self.fileName
+                )
+            correct, errmsg = checks.accuracy_check(inline)
+            if not correct:
+                # without the file and line, as the checkers have always reported it
+                return correct, errmsg
+        if section != "accuracy":
+            correct, errmsg = getattr(checks, RECORD_CHECKS[section])(inline)
+            if not correct:
+                return checks.handle_error(correct, errmsg, inline, line_num + self.line_offset, self.fileName)
+
+        if section == "author" or section == "end" or section not in self.visited_states:
+            self._visit(section, section)
+        return None
+
+    def _visit(self, state, section):
+        self.visited_states.append(state)
+        if self.dfa_state is not None:
+            self.dfa_state = self.rules.next_section_state(self.dfa_state, section)
+
+    def order_possible(self):
+        """ False once the sections seen so far cannot begin any legal order """
+        return self.dfa_state is not None
+
+    def order_ok(self):
+        """ Whether the sections seen so far are one of the legal orders """
+        return self.dfa_state in self.rules.accepting_states
+
+    def check_prediction(self, inline):
+        raise NotImplementedError
+
+    def finish(self):
+        """ The checker's (correct, errmsg) for a file that ends here """
+        raise NotImplementedError
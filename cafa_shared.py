@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import mmap
+import os
+import tempfile
+import weakref
+import zipfile
+from collections import namedtuple
+from concurrent.futures import wait
+from multiprocessing import shared_memory
+
+from cafa4_format_checker import file_name_check, prediction_kind
+from cafa_async import validate_member
+from cafa_deadline import DeadlineExceeded, inconclusive_message
+from cafa_distributed import (
+    BLOCK_SIZE,
+    CHUNK_BYTES,
+    _restored,
+    byte_ranges,
+    check_range,
+    merge_ranges,
+    prediction_state,
+)
+from cafa_executor import make_executor
+from cafa_records import RecordValidator
+
+"""
+Zero-copy handoff of inflated zip members to worker processes.
+
+A zip member has to be inflated in order, so its byte ranges cannot be read by workers from the archive
+without each inflating everything before its range.  validate_member_in_chunks() inflates a large GO, HPO
+or DO member once, into a shared memory segment (or a memory-mapped temporary file), and gives the
+workers only a SegmentRef and a byte range: each worker maps the segment and validates its range in place
+with cafa_distributed.check_range, and returns a small dict.  No lines or data cross between processes.
+The ranges are merged as the distributed checker merges them, so the result is cafa_checker's.
+
+Segments live as long as the SharedSegment that made them: it is used as a context manager, and unlinks
+the segment when the validation ends, fails or is interrupted (a weakref finalizer covers a segment that
+is dropped, and multiprocessing's resource tracker one whose process is killed).  Workers only map a
+segment for the duration of a task.  A segment is backed by /dev/shm when it has room for it, since
+writing past the space left there kills the process with SIGBUS; otherwise by a file in the temporary
+directory (backing "file"), whose pages the kernel can write out.
+"""
+
+SegmentRef = namedtuple("SegmentRef", ["name", "backing", "size"])
+
+BACKINGS = ("auto", "shm", "file")
+
+SHM_DIR = "/dev/shm"
+
+# Prefix of the temporary files behind "file" segments, so stale ones can be found after a crash
+FILE_PREFIX = "cafa-segment-"
+
+# How often the deadline is looked at while waiting for a range
+DEADLINE_POLL_SECONDS = 0.1
+
+
+def _shm_has_room(size):
+    try:
+        stat = os.statvfs(SHM_DIR)
+    except (OSError, AttributeError):
+        return False
+    return stat.f_bavail * stat.f_frsize > size
+
+
+def _release_shm(shm):
+    try:
+        shm.close()
+    finally:
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _release_file(mapped, handle, path):
+    try:
+        mapped.close()
+        os.close(handle)
+    finally:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+class SharedSegment(object):
+    """
+    size bytes of memory that worker processes can map by name.  buf is a writable memoryview of it; ref
+    the SegmentRef to give the workers.  close() unmaps and removes the segment.
+    """
+
+    def __init__(self, size, backing="auto"):
+        if backing not in BACKINGS:
+            raise ValueError("backing must be one of {}, not {!r}".format(", ".join(BACKINGS), backing))
+        if backing == "auto":
+            backing = "shm" if _shm_has_room(size) else "file"
+        # a mapping cannot be empty
+        mapped_size = max(size, 1)
+        if backing == "shm":
+            self._shm = shared_memory.SharedMemory(create=True, size=mapped_size)
+            name = self._shm.name
+            self.buf = self._shm.buf
+            self._finalizer = weakref.finalize(self, _release_shm, self._shm)
+        else:
+            handle, name = tempfile.mkstemp(prefix=FILE_PREFIX)
+            try:
+                os.ftruncate(handle, mapped_size)
+                self._mmap = mmap.mmap(handle, mapped_size)
+            except BaseException:
+                os.close(handle)
+                os.unlink(name)
+                raise
+            self.buf = memoryview(self._mmap)
+            self._finalizer = weakref.finalize(self, _release_file, self._mmap, handle, name)
+        self.ref = SegmentRef(name, backing, size)
+
+    def close(self):
+        if self._finalizer.alive:
+            self.buf.release()
+            self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+class SegmentReader(object):
+    """ A read-only binary file over a segment mapped from its SegmentRef, for cafa_distributed.range_lines """
+
+    def __init__(self, ref):
+        self.size = ref.size
+        self.position = 0
+        if ref.backing == "shm":
+            self._shm = shared_memory.SharedMemory(name=ref.name)
+            self._mmap = None
+            self._view = self._shm.buf
+        else:
+            with open(ref.name, "rb") as in_handle:
+                self._mmap = mmap.mmap(in_handle.fileno(), max(ref.size, 1), access=mmap.ACCESS_READ)
+            self._shm = None
+            self._view = memoryview(self._mmap)
+
+    def seek(self, position):
+        self.position = position
+        return position
+
+    def tell(self):
+        return self.position
+
+    def read(self, size=-1):
+        end = self.size if size is None or size < 0 else min(self.position + size, self.size)
+        if end <= self.position:
+            return b""
+        data = self._view[self.position:end].tobytes()
+        self.position = end
+        return data
+
+    def close(self):
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+            if self._shm is not None:
+                # mapped, not owned: the segment is removed by its SharedSegment
+                self._shm.close()
+            else:
+                self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+def inflate_member(path, member, backing="auto", block_size=BLOCK_SIZE, deadline=None):
+    """
+    A SharedSegment holding the uncompressed member of the archive path; removed again if inflating fails, or
+    if deadline (an optional cafa_deadline.Deadline) passes first, which raises DeadlineExceeded
+    """
+    with zipfile.ZipFile(path, "r") as files:
+        size = files.getinfo(member).file_size
+        segment = SharedSegment(size, backing)
+        try:
+            with files.open(member) as raw:
+                position = 0
+                while position < size:
+                    if deadline is not None and deadline.reason() is not None:
+                        raise DeadlineExceeded(deadline.partial(member.split("/")[-1]))
+                    view = segment.buf[position:min(position + block_size, size)]
+                    try:
+                        read = raw.readinto(view)
+                    finally:
+                        # released here, or a traceback holding it would keep the segment from being unmapped
+                        view.release()
+                    if not read:
+                        raise EOFError("{} ended after {} of {} bytes".format(member, position, size))
+                    position += read
+        except BaseException:
+            segment.close()
+            raise
+    return segment
+
+
+def is_chunked(filename, size, chunk_bytes=None):
+    """ Whether validate_member_in_chunks inflates a member of size bytes named filename into a segment """
+    if size < 2 * (chunk_bytes or CHUNK_BYTES) or prediction_kind(filename) == "binding":
+        return False
+    return file_name_check(None, filename, _accept, _accept)[1]
+
+
+def validate_member_in_chunks(path, member, workers=None, executor=None, chunk_bytes=None, backing="auto",
+                              deadline=None, progress=None):
+    """
+    file_name_check's (type, correct, errmsg) for the member of the archive path, as cafa_checker reports
+    it.  A GO, HPO or DO member of at least two chunk_bytes is inflated into a segment and its byte ranges
+    validated by workers (a cafa_executor pool); any other member is validated here as a whole.
+    chunk_bytes: default CHUNK_BYTES (cafa_distributed's, 64 MB).
+    deadline: optional cafa_deadline.Deadline.  If it passes (or is cancelled) first, the ranges not started
+    are dropped and the result is inconclusive, (None, None, message), as for a file validated serially.
+    progress: optional cafa_progress.WorkerProgress, updated as the results of the ranges come back.
+    """
+    filename = member.split("/")[-1]
+    kind = prediction_kind(filename)
+    with zipfile.ZipFile(path, "r") as files:
+        size = files.getinfo(member).file_size
+    if not is_chunked(filename, size, chunk_bytes):
+        return _whole(path, member, deadline, progress)
+
+    try:
+        with inflate_member(path, member, backing, deadline=deadline) as segment:
+            ref = segment.ref
+            state = prediction_state(ref, member, filename, kind)
+            if state is None:
+                return _whole(path, member, deadline, progress)
+            ranges = byte_ranges(size, chunk_bytes or CHUNK_BYTES)
+            results = _check_ranges(ref, member, filename, kind, ranges, state, workers, executor, deadline,
+                                    progress)
+            outcome = merge_ranges(ref, {"filename": filename, "member": member, "kind": kind, "ranges": ranges},
+                                   results)
+    except DeadlineExceeded as stopped:
+        return None, None, inconclusive_message(stopped.partial)
+    if outcome is None:
+        # an error only the serial checker reports exactly
+        return _whole(path, member, deadline, progress)
+    return file_name_check(None, filename, checker=lambda infile, fileName: outcome)
+
+
+def _check_ranges(ref, member, filename, kind, ranges, state, workers, executor, deadline, progress=None):
+    """ check_range's result for every range, in order; raises DeadlineExceeded if deadline passes first """
+    pool = make_executor(workers, executor, thread_name_prefix="cafa-chunk")
+    results = []
+    finished = False
+    try:
+        futures = [
+            pool.submit(check_range, ref, member, filename, kind, start, end, None if start == 0 else state, 0,
+                        start != 0)
+            for start, end in ranges
+        ]
+        for future in futures:
+            while deadline is not None and not wait((future,), DEADLINE_POLL_SECONDS).done:
+                if deadline.reason() is not None:
+                    visited_states = RecordValidator(filename, kind, state=_restored(state)).visited_states
+                    lines_checked = sum(result["lines"] for result in results)
+                    raise DeadlineExceeded(deadline.partial(filename, lines_checked, visited_states))
+            result = future.result()
+            results.append(result)
+            if progress is not None:
+                # the ranges cover the member from its start
+                progress.update(ranges[len(results) - 1][1], progress.lines + result["lines"])
+        finished = True
+    finally:
+        # the ranges not started are dropped; once the deadline has passed, the running ones are not waited for
+        pool.shutdown(wait=finished, cancel_futures=True)
+    return results
+
+
+def _accept(path, fileName):
+    return True, None
+
+
+def _whole(path, member, deadline=None, progress=None):
+    if deadline is None:
+        result = validate_member(path, member)
+    else:
+        result = validate_member(path, member, deadline.remaining(), deadline.cancel_event)
+    if progress is not None:
+        progress.update(progress.bytes_total, result.lines)
+    return result.file_type, result.correct, result.errmsg
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import base64
+import hashlib
+import itertools
+import json
+import os
+import sys
+from array import array
+
+from cafa_stats import SECTION_WORDS, _hash64
+
+"""
+Near-duplicate detection across submissions with MinHash sketches.
+
+PredictionSketch.track() wraps the lines handed to a checker, like cafa_stats.SubmissionStats, and sketches
+the set of (target, term, score) of the prediction lines going by; the scores of validated lines all have
+the precision of the ruleset, so equal scores are equal strings.  The sketch is a
+one-permutation MinHash: each prediction is hashed once, the hash picks one of num_perm bins and the bin
+keeps its smallest value.  Empty bins are filled from other bins when the sketch is compared (optimal
+densification), so small files compare as well as large ones.  The fraction of bins two sketches agree
+on estimates the Jaccard similarity of their prediction sets, with a standard error of about
+sqrt(J(1 - J) / num_perm).
+
+cafa_checker(sketches={}) and the scheduler (--sketches) store a sketch per GO/HPO/DO file;
+`./cafa_similarity.py results/` then finds the similar pairs among all of them with LSH banding: the
+signatures are cut into bands, files sharing a band are candidates, and only candidates are compared.
+"""
+
+NUM_PERM = 128
+
+SECTION_BYTES = frozenset(SECTION_WORDS) | frozenset(word.encode("ascii") for word in SECTION_WORDS)
+
+# Bin values are the hash divided by the number of bins; an empty bin holds EMPTY
+EMPTY = (1 << 64) - 1
+
+
+class PredictionSketch(object):
+    def __init__(self, num_perm=NUM_PERM):
+        self.num_perm = num_perm
+        self.minima = array("Q", [EMPTY]) * num_perm
+        self.predictions = 0
+
+    def track(self, lines):
+        """ Yields the lines unchanged while adding the prediction lines to the sketch """
+        minima = self.minima
+        num_perm = self.num_perm
+        section_words = SECTION_BYTES
+        # cafa_stats._hash64, inlined
+        blake2b = hashlib.blake2b
+        from_bytes = int.from_bytes
+        predictions = 0
+        try:
+            for line in lines:
+                fields = line.split()
+                if len(fields) == 3 and fields[0] not in section_words:
+                    if isinstance(line, str):
+                        key = "\t".join(fields).encode("utf-8")
+                    else:
+                        key = b"\t".join(fields)
+                    # the remainder picks the bin, the quotient is the value the bin keeps the smallest of
+                    value, bin_index = divmod(from_bytes(blake2b(key, digest_size=8).digest(), "big"), num_perm)
+                    if value < minima[bin_index]:
+                        minima[bin_index] = value
+                    predictions += 1
+                yield line
+        finally:
+            self.predictions += predictions
+
+    def add_line(self, line):
+        if isinstance(line, str):
+            line = line.encode("utf-8")
+        fields = line.split()
+        if len(fields) != 3 or fields[0] in SECTION_BYTES:
+            return
+        self.add_prediction(fields[0], fields[1], fields[2])
+
+    def add_prediction(self, target, term, score):
+        """ target, term, score: bytes fields of a validated prediction line """
+        self.predictions += 1
+        value, bin_index = divmod(_hash64(b"%s\t%s\t%s" % (target, term, score)), self.num_perm)
+        if value < self.minima[bin_index]:
+            self.minima[bin_index] = value
+
+    def merge(self, other):
+        """ Adds the predictions of another chunk or member to this sketch """
+        if other.num_perm != self.num_perm:
+            raise ValueError("Cannot merge sketches with a different number of bins")
+        minima = self.minima
+        for index, value in enumerate(other.minima):
+            if value < minima[index]:
+                minima[index] = value
+        self.predictions += other.predictions
+        return self
+
+    def signature(self):
+        """ The bin values with the empty bins filled in, the same way for every sketch """
+        minima = self.minima
+        num_perm = self.num_perm
+        if self.predictions == 0:
+            return tuple(minima)
+        signature = list(minima)
+        for index, value in enumerate(minima):
+            if value != EMPTY:
+                continue
+            # probe bins in an order that depends on the bin only, until a non-empty one is found
+            for attempt in itertools.count():
+                donor = _hash64(b"%d:%d" % (index, attempt)) % num_perm
+                if minima[donor] != EMPTY:
+                    signature[index] = minima[donor]
+                    break
+        return tuple(signature)
+
+    def jaccard(self, other):
+        """ Estimated Jaccard similarity of the two prediction sets """
+        if other.num_perm != self.num_perm:
+            raise ValueError("Cannot compare sketches with a different number of bins")
+        if not self.predictions or not other.predictions:
+            return 0.0
+        return _agreement(self.signature(), other.signature())
+
+    def to_dict(self):
+        """ The sketch as JSON-able data; the bin values are stored little-endian """
+        minima = array("Q", self.minima)
+        if sys.byteorder == "big":
+            minima.byteswap()
+        return {
+            "num_perm": self.num_perm,
+            "predictions": self.predictions,
+            "minima": base64.b64encode(minima.tobytes()).decode("ascii"),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data["num_perm"])
+        sketch.minima = array("Q")
+        sketch.minima.frombytes(base64.b64decode(data["minima"]))
+        if sys.byteorder == "big":
+            sketch.minima.byteswap()
+        sketch.predictions = data["predictions"]
+        return sketch
+
+
+def _agreement(signature, other):
+    return sum(1 for a, b in zip(signature, other) if a == b) / float(len(signature))
+
+
+def band_threshold(num_perm, bands):
+    """ The similarity at which a pair becomes a candidate with probability about 1/2 """
+    rows = num_perm // bands
+    return (1.0 / bands) ** (1.0 / rows)
+
+
+def similar_pairs(sketches, threshold=0.8, bands=16):
+    """
+    sketches: {key: PredictionSketch}, all with the same number of bins.  Returns [(similarity, key_a,
+    key_b)] for the pairs of sketches sharing at least one LSH band whose estimated Jaccard similarity is at
+    least threshold, most similar first.  bands must divide num_perm; more bands find less similar pairs at
+    the cost of more candidates (see band_threshold).
+    """
+    signatures = dict((key, sketch.signature()) for key, sketch in sketches.items() if sketch.predictions)
+    if not signatures:
+        return []
+    num_perm = len(next(iter(signatures.values())))
+    if num_perm % bands:
+        raise ValueError("bands ({}) must divide the number of bins ({})".format(bands, num_perm))
+    rows = num_perm // bands
+    buckets = {}
+    for key, signature in signatures.items():
+        if len(signature) != num_perm:
+            raise ValueError("Cannot compare sketches with a different number of bins: {}".format(key))
+        for band in range(bands):
+            buckets.setdefault((band, signature[band * rows:(band + 1) * rows]), []).append(key)
+
+    candidates = set()
+    for keys in buckets.values():
+        if len(keys) > 1:
+            candidates.update(itertools.combinations(sorted(keys), 2))
+    pairs = []
+    for key_a, key_b in candidates:
+        similarity = _agreement(signatures[key_a], signatures[key_b])
+        if similarity >= threshold:
+            pairs.append((similarity, key_a, key_b))
+    pairs.sort(key=lambda pair: (-pair[0], pair[1], pair[2]))
+    return pairs
+
+
+def load_sketches(paths):
+    """
+    Reads the sketches in scheduler results (<submission>.json with a "sketches" entry), in JSON files
+    written by cafa4_format_checker.py --sketches ({file: sketch}) and in directories of either.  Returns
+    {(submission, file): PredictionSketch}.
+    """
+    sketches = {}
+    for path in paths:
+        if os.path.isdir(path):
+            names = sorted(name for name in os.listdir(path) if name.endswith(".json"))
+            sketches.update(load_sketches([os.path.join(path, name) for name in names]))
+            continue
+        with open(path) as in_handle:
+            data = json.load(in_handle)
+        if "sketches" in data:
+            submission = data.get("file", os.path.basename(path))
+            data = data["sketches"] or {}
+        else:
+            submission = os.path.basename(path)
+        for file_name, sketch in data.items():
+            sketches[(submission, file_name)] = PredictionSketch.from_dict(sketch)
+    return sketches
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Find near-duplicate prediction files among submissions")
+    parser.add_argument("paths", nargs="+",
+                        help="scheduler results directories or files, or JSON files written with --sketches")
+    parser.add_argument("--threshold", type=float, default=0.8,
+                        help="smallest estimated Jaccard similarity reported (default %(default)s)")
+    parser.add_argument("--bands", type=int, default=16,
+                        help="LSH bands; must divide the number of bins (default %(default)s)")
+    args = parser.parse_args(argv)
+
+    sketches = load_sketches(args.paths)
+    pairs = similar_pairs(sketches, args.threshold, args.bands)
+    for similarity, key_a, key_b in pairs:
+        print("{:.3f}\t{}\t{}\t{}\t{}".format(similarity, key_a[0], key_a[1], key_b[0], key_b[1]))
+    sys.stdout.flush()
+    print("{:,} files, {:,} similar pairs".format(len(sketches), len(pairs)), file=sys.stderr)
+    return pairs
+
+
+if __name__ == "__main__":
+    main()
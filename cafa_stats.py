@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import base64
+import bisect
+import hashlib
+import math
+
+"""
+Bounded-memory submission statistics, collected in the same pass as validation.
+
+SubmissionStats.track() wraps the lines handed to a checker and profiles the prediction lines going by:
+    - distinct targets and distinct terms: HyperLogLog sketches (16 KB each, ~0.8% standard error)
+    - confidence histogram per MODEL: 101 fixed bins, exact because scores have two decimals
+    - predictions per target: a t-digest over the lengths of runs of consecutive lines with the same target
+      (submissions are normally grouped by target; an interleaved target counts as several runs)
+    - trivially flat scores: the share of target runs whose scores are all identical
+Every structure has a fixed size whatever the file size, and merge() combines the state of two chunks or
+archive members exactly (HyperLogLog registers take the maximum, histograms add, t-digests merge).
+"""
+
+HLL_PRECISION = 14
+
+# Fixed bins for the predictions-per-target histogram: upper bounds, inclusive
+RUN_LENGTH_BINS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000)
+
+SECTION_WORDS = ("AUTHOR", "MODEL", "KEYWORDS", "ACCURACY", "END")
+
+
+def _hash64(value):
+    """ A hash that is stable across processes (unlike hash()), so sketches from different workers merge """
+    return int.from_bytes(hashlib.blake2b(value, digest_size=8).digest(), "big")
+
+
+class HyperLogLog(object):
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value):
+        """ value: bytes """
+        hashed = _hash64(value)
+        width = 64 - self.precision
+        index = hashed >> width
+        # position of the leftmost 1 bit in the remaining bits
+        rank = width - (hashed & ((1 << width) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLog sketches of different precision")
+        registers = self.registers
+        for index, rank in enumerate(other.registers):
+            if rank > registers[index]:
+                registers[index] = rank
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -rank for rank in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # small range correction: linear counting
+            estimate = m * math.log(m / float(zeros))
+        return int(round(estimate))
+
+    def to_dict(self):
+        return {"precision": self.precision, "registers": base64.b64encode(bytes(self.registers)).decode("ascii")}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data["precision"])
+        sketch.registers = bytearray(base64.b64decode(data["registers"]))
+        return sketch
+
+
+class TDigest(object):
+    """ A merging t-digest (Dunning) for quantiles of an unbounded distribution in fixed memory """
+
+    def __init__(self, compression=100):
+        self.compression = compression
+        # sorted lists of centroid means and weights
+        self.means = []
+        self.weights = []
+        self._buffer = []
+        self.total = 0
+
+    def add(self, value, weight=1):
+        self._buffer.append((value, weight))
+        if len(self._buffer) >= 10 * self.compression:
+            self._compress()
+
+    def merge(self, other):
+        other._compress()
+        self._buffer.extend(zip(other.means, other.weights))
+        self._compress()
+
+    def _compress(self):
+        if not self._buffer:
+            return
+        points = sorted(list(zip(self.means, self.weights)) + self._buffer)
+        self._buffer = []
+        total = sum(weight for value, weight in points)
+        means = []
+        weights = []
+        so_far = 0
+        current_mean, current_weight = points[0]
+        limit = total * self._quantile_limit(0.0)
+        for value, weight in points[1:]:
+            if so_far + current_weight + weight <= limit:
+                current_mean += (value - current_mean) * weight / float(current_weight + weight)
+                current_weight += weight
+            else:
+                so_far += current_weight
+                means.append(current_mean)
+                weights.append(current_weight)
+                limit = total * self._quantile_limit(so_far / float(total))
+                current_mean, current_weight = value, weight
+        means.append(current_mean)
+        weights.append(current_weight)
+        self.means = means
+        self.weights = weights
+        self.total = total
+
+    def _quantile_limit(self, quantile):
+        """ Upper quantile bound of a centroid starting at quantile (k1 scale function) """
+        k = self.compression / (2 * math.pi) * math.asin(2 * quantile - 1) + 1
+        k = min(k, self.compression / 4.0)
+        return (math.sin(2 * math.pi * k / self.compression) + 1) / 2
+
+    def quantile(self, q):
+        self._compress()
+        if not self.means:
+            return None
+        target = q * self.total
+        cumulative = 0
+        for mean, weight in zip(self.means, self.weights):
+            if cumulative + weight >= target:
+                return mean
+            cumulative += weight
+        return self.means[-1]
+
+    def to_dict(self):
+        self._compress()
+        return {"compression": self.compression, "means": self.means, "weights": self.weights}
+
+    @classmethod
+    def from_dict(cls, data):
+        digest = cls(data["compression"])
+        digest.means = list(data["means"])
+        digest.weights = list(data["weights"])
+        digest.total = sum(digest.weights)
+        return digest
+
+
+class SubmissionStats(object):
+    def __init__(self):
+        self.targets = HyperLogLog()
+        self.terms = HyperLogLog()
+        # MODEL number (as a string) -> 101 bins, one per hundredth
+        self.confidence = {}
+        self.run_lengths = TDigest()
+        self.run_length_bins = [0] * (len(RUN_LENGTH_BINS) + 1)
+        self.runs = 0
+        self.flat_runs = 0
+        self.predictions = 0
+        # current target run, carried between lines
+        self._model = "1"
+        self._run_target = None
+        self._run_length = 0
+        self._run_score = None
+        self._run_flat = True
+
+    def track(self, lines):
+        """ Yields the lines unchanged while adding the prediction lines to the statistics """
+        for line in lines:
+            self.add_line(line)
+            yield line
+        self.finish()
+
+    def add_line(self, line):
+        if isinstance(line, str):
+            line = line.encode("utf-8")
+        fields = line.split()
+        if not fields:
+            return
+        if fields[0] == b"MODEL":
+            self._end_run()
+            if len(fields) > 1:
+                self._model = fields[1].decode("utf-8", "replace")
+            return
+        if len(fields) != 3 or fields[0].decode("ascii", "replace") in SECTION_WORDS:
+            return
+        self.add_prediction(fields[0], fields[1], fields[2])
+
+    def add_prediction(self, target, term, score):
+        """ target, term, score: bytes fields of a validated prediction line """
+        self.predictions += 1
+        if target != self._run_target:
+            self._end_run()
+            self.targets.add(target)
+            self._run_target = target
+            self._run_score = score
+        elif score != self._run_score:
+            self._run_flat = False
+        self._run_length += 1
+        self.terms.add(term)
+        bins = self.confidence.get(self._model)
+        if bins is None:
+            bins = self.confidence[self._model] = [0] * 101
+        try:
+            hundredths = int(round(float(score) * 100))
+        except ValueError:
+            return
+        if 0 <= hundredths <= 100:
+            bins[hundredths] += 1
+
+    def _end_run(self):
+        if self._run_length:
+            self.runs += 1
+            if self._run_flat and self._run_length > 1:
+                self.flat_runs += 1
+            self.run_lengths.add(self._run_length)
+            self.run_length_bins[bisect.bisect_left(RUN_LENGTH_BINS, self._run_length)] += 1
+        self._run_target = None
+        self._run_length = 0
+        self._run_score = None
+        self._run_flat = True
+
+    def finish(self):
+        """ Closes the current target run; call once the file has been read """
+        self._end_run()
+
+    def merge(self, other):
+        """ Adds the statistics of another chunk or member to this one """
+        self.finish()
+        other.finish()
+        self.targets.merge(other.targets)
+        self.terms.merge(other.terms)
+        for model, bins in other.confidence.items():
+            mine = self.confidence.setdefault(model, [0] * 101)
+            for index, count in enumerate(bins):
+                mine[index] += count
+        self.run_lengths.merge(other.run_lengths)
+        self.run_length_bins = [a + b for a, b in zip(self.run_length_bins, other.run_length_bins)]
+        self.runs += other.runs
+        self.flat_runs += other.flat_runs
+        self.predictions += other.predictions
+        return self
+
+    def confidence_quantile(self, q, model=None):
+        """ Exact quantile of the confidence scores (of one MODEL, or all) """
+        if model is None:
+            bins = [sum(column) for column in zip(*self.confidence.values())] if self.confidence else []
+        else:
+            bins = self.confidence.get(model, [])
+        total = sum(bins)
+        if not total:
+            return None
+        cumulative = 0
+        for hundredths, count in enumerate(bins):
+            cumulative += count
+            if cumulative >= q * total:
+                return hundredths / 100.0
+        return 1.0
+
+    def summary(self):
+        """ A JSON-friendly profile of the submission """
+        self.finish()
+        distinct_targets = self.targets.count()
+        return {
+            "predictions": self.predictions,
+            "distinct_targets": distinct_targets,
+            "distinct_terms": self.terms.count(),
+            "predictions_per_target": {
+                "mean": self.predictions / float(distinct_targets) if distinct_targets else 0.0,
+                "median": self.run_lengths.quantile(0.5),
+                "p90": self.run_lengths.quantile(0.9),
+                "p99": self.run_lengths.quantile(0.99),
+                "histogram": dict(
+                    ("<={}".format(bound), count) for bound, count in zip(RUN_LENGTH_BINS, self.run_length_bins)
+                ),
+                "histogram_overflow": self.run_length_bins[-1],
+            },
+            "confidence_histograms": dict(
+                (model, dict(("{:.2f}".format(index / 100.0), count) for index, count in enumerate(bins) if count))
+                for model, bins in self.confidence.items()
+            ),
+            "confidence_median": self.confidence_quantile(0.5),
+            "flat_target_share": self.flat_runs / float(self.runs) if self.runs else 0.0,
+        }
+
+    def to_dict(self):
+        """ Complete mergeable state, e.g. to send back from a worker process """
+        self.finish()
+        return {
+            "targets": self.targets.to_dict(),
+            "terms": self.terms.to_dict(),
+            "confidence": self.confidence,
+            "run_lengths": self.run_lengths.to_dict(),
+            "run_length_bins": self.run_length_bins,
+            "runs": self.runs,
+            "flat_runs": self.flat_runs,
+            "predictions": self.predictions,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.targets = HyperLogLog.from_dict(data["targets"])
+        stats.terms = HyperLogLog.from_dict(data["terms"])
+        stats.confidence = dict((model, list(bins)) for model, bins in data["confidence"].items())
+        stats.run_lengths = TDigest.from_dict(data["run_lengths"])
+        stats.run_length_bins = list(data["run_length_bins"])
+        stats.runs = data["runs"]
+        stats.flat_runs = data["flat_runs"]
+        stats.predictions = data["predictions"]
+        return stats
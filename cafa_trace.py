@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from cafa_progress import section_of
+
+"""
+Span-based tracing of the validation phases.
+
+cafa4_format_checker.cafa_checker(tracer=Tracer("spans.jsonl")) records one trace per submission:
+
+    submission                      path, bytes, valid
+        open                        is it an archive
+        zip_directory               members
+        precheck                    (a plain file, with precheck=True)
+        member                      member, bytes, compressed_bytes
+            decompress              bytes, busy_seconds (on the reader thread, alongside the validation)
+            file_name_check         file_type, kind, correct, lines
+                section             section, lines (one per run of author, model, ..., prediction, end lines)
+        report
+
+Every finished span is written as one line of JSON, in the shape of an OpenTelemetry span (trace_id,
+span_id, parent_span_id, name, start_time_unix_nano, end_time_unix_nano, attributes, resource).  Each line
+is a single write() to a file opened for appending, so worker processes can share one file.
+`./cafa_trace.py spans.jsonl -o trace.json` converts it to the Chrome trace event format that
+chrome://tracing, Perfetto and speedscope open.
+
+Sampling is decided once per submission: with sample_rate 0.01 one trace in a hundred is recorded, whole.
+The other submissions run without any tracing wrapper; trace() and span() cost a function call.  In a
+sampled trace the section spans look at the first character of every line and classify only the lines
+that can start a new section.
+"""
+
+# First characters of the lines that can start a section other than predictions (AUTHOR, MODEL, ...)
+SECTION_INITIALS = frozenset("AMKE")
+
+SERVICE_NAME = "cafa-format-checker"
+
+
+def _span_id():
+    return "%016x" % random.getrandbits(64)
+
+
+class Span(object):
+    __slots__ = ("tracer", "name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "attributes")
+
+    def __init__(self, tracer, name, trace_id, parent_id, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _span_id()
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.tracer._stack().append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.tracer._stack().pop()
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        self.end()
+        return False
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            self.tracer.export(self)
+
+    def child(self, name, **attributes):
+        """ A span under this one that is not made current, e.g. for work done on another thread """
+        return Span(self.tracer, name, self.trace_id, self.span_id, attributes)
+
+
+class _NullSpan(object):
+    """ Stands in for a span when the submission is not sampled or no tracer is given """
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _TracedReader(object):
+    """ Wraps a binary file object and records the time spent in its read() calls as one span """
+
+    def __init__(self, raw, span):
+        self.raw = raw
+        self.span = span
+        self.busy_ns = 0
+        self.nbytes = 0
+        self.first_ns = None
+        self.last_ns = None
+
+    def read(self, size=-1):
+        start = time.time_ns()
+        data = self.raw.read(size)
+        end = time.time_ns()
+        if self.first_ns is None:
+            self.first_ns = start
+            self.span.set(**{"thread.id": threading.get_ident()})
+        self.last_ns = end
+        self.busy_ns += end - start
+        self.nbytes += len(data)
+        return data
+
+    def finish(self):
+        span = self.span
+        if self.first_ns is not None:
+            span.start_ns = self.first_ns
+            span.end_ns = self.last_ns
+        else:
+            span.end_ns = span.start_ns
+        span.set(bytes=self.nbytes, busy_seconds=self.busy_ns / 1e9)
+        span.tracer.export(span)
+
+    def __getattr__(self, attr):
+        return getattr(self.raw, attr)
+
+
+class NullTracer(object):
+    """ The tracer used when none is given: records nothing """
+
+    def trace(self, name, **attributes):
+        return NULL_SPAN
+
+    span = trace
+
+    @contextmanager
+    def traced_reader(self, raw, name="decompress", **attributes):
+        yield raw
+
+    @contextmanager
+    def track_sections(self, lines):
+        yield lines
+
+
+NULL_TRACER = NullTracer()
+
+
+class Tracer(object):
+    """
+    path: file the spans are appended to, as JSON lines
+    sample_rate: fraction of submissions traced
+    """
+
+    def __init__(self, path, sample_rate=1.0, rng=random.random):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.rng = rng
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._local = threading.local()
+
+    def _stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            stack = self._local.stack = []
+            return stack
+
+    def current(self):
+        """ The innermost open span of this thread, or None """
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    def trace(self, name, **attributes):
+        """ The root span of a new trace, or NULL_SPAN if this one is not sampled """
+        if self.sample_rate < 1.0 and self.rng() >= self.sample_rate:
+            return NULL_SPAN
+        return Span(self, name, "%032x" % random.getrandbits(128), None, attributes)
+
+    def span(self, name, **attributes):
+        """ A span under the current one; NULL_SPAN outside a sampled trace """
+        parent = self.current()
+        if parent is None:
+            return NULL_SPAN
+        return parent.child(name, **attributes)
+
+    @contextmanager
+    def traced_reader(self, raw, name="decompress", **attributes):
+        """ Gives raw wrapped to record its reads as a span under the current one, exported at the end """
+        parent = self.current()
+        if parent is None:
+            yield raw
+            return
+        reader = _TracedReader(raw, parent.child(name, **attributes))
+        try:
+            yield reader
+        finally:
+            reader.finish()
+
+    @contextmanager
+    def track_sections(self, lines):
+        """
+        Gives the lines, unchanged, with a section span recorded per run of lines of one record type.  The
+        last span ends with the block, also when the checker stopped early.
+        """
+        parent = self.current()
+        if parent is None:
+            yield lines
+            return
+        tracked = self._sections(lines, parent)
+        try:
+            yield tracked
+        finally:
+            tracked.close()
+
+    def _sections(self, lines, parent):
+        initials = SECTION_INITIALS
+        span = None
+        count = 0
+        # every line is classified until the predictions start, then only those that may end them
+        in_predictions = False
+        try:
+            for line in lines:
+                if not in_predictions or line[:1] in initials:
+                    section = section_of(line)
+                    in_predictions = section == "prediction"
+                    if span is None or section != span.attributes["section"]:
+                        if span is not None:
+                            span.set(lines=count)
+                            span.end()
+                        span = parent.child("section", section=section)
+                        count = 0
+                count += 1
+                yield line
+        finally:
+            if span is not None:
+                span.set(lines=count)
+                span.end()
+
+    def export(self, span):
+        attributes = dict(span.attributes)
+        attributes.setdefault("thread.id", threading.get_ident())
+        record = {
+            "trace_id": span.trace_id,
+            "span_id": span.span_id,
+            "parent_span_id": span.parent_id,
+            "name": span.name,
+            "start_time_unix_nano": span.start_ns,
+            "end_time_unix_nano": span.end_ns,
+            "attributes": attributes,
+            # looked up here: a tracer inherited by a forked worker process reports the worker
+            "resource": {"service.name": SERVICE_NAME, "process.pid": os.getpid()},
+        }
+        # one write per line: appends from several processes do not interleave
+        os.write(self._fd, (json.dumps(record, default=str) + "\n").encode("utf-8"))
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __getstate__(self):
+        # a tracer sent to a worker process opens the file again there
+        return {"path": self.path, "sample_rate": self.sample_rate}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"], state["sample_rate"])
+
+
+def read_spans(path):
+    with open(path) as in_handle:
+        return [json.loads(line) for line in in_handle if line.strip()]
+
+
+def chrome_trace(spans):
+    """ The spans (dicts as exported) as a Chrome trace event format document """
+    events = []
+    for span in spans:
+        attributes = dict(span["attributes"])
+        attributes["trace_id"] = span["trace_id"]
+        events.append({
+            "name": span["name"],
+            "cat": "cafa",
+            "ph": "X",
+            "ts": span["start_time_unix_nano"] / 1000.0,
+            "dur": (span["end_time_unix_nano"] - span["start_time_unix_nano"]) / 1000.0,
+            "pid": span["resource"].get("process.pid", 0),
+            "tid": attributes.pop("thread.id", 0),
+            "args": attributes,
+        })
+    events.sort(key=lambda event: (event["ts"], -event["dur"]))
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert validation spans to a Chrome/Perfetto trace file")
+    parser.add_argument("spans", help="JSON lines file written by --trace")
+    parser.add_argument("-o", "--output", default="trace.json", help="trace file to write (default %(default)s)")
+    args = parser.parse_args(argv)
+
+    spans = read_spans(args.spans)
+    with open(args.output, "w") as out_handle:
+        json.dump(chrome_trace(spans), out_handle)
+    print("{:,} spans written to {}".format(len(spans), args.output))
+    return len(spans)
+
+
+if __name__ == "__main__":
+    main()
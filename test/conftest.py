@@ -0,0 +1,9 @@
+import os
+import pytest
+
+
+@pytest.fixture(scope="session")
+def test_data_path():
+    ''' Provides a single, consistent absolute path to the test_data directory across environments '''
+    root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return "{}/test/test_data/".format(root_path)
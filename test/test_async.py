@@ -0,0 +1,160 @@
+import asyncio
+import time
+import zipfile
+from cafa_async import AsyncValidator, MemberResult, validate_async
+
+HEADER = ["AUTHOR ateam", "MODEL 1", "KEYWORDS sequence alignment."]
+
+
+def go_file(n_targets=10, model=1, bad_line=None):
+    lines = [line if line != "MODEL 1" else "MODEL %d" % model for line in HEADER]
+    lines += ["T{:011d}\tGO:0000001\t0.50".format(target) for target in range(n_targets)]
+    if bad_line is not None:
+        lines.insert(bad_line, "T00000000001\tGO:0000001\t1.50")
+    return "\n".join(lines + ["END"]) + "\n"
+
+
+def write_archive(path):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("ateam_1_9606.txt", go_file())
+        archive.writestr("ateam_2_9606.txt", go_file(model=2, bad_line=5))
+        archive.writestr("ateam_3_9606.txt", go_file(model=3))
+
+
+def test_members_are_yielded_in_order(tmpdir):
+    path = str(tmpdir.join("ateam.zip"))
+    write_archive(path)
+
+    async def run():
+        async with AsyncValidator(max_workers=2) as validator:
+            members = [result async for result in validator.iter_members(path)]
+            return members, await validator.validate(path)
+
+    members, (is_valid, results) = asyncio.run(run())
+    assert [result.filename for result in members] == ["ateam_1_9606.txt", "ateam_2_9606.txt", "ateam_3_9606.txt"]
+    assert [result.correct for result in members] == [True, False, True]
+    assert "line 6" in members[1].errmsg
+    assert is_valid is False and results == members
+
+
+def test_concurrent_submissions_share_one_pool(tmpdir):
+    paths = []
+    for number in range(8):
+        path = tmpdir.join("team%d_1_9606.txt" % number)
+        path.write(go_file(bad_line=4 if number == 3 else None))
+        paths.append(str(path))
+
+    async def run():
+        validator = AsyncValidator(max_workers=2, max_concurrency=3, executor="thread")
+        try:
+            return await asyncio.gather(*(validate_async(path, validator=validator) for path in paths))
+        finally:
+            validator.close()
+
+    verdicts = [is_valid for is_valid, _ in asyncio.run(run())]
+    assert verdicts == [True, True, True, False, True, True, True, True]
+
+
+def test_stream_is_validated_as_it_arrives():
+    data = go_file(200, bad_line=4).encode()
+    received = []
+
+    async def upload():
+        for start in range(0, len(data), 100):
+            received.append(start)
+            yield data[start:start + 100]
+
+    async def run():
+        async with AsyncValidator(executor="thread") as validator:
+            return await validator.validate(upload(), "ateam_1_9606.txt")
+
+    is_valid, results = asyncio.run(run())
+    assert is_valid is False
+    assert results[0] == MemberResult("ateam_1_9606.txt", "GO/HPO Prediction", False, results[0].errmsg)
+    # rejected long before the end of the upload
+    assert len(received) < len(data) // 100 // 2
+
+
+def test_stream_file_name_is_checked_first():
+    received = []
+
+    async def upload():
+        received.append(True)
+        yield go_file().encode()
+
+    async def run():
+        async with AsyncValidator(executor="thread") as validator:
+            bad_name = await validator.validate(upload(), "garbage.txt")
+            return bad_name, await validator.validate(upload(), "ateam_1_9606.txt")
+
+    (is_valid, results), (good_name, _) = asyncio.run(run())
+    assert is_valid is False
+    assert results[0].file_type is None
+    assert "not enough fields separated by '_'" in results[0].errmsg
+    assert good_name is True and len(received) == 1
+
+
+def test_cancelling_stops_the_running_job(tmpdir):
+    path = tmpdir.join("ateam_1_9606.txt")
+    path.write(go_file(1500000))
+
+    async def run():
+        validator = AsyncValidator(max_workers=1, executor="thread")
+        try:
+            task = asyncio.ensure_future(validator.validate(str(path)))
+            await asyncio.sleep(0.2)
+            # still running: the file takes seconds to validate
+            assert task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            start = time.monotonic()
+            while validator.in_flight and time.monotonic() - start < 10:
+                await asyncio.sleep(0.01)
+            return validator.in_flight, time.monotonic() - start
+        finally:
+            validator.close()
+
+    in_flight, waited = asyncio.run(run())
+    assert in_flight == 0 and waited < 1
+
+
+def test_time_budget_makes_a_file_inconclusive(tmpdir):
+    path = tmpdir.join("ateam_1_9606.txt")
+    path.write(go_file(400000))
+
+    async def run():
+        async with AsyncValidator(executor="thread", time_budget=0.01) as validator:
+            return await validator.validate(str(path))
+
+    is_valid, results = asyncio.run(run())
+    assert is_valid is None and "Inconclusive" in results[0].errmsg
+
+
+def test_streams_wait_for_a_slot():
+    gate = asyncio.Event()
+    received = []
+
+    async def held_upload():
+        yield go_file().encode()[:50]
+        await gate.wait()
+        yield go_file().encode()[50:]
+
+    async def upload():
+        received.append(True)
+        yield go_file().encode()
+
+    async def run():
+        async with AsyncValidator(max_concurrency=1, executor="thread") as validator:
+            first = asyncio.ensure_future(validator.validate(held_upload(), "ateam_1_9606.txt"))
+            await asyncio.sleep(0.05)
+            assert validator.in_flight == 1
+            second = asyncio.ensure_future(validator.validate(upload(), "ateam_2_9606.txt"))
+            await asyncio.sleep(0.05)
+            # the only slot is held by the first upload
+            assert received == []
+            gate.set()
+            return [is_valid for is_valid, _ in await asyncio.gather(first, second)], received
+
+    assert asyncio.run(run()) == ([True, True], [True])
@@ -0,0 +1,17 @@
+import cafa_go_format_checker
+from cafa_benchmark import measure
+
+
+def test_valid_lines_allocate_little(monkeypatch):
+    fast = measure("go", 5000)
+    # every line through the validators
+    monkeypatch.setattr(cafa_go_format_checker, "valid_prediction_line", lambda line: None)
+    slow = measure("go", 5000)
+    assert fast["bytes_per_million_lines"] < slow["bytes_per_million_lines"]
+    assert fast["retained_bytes"] < 4096
+
+
+def test_binding_rows_allocate_independently_of_their_length():
+    short = measure("binding", 2000, residues=20)
+    long = measure("binding", 2000, residues=2000)
+    assert long["max_line_bytes"] < 2 * short["max_line_bytes"]
@@ -0,0 +1,98 @@
+import glob
+import io
+import os
+import threading
+import pytest
+import cafa_binding_parallel
+import cafa_binding_site_format_checker
+from cafa_benchmark import synthetic_lines
+from cafa4_format_checker import cafa_checker as cafa4_checker, main
+from cafa_binding_parallel import _next_target, cafa_checker, target_batches
+from cafa_deadline import Deadline, DeadlineExceeded
+
+
+@pytest.fixture
+def small_batches(monkeypatch):
+    monkeypatch.setattr(cafa_binding_parallel, "MIN_PARALLEL_BYTES", 0)
+    monkeypatch.setattr(cafa_binding_parallel, "SCAN_BYTES", 5)
+
+
+def serial(path):
+    with open(path, "r") as infile:
+        return cafa_binding_site_format_checker.cafa_checker(infile, os.path.basename(path))
+
+
+def write(tmpdir, lines, name="ateam_1_9606_binding.txt"):
+    path = str(tmpdir.join(name))
+    with open(path, "w") as out_handle:
+        out_handle.writelines(lines)
+    return path
+
+
+def test_next_target_finds_line_starts_across_reads(small_batches):
+    data = io.BytesIO(b">T1\nRNA\n0.1\n>T2\nx>y\n>T3\n")
+    assert _next_target(data, 0) == 0
+    assert _next_target(data, 1) == 12
+    # a ">" inside a line is not a target
+    assert _next_target(data, 12) == 20
+    assert _next_target(data, 20) is None
+
+
+def test_batches_cover_the_blocks(tmpdir, small_batches):
+    path = write(tmpdir, synthetic_lines("binding", 700, residues=10))
+    ranges = target_batches(path, batch_bytes=300)
+    assert len(ranges) > 10
+    assert all(end == next_start for (_, end), (next_start, _) in zip(ranges, ranges[1:]))
+    assert ranges[-1][1] == os.path.getsize(path)
+
+
+@pytest.mark.parametrize("workers, executor", [(1, None), (2, "process"), (2, "thread")])
+def test_same_result_as_the_serial_checker(tmpdir, small_batches, workers, executor):
+    valid = list(synthetic_lines("binding", 700, residues=10))
+    cases = [
+        valid,
+        # a score row missing before the next target, in the middle of the file
+        valid[:300] + [valid[300].replace("0.00, ", "")] + valid[301:],
+        valid[:400] + [">T00000999\n"] + valid[400:],
+        # a record line inside the target blocks, then a fourth model
+        valid[:200] + ["MODEL 2\n"] + valid[200:400] + ["MODEL 3\n", "MODEL 4\n"] + valid[400:],
+        # sections out of order, reported at the end
+        valid[:-1] + ["KEYWORDS phylogeny\n"] + valid[-1:],
+        valid[:3] + valid[-1:],
+    ]
+    for lines in cases:
+        path = write(tmpdir, lines)
+        assert cafa_checker(path, workers=workers, batch_bytes=200, executor=executor) == serial(path)
+
+
+def test_example_files(small_batches):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for path in glob.glob(os.path.join(root, "Binding Site Test Predictions", "*.txt")):
+        assert cafa_checker(path, workers=1, batch_bytes=64) == serial(path)
+
+
+@pytest.mark.parametrize("workers, executor", [(1, None), (2, "thread")])
+def test_deadline_stops_between_batches(tmpdir, small_batches, workers, executor):
+    path = write(tmpdir, synthetic_lines("binding", 700, residues=10))
+    cancel_event = threading.Event()
+    cancel_event.set()
+    with pytest.raises(DeadlineExceeded) as stopped:
+        cafa_checker(path, workers=workers, batch_bytes=200, executor=executor, deadline=Deadline(None, cancel_event))
+    assert stopped.value.partial.reason == "cancelled"
+    assert stopped.value.partial.visited_states == ["author", "model", "keywords"]
+
+
+def test_binding_workers_keep_the_checker_options(tmpdir, small_batches, capsys, monkeypatch):
+    path = write(tmpdir, synthetic_lines("binding", 700, residues=10))
+    assert cafa4_checker(path, binding_workers=2, executor="thread", time_budget=0) is None
+    assert "Inconclusive: validation of ateam_1_9606_binding.txt stopped" in capsys.readouterr().out
+
+    no_end = write(tmpdir, list(synthetic_lines("binding", 700, residues=10))[:-1], "ateam_2_9606_binding.txt")
+    # rejected by the precheck, before any worker starts
+    monkeypatch.setattr(cafa_binding_parallel, "cafa_checker", None)
+    assert cafa4_checker(no_end, binding_workers=2, executor="thread", precheck=True) is False
+
+    for option in (["--stats", "stats.json"], ["--metrics-textfile", "cafa.prom"]):
+        with pytest.raises(SystemExit):
+            main([path, "--binding-workers", "2"] + option)
+        assert "cannot be used with --binding-workers" in capsys.readouterr().err
@@ -0,0 +1,79 @@
+import os
+import pytest
+import cafa_canonicalize
+from cafa_canonicalize import CanonicalizeError, ExternalSorter, canonicalize, canonicalize_lines, output_name
+from cafa_go_format_checker import cafa_checker as go
+
+
+def test_external_sort_spills_and_merges(tmpdir, monkeypatch):
+    monkeypatch.setattr(cafa_canonicalize, "MERGE_FAN_IN", 3)
+    records = ["{:05d}\n".format((i * 7919) % 1000) for i in range(1000)]
+    # a budget of ~10 records per run gives 100 runs, merged in several passes
+    sorter = ExternalSorter(str(tmpdir), memory_budget=10 * (6 + cafa_canonicalize.RECORD_OVERHEAD))
+    for record in records:
+        sorter.add(record)
+    assert len(sorter.runs) >= 99
+    assert list(sorter.sorted_records()) == sorted(records)
+
+
+def test_output_name():
+    assert output_name("ateam_1_9606.txt", "2") == "ateam_2_9606.txt"
+    assert output_name("tc_ateam_1_9606.txt", "3") == "tc_ateam_3_9606.txt"
+
+
+def test_models_split_and_sorted(tmpdir, monkeypatch):
+    monkeypatch.setattr(cafa_canonicalize, "RECORD_OVERHEAD", 0)
+    lines = [
+        "AUTHOR   ateam\n",
+        "MODEL 1\n",
+        "KEYWORDS sequence alignment.\n",
+        "ACCURACY 1 PR=0.50; RC=0.50\n",
+        "T96060000002 GO:0000002    0.50\n",
+        "T96060000001\tGO:0000009 0.10\n",
+        "T96060000001 GO:0000001 1.00\n",
+        "MODEL 2\n",
+        "KEYWORDS  sequence alignment, machine learning.\n",
+        "T96060000003 GO:0000001 0.20\n",
+        "T96060000001 GO:0000001 0.30\n",
+        "END\n",
+    ]
+    out_dir = str(tmpdir.join("out"))
+    written = canonicalize_lines(lines, "ateam_1_9606.txt", out_dir, memory_budget=64, tmp_dir=str(tmpdir))
+    assert [os.path.basename(path) for path in written] == ["ateam_1_9606.txt", "ateam_2_9606.txt"]
+    first = open(written[0]).read().splitlines()
+    assert first == [
+        "AUTHOR\tateam",
+        "MODEL\t1",
+        "KEYWORDS sequence alignment.",
+        "ACCURACY\t1\tPR=0.50;\tRC=0.50",
+        "T96060000001\tGO:0000001\t1.00",
+        "T96060000001\tGO:0000009\t0.10",
+        "T96060000002\tGO:0000002\t0.50",
+        "END",
+    ]
+    second = open(written[1]).read().splitlines()
+    assert second[2] == "KEYWORDS sequence alignment, machine learning."
+    assert second[3:5] == ["T96060000001\tGO:0000001\t0.30", "T96060000003\tGO:0000001\t0.20"]
+    # every output is a valid single-model submission
+    for path in written:
+        with open(path) as in_handle:
+            assert go(in_handle, os.path.basename(path))[0] is True
+    # no runs are left behind
+    assert [name for name in os.listdir(str(tmpdir)) if name.startswith("cafa_canonicalize")] == []
+
+
+def test_valid_file_round_trip(test_data_path, tmpdir):
+    written = canonicalize("{}end_to_end_data/valid/ateam_1_go.txt".format(test_data_path), str(tmpdir))
+    assert len(written) == 1
+    lines = open(written[0]).read().splitlines()
+    predictions = [line for line in lines if line.startswith("T")]
+    assert len(predictions) == 43
+    assert predictions == sorted(predictions)
+
+
+def test_invalid_file_writes_nothing(tmpdir):
+    lines = ["AUTHOR ateam\n", "MODEL 1\n", "KEYWORDS sequence alignment.\n", "T1 GO:0000001 1.50\n", "END\n"]
+    out_dir = str(tmpdir.join("out"))
+    with pytest.raises(CanonicalizeError):
+        canonicalize_lines(lines, "ateam_1_9606.txt", out_dir)
+    assert not os.path.exists(out_dir)
@@ -0,0 +1,69 @@
+import ast
+import os
+from array import array
+import pytest
+from cafa4_format_checker import cafa_checker
+from cafa_columnar import ColumnarWriter, load_columns
+
+
+def read_npy(path, code):
+    ''' Minimal .npy reader, so the format is checked without numpy '''
+    with open(path, "rb") as in_handle:
+        data = in_handle.read()
+    assert data[:8] == b"\x93NUMPY\x01\x00"
+    header_len = int.from_bytes(data[8:10], "little")
+    header = ast.literal_eval(data[10:10 + header_len].decode("latin1"))
+    values = array(code)
+    values.frombytes(data[10 + header_len:])
+    assert header["shape"] == (len(values),)
+    return values
+
+
+def test_export_of_valid_file(test_data_path, tmpdir, capfd):
+    out_dir = str(tmpdir)
+    assert cafa_checker("{}end_to_end_data/valid/ateam_1_go.txt".format(test_data_path), columnar=out_dir) is True
+    capfd.readouterr()
+    export = os.path.join(out_dir, "ateam_1_go")
+
+    targets = open(os.path.join(export, "targets.txt")).read().split()
+    terms = open(os.path.join(export, "terms.txt")).read().split()
+    target_col = read_npy(os.path.join(export, "target.npy"), "I")
+    term_col = read_npy(os.path.join(export, "term.npy"), "I")
+    score_col = read_npy(os.path.join(export, "score.npy"), "B")
+    assert len(target_col) == len(term_col) == len(score_col) == 43
+    # first prediction line of the file: T96060020120 GO:0008270 0.80
+    assert targets[target_col[0]] == "T96060020120"
+    assert terms[term_col[0]] == "GO:0008270"
+    assert score_col[0] == 80
+
+
+def test_blocks_and_models(tmpdir, monkeypatch):
+    import cafa_columnar
+
+    monkeypatch.setattr(cafa_columnar, "BLOCK_ROWS", 3)
+    writer = ColumnarWriter(str(tmpdir.join("out")))
+    lines = ["AUTHOR a\n", "MODEL 1\n"] + ["T00001 GO:0000001 0.05\n"] * 4
+    lines += ["MODEL 2\n"] + ["T00002 GO:0000002 1.00\n"] * 4 + ["END\n"]
+    list(writer.track(lines))
+    writer.close()
+    assert list(read_npy(str(tmpdir.join("out", "model.npy")), "B")) == [1] * 4 + [2] * 4
+    assert list(read_npy(str(tmpdir.join("out", "score.npy")), "B")) == [5] * 4 + [100] * 4
+
+
+def test_failed_file_leaves_no_output(test_data_path, tmpdir, capfd):
+    bad_path = tmpdir.join("ateam_1_do.txt")
+    with open("{}disorder_ontology/bad_keyword_DO_example.txt".format(test_data_path)) as read_handle:
+        bad_path.write(read_handle.read())
+    out_dir = tmpdir.join("out")
+    assert cafa_checker(str(bad_path), columnar=str(out_dir)) is False
+    capfd.readouterr()
+    assert not out_dir.join("ateam_1_do").check()
+
+
+def test_load_columns_memory_maps(test_data_path, tmpdir, capfd):
+    pytest.importorskip("numpy")
+    cafa_checker("{}end_to_end_data/valid/ateam_1_go.txt".format(test_data_path), columnar=str(tmpdir))
+    capfd.readouterr()
+    columns, targets, terms = load_columns(str(tmpdir.join("ateam_1_go")))
+    assert columns["score"].shape == (43,)
+    assert targets[columns["target"][0]] == "T96060020120"
@@ -0,0 +1,91 @@
+import gzip
+import os
+import zipfile
+import pytest
+from cafa_convert import ConvertError, from_tsv, lines_to_tsv, main, to_tsv, tsv_name
+from cafa_go_format_checker import cafa_checker as go
+
+
+LINES = [
+    "AUTHOR   ateam\n",
+    "MODEL 1\n",
+    "KEYWORDS sequence alignment.\n",
+    "ACCURACY 1 PR=0.50; RC=0.50\n",
+    "T96060000002 GO:0000002    0.50\n",
+    "T96060000001\tGO:0000009 0.10\n",
+    "MODEL 2\n",
+    "KEYWORDS  sequence alignment, machine learning.\n",
+    "T96060000003 GO:0000001 0.20\n",
+    "END\n",
+]
+
+
+def test_tsv_name():
+    assert tsv_name("ateam_1_9606.txt", "2") == "ateam_2_9606.tsv"
+    assert tsv_name("tc_ateam_1_9606.txt", "3", "gzip") == "tc_ateam_3_9606.tsv.gz"
+    assert tsv_name("ateam_1_9606.txt", "1", "zstd") == "ateam_1_9606.tsv.zst"
+
+
+def test_models_split(tmpdir):
+    written = lines_to_tsv(LINES, "ateam_1_9606.txt", str(tmpdir))
+    assert [os.path.basename(path) for path in written] == ["ateam_1_9606.tsv", "ateam_2_9606.tsv"]
+    assert open(written[0]).read() == "T96060000002\tGO:0000002\t0.50\nT96060000001\tGO:0000009\t0.10\n"
+    assert open(written[1]).read() == "T96060000003\tGO:0000001\t0.20\n"
+    assert sorted(os.listdir(str(tmpdir))) == ["ateam_1_9606.tsv", "ateam_2_9606.tsv"]
+
+
+def test_gzip_output(tmpdir):
+    written = lines_to_tsv(LINES, "ateam_1_9606.txt", str(tmpdir), compression="gzip")
+    with gzip.open(written[1], "rt") as in_handle:
+        assert in_handle.read() == "T96060000003\tGO:0000001\t0.20\n"
+
+
+def test_invalid_file_writes_nothing(tmpdir):
+    lines = ["AUTHOR ateam\n", "MODEL 1\n", "KEYWORDS sequence alignment.\n", "T1 GO:0000001 0.50\n",
+             "T1 GO:0000002 1.50\n", "END\n"]
+    out_dir = str(tmpdir.join("out"))
+    with pytest.raises(ConvertError):
+        lines_to_tsv(lines, "ateam_1_9606.txt", out_dir)
+    assert os.listdir(out_dir) == []
+
+
+def test_binding_files_are_refused(tmpdir):
+    with pytest.raises(ConvertError, match="can be converted"):
+        lines_to_tsv(LINES, "ateam_1_9606_binding.txt", str(tmpdir))
+
+
+def test_zip_round_trip(test_data_path, tmpdir):
+    source = "{}end_to_end_data/valid/ateam_1_go.txt".format(test_data_path)
+    archive = str(tmpdir.join("ateam.zip"))
+    with zipfile.ZipFile(archive, "w") as files:
+        files.write(source, "ateam_1_go.txt")
+    written = to_tsv(archive, str(tmpdir.join("tsv")), compression="gzip")
+    assert [os.path.basename(path) for path in written] == ["ateam_1_go.tsv.gz"]
+
+    output = str(tmpdir.join("ateam_1_go.txt"))
+    from_tsv(written[0], output, "ateam", "1", "sequence alignment")
+    with open(output) as in_handle:
+        assert go(in_handle, "ateam_1_go.txt")[0] is True
+    with open(source) as in_handle:
+        original = [line.split() for line in in_handle if line.startswith("T")]
+    with open(output) as in_handle:
+        converted = [line.split() for line in in_handle if line.startswith("T")]
+    assert converted == original
+
+
+def test_from_tsv_rounds_scores_and_rejects_bad_lines(tmpdir):
+    tsv = tmpdir.join("in.tsv")
+    tsv.write("T96060000001\tGO:0000001\t0.456\n\nT96060000002\tGO:0000002\t1\n")
+    output = str(tmpdir.join("ateam_1_9606.txt"))
+    assert main(["from-tsv", str(tsv), output, "--author", "ateam"]) is True
+    assert open(output).read().splitlines() == [
+        "AUTHOR ateam", "MODEL 1", "KEYWORDS sequence alignment.",
+        "T96060000001\tGO:0000001\t0.46", "T96060000002\tGO:0000002\t1.00", "END",
+    ]
+
+    tsv.write("T96060000001\tGO:0000001\t0.45\nT96060000002\tGO:0000002\n")
+    output = str(tmpdir.join("ateam_2_9606.txt"))
+    with pytest.raises(ConvertError):
+        from_tsv(str(tsv), output, "ateam")
+    assert not os.path.exists(output)
+    assert not os.path.exists(output + ".part")
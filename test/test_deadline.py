@@ -0,0 +1,96 @@
+import threading
+import pytest
+from cafa4_format_checker import cafa_checker
+from cafa_deadline import Deadline, DeadlineExceeded, bounded_check
+from cafa_go_format_checker import cafa_checker as go
+from cafa_records import RecordValidator
+
+
+class FakeClock(object):
+    ''' Advances one second every time it is read '''
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        self.now += 1.0
+        return self.now
+
+
+def go_lines(test_data_path):
+    with open("{}end_to_end_data/valid/ateam_1_go.txt".format(test_data_path)) as in_handle:
+        return in_handle.readlines()
+
+
+def test_unlimited_deadline_passes_result_through(test_data_path):
+    correct, errmsg, partial = bounded_check(go, go_lines(test_data_path), "ateam_1_go.txt", Deadline())
+    assert correct is True
+    assert partial is None
+
+
+def test_deadline_stops_with_partial_result(test_data_path):
+    # the clock is read once when the deadline is made and then every check_every lines
+    deadline = Deadline(3.5, check_every=4, clock=FakeClock())
+    correct, errmsg, partial = bounded_check(go, go_lines(test_data_path), "ateam_1_go.txt", deadline, "go_prediction")
+    assert correct is None
+    assert partial.lines_checked == 8
+    assert partial.visited_states == ["author", "model", "keywords", "go_prediction"]
+    assert partial.reason == "time budget exhausted"
+    assert errmsg.startswith("Inconclusive")
+
+
+def test_error_before_deadline_is_conclusive(test_data_path):
+    lines = go_lines(test_data_path)
+    lines[5] = "T96060020120 GO:0008270 1.80\n"
+    deadline = Deadline(100, check_every=4, clock=FakeClock())
+    correct, errmsg, partial = bounded_check(go, lines, "ateam_1_go.txt", deadline)
+    assert correct is False
+    assert partial is None
+
+
+def test_cancel_event_shared_by_children(test_data_path):
+    parent = Deadline(cancel_event=threading.Event())
+    child = parent.child(60)
+    parent.cancel()
+    correct, errmsg, partial = bounded_check(go, go_lines(test_data_path), "ateam_1_go.txt", child)
+    assert correct is None
+    assert partial.reason == "cancelled"
+    assert partial.lines_checked == 0
+
+
+def test_child_never_outlives_parent():
+    parent = Deadline(10, clock=lambda: 0.0)
+    assert parent.child(60).expires == 10
+    assert parent.child(5).expires == 5
+    assert parent.child().expires == 10
+
+
+def test_cafa4_checker_inconclusive(test_data_path, capfd):
+    event = threading.Event()
+    event.set()
+    assert cafa_checker("{}end_to_end_data/valid/ateam_1_go.txt".format(test_data_path), cancel_event=event) is None
+    out, err = capfd.readouterr()
+    assert "Files not completely validated" in out
+    assert "0 lines checked" in out
+    assert cafa_checker("{}end_to_end_data/valid/ateam_1_go.txt".format(test_data_path), time_budget=60) is True
+
+
+def test_sections_so_far_are_the_checkers(test_data_path):
+    header, predictions = go_lines(test_data_path)[:3], go_lines(test_data_path)[3:-1]
+    lines = (header + predictions + ["MODEL 2\n", "ACCURACY 1 PR=0.50; RC=0.50\n"] + predictions
+             + [" AUTHOR ateam\n", "END\n", "END\n"] + predictions)
+    deadline = Deadline(cancel_event=threading.Event(), check_every=8)
+    tracked = deadline.track(lines, "ateam_1_9606.txt", "go_prediction")
+    for count in range(96):
+        next(tracked)
+    deadline.cancel()
+    with pytest.raises(DeadlineExceeded) as stopped:
+        next(tracked)
+    validator = RecordValidator("ateam_1_9606.txt")
+    for line in lines[:96]:
+        validator.feed(line)
+    assert stopped.value.partial.lines_checked == 96
+    # AUTHOR and END each time, as the checker appends them
+    assert stopped.value.partial.visited_states == validator.visited_states == [
+        "author", "model", "keywords", "go_prediction", "accuracy", "author", "end", "end"
+    ]
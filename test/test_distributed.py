@@ -0,0 +1,196 @@
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import cafa_distributed
+from cafa4_format_checker import cafa_checker
+from cafa_distributed import distributed_checker, publish, work
+from cafa_queue import DirectoryQueue, SQLiteQueue, open_queue
+
+HEADER = ["AUTHOR ateam", "MODEL 1", "KEYWORDS sequence alignment."]
+
+
+def go_lines(n_targets, model=1):
+    lines = [line if line != "MODEL 1" else "MODEL %d" % model for line in HEADER]
+    return lines + ["T{:011d}\tGO:{:07d}\t0.50".format(target, target % 999 + 1) for target in range(n_targets)]
+
+
+@pytest.fixture(params=["dir", "sqlite"])
+def queue(request, tmpdir):
+    if request.param == "dir":
+        return DirectoryQueue(str(tmpdir.join("queue")))
+    return SQLiteQueue(str(tmpdir.join("queue.db")))
+
+
+def test_tasks_are_claimed_once_and_in_order(queue):
+    for number in (2, 1, 3):
+        queue.put("job-%05d" % number, {"n": number})
+    first = queue.claim("a")
+    second = queue.claim("b")
+    assert (first, second) == (("job-00001", {"n": 1}), ("job-00002", {"n": 2}))
+    queue.complete("job-00001", {"ok": 1})
+    queue.complete("job-00001", {"ok": 2})
+    assert queue.result("job-00001") == {"ok": 1} and queue.result("job-00002") is None
+    assert queue.claim("c") == ("job-00003", {"n": 3})
+    assert queue.claim("d") is None
+    queue.discard(["job-00001", "job-00002", "job-00003"])
+    assert queue.result("job-00001") is None and queue.claim("e") is None
+
+
+def test_expired_lease_is_handed_out_again(queue):
+    queue.put("job-00001", {"n": 1})
+    assert queue.claim("a", lease_seconds=0)[0] == "job-00001"
+    assert queue.claim("b", lease_seconds=60)[0] == "job-00001"
+    assert queue.claim("c") is None
+
+
+def test_concurrent_claims(tmpdir):
+    path = str(tmpdir.join("queue"))
+    task_ids = ["job-%05d" % number for number in range(100)]
+    for task_id in task_ids:
+        DirectoryQueue(path).put(task_id, {})
+
+    def drain(worker):
+        queue = DirectoryQueue(path)
+        claimed = []
+        while True:
+            task = queue.claim(worker)
+            if task is None:
+                return claimed
+            claimed.append(task[0])
+
+    with ThreadPoolExecutor(8) as pool:
+        claimed = [task_id for tasks in pool.map(drain, "abcdefgh") for task_id in tasks]
+    assert sorted(claimed) == task_ids
+
+    # leases that expire at once: every claim is a takeover race, and no claim file is ever half written
+    def take_over(worker):
+        queue = DirectoryQueue(path)
+        return sum(queue._try_claim("job-takeover", worker, 0) for _ in range(100))
+
+    with ThreadPoolExecutor(8) as pool:
+        assert sum(pool.map(take_over, "abcdefgh")) > 0
+    claims = DirectoryQueue(path).claims_dir
+    for name in os.listdir(claims):
+        with open(os.path.join(claims, name)) as in_handle:
+            assert json.load(in_handle)["worker"] in "abcdefgh"
+
+
+def test_open_queue_by_spec(tmpdir):
+    assert isinstance(open_queue("dir:" + str(tmpdir.join("q"))), DirectoryQueue)
+    assert isinstance(open_queue(str(tmpdir.join("q.db"))), SQLiteQueue)
+    assert isinstance(open_queue("sqlite:" + str(tmpdir.join("other"))), SQLiteQueue)
+
+
+def report_of(check, *args, **kwargs):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        result = check(*args, **kwargs)
+    return result, out.getvalue()
+
+
+def write_archive(path, members):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, lines in members:
+            archive.writestr(name, "\n".join(lines) + "\n")
+
+
+def broken(lines, index, line):
+    lines = list(lines)
+    lines[index] = line
+    return lines
+
+
+CASES = {
+    "valid": go_lines(3000) + ["END"],
+    "bad score": broken(go_lines(3000), 2500, "T00000000001\tGO:0000001\t1.50") + ["END"],
+    "bad score early": broken(go_lines(3000), 40, "T00000000001\tGO:0000001\t1.50") + ["END"],
+    "no end": go_lines(3000),
+    "keywords twice": broken(go_lines(3000), 1500, "KEYWORDS sequence alignment.") + ["END"],
+    "model in the middle": broken(go_lines(3000), 2000, "MODEL 2") + ["END"],
+    "blank line": broken(go_lines(3000), 1200, "") + ["END"],
+    "trailing blank lines": go_lines(3000) + ["END", "", ""],
+    "three models": go_lines(1000) + go_lines(1000, model=2)[1:] + go_lines(1000, model=3)[1:] + ["END"],
+    "too many models": go_lines(800) + sum((go_lines(800, model)[1:] for model in (2, 3, 4)), []) + ["END"],
+    "accuracy late in a model": broken(go_lines(1000) + go_lines(2000, model=2)[1:], 2500,
+                                       "ACCURACY 1 PR=0.50; RC=0.50") + ["END"],
+}
+
+
+@pytest.mark.parametrize("case", sorted(CASES))
+def test_ranges_merge_into_the_serial_report(tmpdir, case):
+    lines = CASES[case]
+    archive = str(tmpdir.join("ateam.zip"))
+    write_archive(archive, [("ateam_1_9606.txt", lines), ("ateam_2_9606.txt", go_lines(10, model=2) + ["END"])])
+    queue = DirectoryQueue(str(tmpdir.join("queue")))
+    expected = report_of(cafa_checker, archive)
+    assert report_of(distributed_checker, archive, queue, chunk_bytes=8 << 10, work=True) == expected
+    if case != "trailing blank lines":
+        plain = tmpdir.join("ateam_1_9606.txt")
+        plain.write("\n".join(lines) + "\n")
+        expected = report_of(cafa_checker, str(plain))
+        # ranges of about 8KB: the 100KB file is cut into about a dozen
+        assert report_of(distributed_checker, str(plain), queue, chunk_bytes=8 << 10, work=True) == expected
+
+
+def test_ranges_after_a_model_line_are_not_validated_again(tmpdir, monkeypatch):
+    plain = tmpdir.join("ateam_1_9606.txt")
+    plain.write("\n".join(CASES["three models"]) + "\n")
+    check_range = cafa_distributed.check_range
+    again = []
+
+    def recording(path, member, filename, kind, start, end, state=None, line_num=0, records=False):
+        if line_num:
+            again.append(start)
+        return check_range(path, member, filename, kind, start, end, state, line_num, records)
+
+    monkeypatch.setattr(cafa_distributed, "check_range", recording)
+    queue = DirectoryQueue(str(tmpdir.join("queue")))
+    expected = report_of(cafa_checker, str(plain))
+    assert report_of(distributed_checker, str(plain), queue, chunk_bytes=8 << 10, work=True) == expected
+    assert expected[0] is True and again == []
+
+
+def test_large_plain_files_are_published_as_ranges(tmpdir):
+    plain = tmpdir.join("ateam_1_9606.txt")
+    plain.write("\n".join(go_lines(3000) + ["END"]) + "\n")
+    queue = DirectoryQueue(str(tmpdir.join("queue")))
+    big, = publish(queue, str(plain), chunk_bytes=8 << 10)["files"]
+    assert len(big["tasks"]) == len(big["ranges"]) > 5
+
+    # archive members go whole to one worker, however large
+    archive = str(tmpdir.join("ateam.zip"))
+    write_archive(archive, [("ateam_1_9606.txt", go_lines(3000) + ["END"]), ("ateam_2_9606.txt", ["AUTHOR x"]),
+                            ("ateam_1.txt", ["AUTHOR x"])])
+    member, small, misnamed = publish(queue, archive, chunk_bytes=8 << 10)["files"]
+    assert len(member["tasks"]) == 1 and "ranges" not in member
+    assert len(small["tasks"]) == 1 and "ranges" not in small
+    # the file name alone fails it: nothing to validate
+    assert misnamed["tasks"] == [] and misnamed["result"][1] is False
+
+
+def test_workers_in_other_processes(tmpdir):
+    archive = str(tmpdir.join("ateam.zip"))
+    write_archive(archive, [("ateam_%d_9606.txt" % model, go_lines(2000, model) + ["END"]) for model in (1, 2, 3)])
+    spec = "sqlite:" + str(tmpdir.join("queue.db"))
+    expected = report_of(cafa_checker, archive)
+    workers = [multiprocessing.Process(target=work, args=(spec,), kwargs=dict(idle_timeout=2, poll_interval=0.05))
+               for _ in range(2)]
+    for worker in workers:
+        worker.start()
+    try:
+        assert report_of(distributed_checker, archive, spec, chunk_bytes=16 << 10, timeout=60) == expected
+    finally:
+        for worker in workers:
+            worker.join(10)
+
+
+def test_unfinished_files_are_inconclusive(tmpdir):
+    archive = str(tmpdir.join("ateam.zip"))
+    write_archive(archive, [("ateam_1_9606.txt", go_lines(10) + ["END"])])
+    result, report = report_of(distributed_checker, archive, DirectoryQueue(str(tmpdir.join("queue"))), timeout=0.1)
+    assert result is None and "Inconclusive: no worker finished validating ateam_1_9606.txt" in report
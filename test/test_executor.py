@@ -0,0 +1,90 @@
+import contextlib
+import io
+import zipfile
+import pytest
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from cafa4_format_checker import cafa_checker, main
+from cafa_benchmark import compare_backends, synthetic_lines
+from cafa_executor import default_backend, free_threaded, make_executor
+from cafa_memory import MemoryBudget, estimate_file_memory
+
+
+def test_backend_selection(monkeypatch):
+    monkeypatch.delenv("CAFA_EXECUTOR", raising=False)
+    assert default_backend() == ("thread" if free_threaded() else "process")
+    monkeypatch.setenv("CAFA_EXECUTOR", "thread")
+    assert default_backend() == "thread"
+    with make_executor(2) as pool:
+        assert isinstance(pool, ThreadPoolExecutor)
+    with make_executor(2, "process") as pool:
+        assert isinstance(pool, ProcessPoolExecutor)
+    with pytest.raises(ValueError):
+        make_executor(2, "fiber")
+
+
+def archive(tmpdir, n_members=4, bad_member=2):
+    path = str(tmpdir.join("bench.zip"))
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as out_zip:
+        for number in range(n_members):
+            lines = list(synthetic_lines("go", 3000))
+            if number == bad_member:
+                lines[1000] = "T00000020\tGO:12\t0.80\n"
+            out_zip.writestr("bench_1_%d.txt" % (9606 + number), "".join(lines))
+    return path
+
+
+def report(path, **options):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        result = cafa_checker(path, **options)
+    return result, out.getvalue()
+
+
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_concurrent_members_report_as_the_serial_checker(tmpdir, executor):
+    path = archive(tmpdir)
+    serial = report(path)
+    assert serial[0] is False and "line 1001" in serial[1]
+    assert report(path, member_workers=3, executor=executor) == serial
+
+
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_concurrent_members_stop_at_the_deadline(tmpdir, executor):
+    result, out = report(archive(tmpdir, bad_member=None), member_workers=2, executor=executor, time_budget=0)
+    assert result is None
+    assert out.count(" stopped (") == 4
+
+
+def test_benchmark_runs_every_backend():
+    results = compare_backends("go", n_files=2, n_lines=2000, workers=2)
+    assert [result["backend"] for result in results] == ["serial", "thread", "process"]
+    assert all(result["valid"] is True for result in results)
+
+
+class RecordingBudget(MemoryBudget):
+    def __init__(self, total_bytes):
+        MemoryBudget.__init__(self, total_bytes)
+        self.grants = []
+
+    def reserve(self, nbytes, timeout=None):
+        reservation = MemoryBudget.reserve(self, nbytes, timeout)
+        self.grants.append(self.reserved)
+        return reservation
+
+
+def test_concurrent_members_reserve_memory(tmpdir):
+    path = archive(tmpdir)
+    with zipfile.ZipFile(path) as files:
+        one_member = max(estimate_file_memory(info.file_size) for info in files.infolist())
+    budget = RecordingBudget(one_member)
+    assert report(path, member_workers=3, executor="thread", memory_budget=budget) == report(path)
+    assert len(budget.grants) == 4 and max(budget.grants) <= one_member
+    assert budget.reserved == 0
+
+
+def test_member_workers_refuse_per_line_options(tmpdir, capsys):
+    path = archive(tmpdir)
+    for option in (["--profile"], ["--stats", "stats.json"], ["--columnar-output", "columns"]):
+        with pytest.raises(SystemExit):
+            main([path, "--member-workers", "2"] + option)
+        assert "cannot be used with --member-workers" in capsys.readouterr().err
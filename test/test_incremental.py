@@ -0,0 +1,120 @@
+import json
+import zipfile
+import pytest
+import cafa_incremental
+from cafa4_format_checker import cafa_checker
+from cafa_incremental import ChunkCache, incremental_checker, iter_chunks, validate_incremental
+
+
+def prediction_file(n_targets=200, per_target=20):
+    lines = [b"AUTHOR ateam\n", b"MODEL 1\n", b"KEYWORDS sequence alignment.\n"]
+    for target in range(n_targets):
+        for term in range(per_target):
+            lines.append(b"T%011d\tGO:%07d\t0.%02d\n" % (target, term, (target + term) % 100))
+    lines.append(b"END\n")
+    return lines
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(cafa_incremental, "MIN_CHUNK_LINES", 16)
+    monkeypatch.setattr(cafa_incremental, "CHUNK_MASK", (1 << 6) - 1)
+
+
+def test_chunks_realign_after_an_insertion():
+    lines = prediction_file()
+    before = [len(chunk) for chunk in iter_chunks(lines, 16, 1 << 16, (1 << 6) - 1)]
+    edited = lines[:100] + [b"T00000000099\tGO:0000001\t0.50\n"] + lines[100:]
+    after = [len(chunk) for chunk in iter_chunks(edited, 16, 1 << 16, (1 << 6) - 1)]
+    assert sum(before) == len(lines)
+    assert len(before) > 20
+    # only the chunk holding the new line changes
+    assert sum(1 for a, b in zip(before, after) if a != b) == 1
+    assert before[-10:] == after[-10:]
+
+
+def test_only_changed_chunks_are_revalidated(small_chunks, tmpdir):
+    cache = ChunkCache(str(tmpdir))
+    lines = prediction_file()
+    correct, errmsg, counts = validate_incremental(lines, "ateam_1_9606.txt", cache)
+    assert correct is True
+    assert counts["reused"] == 0 and counts["lines_validated"] == len(lines)
+
+    correct, errmsg, counts = validate_incremental(lines, "ateam_1_9606.txt", cache)
+    assert correct is True
+    assert counts["reused"] == counts["chunks"] and counts["lines_validated"] == 0
+
+    lines[2000] = b"T00000000099\tGO:0000019\t0.77\n"
+    correct, errmsg, counts = validate_incremental(lines, "ateam_1_9606.txt", cache)
+    assert correct is True
+    assert counts["chunks"] - counts["reused"] <= 2
+    assert counts["lines_validated"] < len(lines) / 10
+
+
+def test_error_in_resubmission_has_file_line_number(small_chunks, tmpdir):
+    cache = ChunkCache(str(tmpdir))
+    lines = prediction_file()
+    validate_incremental(lines, "ateam_1_9606.txt", cache)
+    lines[3001] = b"T00000000150\tGO:0000001\t1.50\n"
+    correct, errmsg, counts = validate_incremental(lines, "ateam_1_9606.txt", cache)
+    assert correct is False
+    assert errmsg.startswith("Error in ateam_1_9606.txt, line 3002, ")
+    assert counts["reused"] > 0
+
+
+def test_state_carried_into_reused_chunks(small_chunks, tmpdir):
+    cache = ChunkCache(str(tmpdir))
+    lines = prediction_file(50, 20)
+    three_models = lines[:-1] + [b"MODEL 2\n"] + lines[3:-1] + [b"MODEL 3\n"] + lines[3:]
+    assert validate_incremental(three_models, "ateam_1_9606.txt", cache)[0] is True
+    # an extra MODEL near the top makes the MODEL 3 record far below, in an unchanged chunk, the fourth model
+    edited = three_models[:1010] + [b"MODEL 2\n"] + three_models[1010:]
+    correct, errmsg, counts = validate_incremental(edited, "ateam_1_9606.txt", cache)
+    assert correct is False
+    assert errmsg == "Too many models. Only up to 3 allowed"
+
+
+def test_cache_is_data_only(small_chunks, tmpdir):
+    cache = ChunkCache(str(tmpdir))
+    lines = prediction_file()
+    validate_incremental(lines, "ateam_1_9606.txt", cache)
+    path = cache._path("ateam_1_9606.txt")
+    assert path.endswith(".json") and len(json.load(open(path))) > 1
+    assert validate_incremental(lines, "ateam_1_9606.txt", cache)[2]["lines_validated"] == 0
+
+    for content in ("not json", '[["zz", [], [], 1]]', '{"a": 1}', "[[1, 2]]"):
+        with open(path, "w") as cache_handle:
+            cache_handle.write(content)
+        assert cache.load("ateam_1_9606.txt") == {}
+        correct, errmsg, counts = validate_incremental(lines, "ateam_1_9606.txt", cache)
+        assert correct is True and counts["reused"] == 0
+
+    # well-formed JSON whose exit states are not validator states
+    rows = json.load(open(path))
+    with open(path, "w") as cache_handle:
+        json.dump([[digest, entry_state, [1], n_lines] for digest, entry_state, exit_state, n_lines in rows],
+                  cache_handle)
+    correct, errmsg, counts = validate_incremental(lines, "ateam_1_9606.txt", cache)
+    assert correct is True and counts["reused"] == 0
+
+
+def test_binding_site_states_round_trip(small_chunks, tmpdir):
+    cache = ChunkCache(str(tmpdir))
+    lines = [b"AUTHOR ateam\n", b"MODEL 1\n", b"KEYWORDS sequence alignment.\n"]
+    for target in range(300):
+        lines += [b">T%011d\n" % target, b"LIG_ATP\n", b"0.50,0.40,0.30\n"]
+    lines.append(b"END\n")
+    assert validate_incremental(lines, "ateam_1_9606_binding.txt", cache)[0] is True
+    correct, errmsg, counts = validate_incremental(lines, "ateam_1_9606_binding.txt", cache)
+    assert correct is True and counts["reused"] == counts["chunks"]
+
+
+def test_members_read_as_the_checker_reads_them(tmpdir):
+    archive = str(tmpdir.join("ateam.zip"))
+    with zipfile.ZipFile(archive, "w") as files:
+        files.writestr("ateam_1_9606.txt", b"\n" + b"".join(prediction_file(10, 2)) + b"\n\n")
+        files.writestr("__MACOSX/._ateam_1_9606.txt", "not a prediction file")
+    assert cafa_checker(archive) is True
+    (filename, correct, errmsg, counts), = incremental_checker(archive, str(tmpdir.join("cache")))
+    assert (filename, correct) == ("ateam_1_9606.txt", True)
+    assert counts["lines_validated"] == 24
@@ -0,0 +1,117 @@
+import threading
+import zipfile
+import cafa_pipeline
+import cafa4_format_checker
+from cafa4_format_checker import cafa_checker
+from cafa_memory import (BASE_BYTES, MB, MIN_BLOCK_SIZE, MemoryBudget, estimate_file_memory,
+                         estimate_submission_memory, minimum_file_memory, pipeline_buffers)
+from cafa_scheduler import IntakeWatcher, Job
+
+
+def test_reserve_waits_until_memory_is_released():
+    budget = MemoryBudget(100)
+    first = budget.reserve(60)
+    assert budget.try_reserve(60) is None
+    assert budget.reserve(60, timeout=0.05) is None
+
+    granted = []
+    waiter = threading.Thread(target=lambda: granted.append(budget.reserve(60)))
+    waiter.start()
+    waiter.join(0.1)
+    assert not granted
+    first.release()
+    waiter.join(5)
+    assert granted[0].nbytes == 60 and budget.available() == 40
+
+
+def test_oversized_request_runs_alone():
+    budget = MemoryBudget(100)
+    with budget.reserve(500) as reservation:
+        assert reservation.nbytes == 100
+        assert budget.try_reserve(1) is None
+    assert budget.available() == 100
+
+
+def test_reserve_grants_what_is_free_above_the_minimum():
+    budget = MemoryBudget(100)
+    first = budget.reserve(70)
+    # 30 free: granted at once, rather than waiting for 60
+    with budget.reserve(60, minimum=20) as reservation:
+        assert reservation.nbytes == 30 and budget.available() == 0
+    assert budget.reserve(60, timeout=0.05, minimum=40) is None
+    first.release()
+    assert budget.reserve(60, minimum=20).nbytes == 60
+
+
+def test_unlimited_budget_never_waits():
+    budget = MemoryBudget()
+    assert budget.try_reserve(1 << 40).nbytes == 1 << 40
+    assert budget.available() is None
+
+
+def test_buffers_adapt_to_headroom():
+    full = estimate_file_memory(1 << 30)
+    assert pipeline_buffers(full) == (cafa_pipeline.BLOCK_SIZE, cafa_pipeline.QUEUE_BLOCKS)
+    block_size, max_blocks = pipeline_buffers(BASE_BYTES + MB)
+    assert (max_blocks + 2) * block_size <= MB
+    assert pipeline_buffers(0) == (MIN_BLOCK_SIZE, 1)
+    # a small file reserves little more than itself
+    assert estimate_file_memory(1000) == BASE_BYTES + 1000
+
+
+def write_archive(path, n_targets=2000):
+    lines = ["AUTHOR ateam", "MODEL 1", "KEYWORDS sequence alignment."]
+    lines += ["T{:011d}\tGO:0000001\t0.50".format(target) for target in range(n_targets)]
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("ateam_1_9606.txt", "\n".join(lines + ["END"]) + "\n")
+        archive.writestr("ateam_2_9606.txt", "\n".join(lines[:1] + ["MODEL 2"] + lines[2:] + ["END"]) + "\n")
+
+
+def test_submission_estimate_is_its_largest_member(tmpdir):
+    path = str(tmpdir.join("ateam.zip"))
+    write_archive(path)
+    with zipfile.ZipFile(path) as archive:
+        largest = max(info.file_size for info in archive.infolist())
+    assert estimate_submission_memory(path) == estimate_file_memory(largest)
+
+
+def test_validation_within_a_small_budget(tmpdir):
+    path = str(tmpdir.join("ateam.zip"))
+    write_archive(path)
+    budget = MemoryBudget(BASE_BYTES + 64 * 1024)
+    assert cafa_checker(path, memory_budget=budget) is True
+    assert budget.available() == budget.total_bytes
+
+
+def test_members_admitted_into_little_headroom_use_smaller_buffers(tmpdir, monkeypatch):
+    path = str(tmpdir.join("ateam.zip"))
+    write_archive(path, n_targets=200000)
+    with zipfile.ZipFile(path) as archive:
+        size = archive.infolist()[0].file_size
+    budget = MemoryBudget(estimate_file_memory(size))
+    held = budget.reserve(estimate_file_memory(size) - minimum_file_memory(size) - MB)
+    pipelined_lines = cafa4_format_checker.pipelined_lines
+    buffers = []
+
+    def recording(member, block_size, max_blocks):
+        buffers.append((block_size, max_blocks))
+        return pipelined_lines(member, block_size, max_blocks)
+
+    monkeypatch.setattr(cafa4_format_checker, "pipelined_lines", recording)
+    assert cafa_checker(path, memory_budget=budget) is True
+    assert buffers[0] == pipeline_buffers(minimum_file_memory(size) + MB) != pipeline_buffers(estimate_file_memory(size))
+    held.release()
+    assert budget.available() == budget.total_bytes
+
+
+def test_scheduler_holds_jobs_that_do_not_fit(tmpdir):
+    watcher = IntakeWatcher(str(tmpdir), str(tmpdir.join("results")), memory_budget=estimate_file_memory(10 * MB))
+    for name in ("ateam_1_9606.txt", "bteam_1_9606.txt"):
+        path = tmpdir.join(name)
+        path.write("x" * (6 * MB))
+        watcher.scheduler.add(Job(str(path), name, 6 * MB, name[:5]))
+    first, reservation = watcher._admit()
+    assert watcher._admit() is None
+    reservation.release()
+    second, _ = watcher._admit()
+    assert {first.name, second.name} == {"ateam_1_9606.txt", "bteam_1_9606.txt"}
@@ -0,0 +1,41 @@
+from cafa4_format_checker import cafa_checker
+from cafa_metrics import ValidationMetrics, classify_error, counted_lines
+
+
+def test_counted_lines_counts_consumed_lines_only():
+    lines, count = counted_lines(["a", "b", "c", "d"])
+    assert next(lines) == "a"
+    assert next(lines) == "b"
+    assert count() == 2
+
+
+def test_classify_error():
+    assert classify_error("Error in x, line 3, KEYWORDS: illegal keyword foo") == "KEYWORDS"
+    assert classify_error("Too many models. Only up to 3 allowed") == "MODEL"
+    assert classify_error("Error in x\nSections found in the file: [author, end]\n") == "section-order"
+    assert classify_error("Error in x, line 9, GO prediction: error in second (GO ID) field") == "prediction"
+
+
+def test_metrics_for_valid_and_invalid_files(test_data_path, tmpdir, capfd):
+    metrics = ValidationMetrics()
+    assert cafa_checker("{}end_to_end_data/valid/ateam_1_go.txt".format(test_data_path), metrics=metrics) is True
+
+    bad_path = tmpdir.join("ateam_1_do.txt")
+    with open("{}disorder_ontology/bad_keyword_DO_example.txt".format(test_data_path)) as read_handle:
+        bad_path.write(read_handle.read())
+    assert cafa_checker(str(bad_path), metrics=metrics) is False
+    capfd.readouterr()
+
+    registry = metrics.registry
+    go_labels = (("type", "GO/HPO Prediction"), ("result", "passed"))
+    assert registry.value("cafa_files_validated", go_labels) == 1
+    # file_name_check labels DO files "GO/HPO Prediction" too; the bad keyword file stops at line 3
+    assert registry.value("cafa_lines_validated", (("type", "GO/HPO Prediction"),)) == 47 + 3
+    assert registry.value("cafa_validation_errors", (("class", "KEYWORDS"),)) == 1
+
+    textfile = tmpdir.join("cafa.prom")
+    metrics.write_textfile(str(textfile))
+    text = textfile.read()
+    assert 'cafa_files_validated_total{type="GO/HPO Prediction",result="passed"} 1' in text
+    assert "# TYPE cafa_validation_latency_seconds histogram" in text
+    assert text.endswith("# EOF\n")
@@ -0,0 +1,64 @@
+import io
+import threading
+import pytest
+from cafa_pipeline import pipelined_lines
+
+
+def old_split(data):
+    ''' What cafa_checker did before: read the whole member, strip it and split it '''
+    return [line.decode("utf-8") for line in data.strip().split(b"\n")]
+
+
+@pytest.mark.parametrize("block_size", [1, 3, 7, 64, 1 << 20])
+def test_same_lines_as_read_strip_split(block_size):
+    data = "\n\n  AUTHOR ateam\nMODEL 1\nT1\tGO:0000001\t0.50\r\n\nT2\tGO:0000002\t0.25\nEND\n\n \n".encode("utf-8")
+    assert list(pipelined_lines(io.BytesIO(data), block_size=block_size, max_blocks=2)) == old_split(data)
+
+
+def test_multibyte_characters_split_across_blocks():
+    data = "AUTHOR équipe\nKEYWORDS naïve\n".encode("utf-8")
+    assert list(pipelined_lines(io.BytesIO(data), block_size=1)) == ["AUTHOR équipe", "KEYWORDS naïve"]
+
+
+def test_empty_member():
+    assert list(pipelined_lines(io.BytesIO(b""))) == []
+    assert list(pipelined_lines(io.BytesIO(b"\n \n"))) == []
+
+
+class CountingReader(object):
+    ''' A file object that counts the blocks read from it '''
+
+    def __init__(self, block):
+        self.block = block
+        self.reads = 0
+
+    def read(self, size):
+        self.reads += 1
+        return self.block
+
+
+def test_backpressure_and_early_stop():
+    source = CountingReader(b"T1 GO:0000001 0.50\n" * 10)
+    lines = pipelined_lines(source, block_size=16, max_blocks=4)
+    assert next(lines) == "T1 GO:0000001 0.50"
+    # the source never ends; the reader thread is held back by the bounded queue
+    threading.Event().wait(0.2)
+    assert source.reads <= 4 + 2
+    lines.close()
+    assert not any(thread.name == "cafa-inflate" for thread in threading.enumerate())
+
+
+class FailingReader(object):
+    def __init__(self):
+        self.calls = 0
+
+    def read(self, size):
+        self.calls += 1
+        if self.calls > 1:
+            raise IOError("Bad CRC-32")
+        return b"AUTHOR ateam\n"
+
+
+def test_read_errors_reach_the_consumer():
+    with pytest.raises(IOError):
+        list(pipelined_lines(FailingReader()))
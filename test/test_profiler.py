@@ -0,0 +1,63 @@
+import pytest
+import cafa_go_format_checker
+from cafa4_format_checker import cafa_checker, main
+from cafa_profiler import ValidationProfiler
+
+
+def test_profile_counts_states_and_validators(test_data_path, tmpdir):
+    filepath = "{}end_to_end_data/valid/ateam_1_go.txt".format(test_data_path)
+    profiler = ValidationProfiler()
+    with profiler:
+        assert cafa_checker(filepath, profiler=profiler) is True
+
+    states = profiler.state_totals()
+    assert states["author"][0] == 1
+    assert states["end"][0] == 1
+    assert states["prediction"][0] == 43
+    totals = profiler.by_name()
+    # the first prediction line goes through the validators, the others through the fast path
+    assert totals["go_prediction_check"][0] == 1
+    assert totals["go_field.match"][0] == 1
+    assert totals["float()"][0] == 1
+    assert totals["valid_prediction_line"][0] == 42
+    assert totals["valid_prediction_line.miss"][0] == 1
+    assert profiler.lines == 47
+
+    collapsed = tmpdir.join("stacks.txt")
+    profiler.dump_collapsed(str(collapsed))
+    stacks = collapsed.read()
+    assert "cafa_checker;go_prediction_check;go_field.match " in stacks
+    assert "cafa_checker;valid_prediction_line " in stacks
+
+
+def test_profiler_restores_checker_globals():
+    ''' The hooks must be gone once profiling is over, so unprofiled runs pay nothing '''
+    original_check = cafa_go_format_checker.go_prediction_check
+    original_pattern = cafa_go_format_checker.go_field
+    with ValidationProfiler():
+        assert cafa_go_format_checker.go_prediction_check is not original_check
+    assert cafa_go_format_checker.go_prediction_check is original_check
+    assert cafa_go_format_checker.go_field is original_pattern
+    assert "float" not in vars(cafa_go_format_checker)
+
+
+def test_profile_refuses_workers(test_data_path, capsys):
+    filepath = "{}end_to_end_data/valid/ateam_1_go.txt".format(test_data_path)
+    for option in (["--chunk-workers", "2"], ["--binding-workers", "2"], ["--executor", "thread"],
+                   ["--member-workers", "2"]):
+        with pytest.raises(SystemExit):
+            main([filepath, "--profile"] + option)
+        assert "--profile" in capsys.readouterr().err
+    with pytest.raises(ValueError):
+        cafa_checker(filepath, profiler=ValidationProfiler(), chunk_workers=2)
+
+
+def test_phases_and_do_patterns_are_timed(test_data_path):
+    profiler = ValidationProfiler()
+    with profiler:
+        assert cafa_checker("{}end_to_end_data/valid/go_and_do.zip".format(test_data_path), profiler=profiler) is True
+        assert cafa_checker("{}end_to_end_data/valid/ateam_1_go.txt".format(test_data_path), profiler=profiler,
+                            precheck=True) is True
+    assert profiler.phases["zip_directory"][0] == 1
+    assert profiler.phases["precheck"][0] == 1
+    assert profiler.by_name()["do_field.match"][0] >= 1
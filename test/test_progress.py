@@ -0,0 +1,94 @@
+import contextlib
+import io
+import os
+import zipfile
+import cafa_binding_parallel
+import cafa_shared
+from cafa4_format_checker import cafa_checker
+from cafa_benchmark import synthetic_lines
+from cafa_progress import ProgressReporter, section_of
+
+
+def test_section_of():
+    assert section_of("AUTHOR ateam\n") == "author"
+    assert section_of(b"KEYWORDS homolog.") == "keywords"
+    assert section_of("T96060020120\tGO:0008270\t0.80\n") == "prediction"
+
+
+def test_progress_reports_every_batch_and_final(test_data_path, capfd):
+    snapshots = []
+
+    def callback(snapshot, final=False):
+        snapshots.append((snapshot, final))
+
+    filepath = "{}end_to_end_data/valid/ateam_1_go.txt".format(test_data_path)
+    progress = ProgressReporter(callback=callback, interval=0.0, check_every=10)
+    assert cafa_checker(filepath, progress=progress) is True
+    capfd.readouterr()
+
+    # one snapshot per 10 lines, plus the final one
+    assert len(snapshots) == 5
+    last, final = snapshots[-1]
+    assert final is True
+    assert last.lines == 47
+    assert last.bytes_done == last.bytes_total == os.stat(filepath).st_size
+    assert last.state == "end"
+    assert snapshots[0][0].state == "prediction"
+
+
+
+def test_bytes_are_counted_encoded():
+    snapshots = []
+    progress = ProgressReporter(callback=lambda snapshot, final=False: snapshots.append(snapshot))
+    assert list(progress.track(["AUTHOR équipe", "END"], "ateam_1_9606.txt", 19)) == ["AUTHOR équipe", "END"]
+    assert snapshots[-1].bytes_done == len("AUTHOR équipe\nEND\n".encode("utf-8")) == 19
+
+
+def final_snapshots(path, **options):
+    snapshots = []
+
+    def callback(snapshot, final=False):
+        if final:
+            snapshots.append(snapshot)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = cafa_checker(path, progress=ProgressReporter(callback=callback, interval=0.0), **options)
+    return result, snapshots
+
+
+def test_progress_of_files_validated_by_workers(tmpdir, monkeypatch):
+    lines = ["AUTHOR ateam\n", "MODEL 1\n", "KEYWORDS sequence alignment.\n"] + [
+        "T{:011d}\tGO:{:07d}\t0.50\n".format(number // 10, number % 10 + 1) for number in range(3000)
+    ] + ["END\n"]
+    archive = str(tmpdir.join("ateam.zip"))
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as out_zip:
+        out_zip.writestr("ateam_1_9606.txt", "".join(lines))
+        out_zip.writestr("ateam_2_9606.txt", "".join(lines).replace("MODEL 1", "MODEL 2"))
+    size = len("".join(lines))
+
+    # members: the archive as a whole, a member at a time
+    result, (snapshot,) = final_snapshots(archive, member_workers=2, executor="thread")
+    assert result is True
+    assert (snapshot.filename, snapshot.bytes_done, snapshot.bytes_total) == ("ateam.zip", 2 * size, 2 * size)
+    assert (snapshot.lines, snapshot.state) == (2 * len(lines), "ateam_2_9606.txt")
+
+    # byte ranges of a member, as serially
+    monkeypatch.setattr(cafa_shared, "CHUNK_BYTES", 10000)
+    result, snapshots = final_snapshots(archive, chunk_workers=2, executor="thread")
+    assert result is True
+    assert [snapshot[:4] for snapshot in snapshots] == [
+        (name, size, size, len(lines)) for name in ("ateam_1_9606.txt", "ateam_2_9606.txt")
+    ]
+
+    # batches of target blocks
+    monkeypatch.setattr(cafa_binding_parallel, "MIN_PARALLEL_BYTES", 0)
+    binding = str(tmpdir.join("ateam_1_9606_binding.txt"))
+    binding_lines = list(synthetic_lines("binding", 300, residues=10))
+    with open(binding, "w") as out_handle:
+        out_handle.writelines(binding_lines)
+    target_batches = cafa_binding_parallel.target_batches
+    monkeypatch.setattr(cafa_binding_parallel, "target_batches", lambda path, batch_bytes: target_batches(path, 500))
+    result, (snapshot,) = final_snapshots(binding, binding_workers=2, executor="thread")
+    assert result is True
+    assert snapshot.bytes_done == snapshot.bytes_total == os.stat(binding).st_size
+    assert snapshot.lines == len(binding_lines)
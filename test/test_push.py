@@ -0,0 +1,54 @@
+import os
+import pytest
+from cafa_push import PushValidator, check_chunks
+from cafa_records import InvalidRecordError
+
+
+def pieces(data, size):
+    return [data[start:start + size] for start in range(0, len(data), size)]
+
+
+VALID = "\n\nAUTHOR équipe\r\nMODEL 1\nKEYWORDS sequence alignment.\nT00000001\tGO:0000001\t0.50\nEND\n\n".encode("utf-8")
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 1000])
+def test_lines_and_characters_split_across_feeds(size):
+    assert check_chunks(pieces(VALID, size), "ateam_1_9606.txt") == (
+        True, "ateam_1_9606.txt, passed the CAFA 4 GO prediction format checker")
+
+
+def test_error_raised_before_the_upload_ends():
+    data = VALID.replace(b"0.50", b"1.50") + b"T00000002\tGO:0000002\t0.40\n" * 1000
+    validator = PushValidator("ateam_1_9606.txt")
+    fed = 0
+    with pytest.raises(InvalidRecordError) as raised:
+        for chunk in pieces(data, 16):
+            validator.feed(chunk)
+            fed += len(chunk)
+    assert fed < 100
+    assert raised.value.errmsg.startswith("Error in ateam_1_9606.txt, line 6, ")
+    # the error sticks
+    with pytest.raises(InvalidRecordError):
+        validator.close()
+
+
+def test_blank_line_inside_the_file():
+    data = b"AUTHOR ateam\nMODEL 1\n\nT00000001\tGO:0000001\t0.50\nEND\n"
+    correct, errmsg = check_chunks([data], "ateam_1_9606.txt")
+    assert correct is False
+    assert "line 3" in errmsg
+
+
+def test_missing_end_and_binding_sites():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with open(os.path.join(root, "test", "test_data", "end_to_end_data", "valid", "ateam_1_go.txt"), "rb") as handle:
+        data = handle.read()
+    assert check_chunks(pieces(data, 5), "ateam_1_go.txt")[0] is True
+    truncated = data[:data.rindex(b"END")]
+    correct, errmsg = check_chunks(pieces(truncated, 5), "ateam_1_go.txt")
+    assert correct is False
+    assert "Sections found in the file" in errmsg
+
+    binding = b">T123456\nRNA\n0.00, 0.01\n"
+    correct, errmsg = check_chunks([b"AUTHOR a\nMODEL 1\n", binding * 3, b"END"], "ateam_1_9606_binding.txt")
+    assert correct is True, errmsg
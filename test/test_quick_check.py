@@ -0,0 +1,136 @@
+import zipfile
+from cafa4_format_checker import check_file
+from cafa_quick_check import format_result, precheck, quick_check, wilson_interval
+
+HEADER = "AUTHOR ateam\nMODEL 1\nKEYWORDS sequence alignment.\n"
+
+
+def write_go_file(path, bad_every=0, end=True, n_lines=2000):
+    lines = [HEADER]
+    for i in range(n_lines):
+        if bad_every and i % bad_every == 0:
+            lines.append("T{:011d}\tGO:12\t0.80\n".format(i))
+        else:
+            lines.append("T{:011d}\tGO:0008270\t0.80\n".format(i))
+    if end:
+        lines.append("END\n")
+    path.write("".join(lines))
+
+
+def test_valid_file_passes(tmpdir):
+    path = tmpdir.join("ateam_1_9606.txt")
+    write_go_file(path)
+    result, = quick_check(str(path), sample_size=200, seed=7)
+    assert result.correct is True
+    assert result.header_error is None and result.trailer_error is None
+    assert 150 < result.sampled <= 200
+    assert result.failed == 0
+
+
+def test_missing_end_and_bad_lines_are_reported(tmpdir):
+    path = tmpdir.join("ateam_1_9606.txt")
+    write_go_file(path, bad_every=2, end=False)
+    result, = quick_check(str(path), sample_size=400, seed=7)
+    assert result.correct is False
+    assert "END" in result.trailer_error
+    # half of the body lines are broken; the estimate and its interval should say so
+    assert result.low < 0.5 < result.high
+    assert "error in second (GO ID) field" in result.examples[0]
+
+
+def test_zip_members_are_sampled(tmpdir):
+    path = tmpdir.join("ateam_1_9606.txt")
+    write_go_file(path, bad_every=10)
+    archive = str(tmpdir.join("ateam.zip"))
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as out_zip:
+        out_zip.write(str(path), "ateam_1_9606.txt")
+    result, = quick_check(archive, sample_size=300, seed=3)
+    assert result.filename == "ateam_1_9606.txt"
+    assert result.failed > 0
+    assert result.low < 0.1 < result.high
+    assert result.trailer_error is None
+    assert "END trailer: OK" in format_result(result)
+
+
+def test_zip_members_are_inflated_once(tmpdir, monkeypatch):
+    path = tmpdir.join("ateam_1_9606.txt")
+    write_go_file(path, end=False)
+    archive = str(tmpdir.join("ateam.zip"))
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as out_zip:
+        out_zip.write(str(path), "ateam_1_9606.txt")
+    seek = zipfile.ZipExtFile.seek
+    targets = []
+
+    def recording_seek(self, offset, whence=0):
+        targets.append(offset)
+        return seek(self, offset, whence)
+
+    monkeypatch.setattr(zipfile.ZipExtFile, "seek", recording_seek)
+    result, = quick_check(archive, sample_size=2000, seed=3)
+    # the END trailer is read last, still seeking forward
+    assert "END" in result.trailer_error
+    assert targets == sorted(targets)
+
+
+def test_trailer_after_sampled_lines(tmpdir):
+    # a small file: every offset is in the last TRAILER_BYTES, and the sample reaches the END line
+    path = tmpdir.join("ateam_1_9606.txt")
+    write_go_file(path, n_lines=20)
+    for seed in range(20):
+        result, = quick_check(str(path), sample_size=200, seed=seed)
+        assert result.correct is True and result.trailer_error is None
+    write_go_file(path, n_lines=20, end=False)
+    result, = quick_check(str(path), sample_size=200, seed=1)
+    assert "END" in result.trailer_error
+
+
+def test_header_checked_as_the_checker_checks_it(tmpdir):
+    path = tmpdir.join("ateam_1_9606.txt")
+    path.write(HEADER.replace("MODEL 1", "MODEL x") + "T00000000001\tGO:0008270\t0.80\n" * 100 + "END\n")
+    result, = quick_check(str(path), sample_size=10, seed=1)
+    assert result.header_error == check_file(open(str(path)), "ateam_1_9606.txt", 0, stripped=False)[2]
+
+    path.write("MODEL 1\nAUTHOR ateam\n" + "T00000000001\tGO:0008270\t0.80\n" * 100 + "END\n")
+    result, = quick_check(str(path), sample_size=10, seed=1)
+    assert "Sections found in the file: [model, author, go_prediction]\n" in result.header_error
+
+
+def test_wilson_interval():
+    low, high = wilson_interval(0, 100)
+    assert low == 0.0 and 0.03 < high < 0.04
+
+
+def test_precheck_passes_valid_files(tmpdir):
+    path = tmpdir.join("ateam_1_9606.txt")
+    write_go_file(path)
+    assert precheck(str(path)) is None
+    # blank trailing lines are left to the full scan
+    path.write(path.read() + "\n\n")
+    assert precheck(str(path)) is None
+
+
+def test_precheck_reports_what_the_checker_reports(tmpdir):
+    path = tmpdir.join("ateam_1_9606.txt")
+    write_go_file(path, end=False)
+    errmsg = precheck(str(path), head_bytes=1024)
+    assert "Sections found in the file: [author, model, keywords, go_prediction]" in errmsg
+    assert errmsg == check_file(open(str(path)), "ateam_1_9606.txt", 0, stripped=False)[2]
+
+    path.write("MODEL 1\nAUTHOR ateam\n" + "T00000000001\tGO:0008270\t0.80\n" * 100 + "END\n")
+    # the order is wrong from the second line on: the sections after it are not read
+    assert "Sections found in the file: [model, author, go_prediction]\n" in precheck(str(path))
+    assert check_file(open(str(path)), "ateam_1_9606.txt", 0, stripped=False)[1] is False
+
+    path.write(HEADER.replace("MODEL 1", "MODEL x") + "T00000000001\tGO:0008270\t0.80\n" * 100 + "END\n")
+    errmsg = precheck(str(path))
+    assert errmsg == check_file(open(str(path)), "ateam_1_9606.txt", 0, stripped=False)[2]
+
+
+def test_cafa_checker_fails_before_the_body_scan(tmpdir, monkeypatch, capsys):
+    import cafa4_format_checker
+
+    path = tmpdir.join("ateam_1_9606.txt")
+    write_go_file(path, end=False)
+    monkeypatch.setattr(cafa4_format_checker, "check_file", None)
+    assert cafa4_format_checker.cafa_checker(str(path), precheck=True) is False
+    assert "go_prediction]" in capsys.readouterr().out
@@ -0,0 +1,135 @@
+import os
+import zipfile
+import pytest
+from cafa4_format_checker import cafa_checker, prediction_kind
+from cafa_binding_site_format_checker import cafa_checker as binding
+from cafa_do_format_checker import cafa_checker as do_checker
+from cafa_go_format_checker import cafa_checker as go
+from cafa_hpo_format_checker import cafa_checker as hpo
+from cafa_records import (
+    BindingSiteRecord,
+    HeaderRecord,
+    InvalidRecordError,
+    PredictionRecord,
+    RecordValidator,
+    iter_file_records,
+    iter_records,
+)
+
+
+CHECKERS = {"go": go, "hpo": hpo, "do": do_checker, "binding": binding}
+
+
+def test_go_records(test_data_path):
+    records = list(iter_records("{}end_to_end_data/valid/ateam_1_go.txt".format(test_data_path)))
+    headers = [record for record in records if isinstance(record, HeaderRecord)]
+    predictions = [record for record in records if isinstance(record, PredictionRecord)]
+    assert [header.kind for header in headers] == ["author", "model", "keywords", "end"]
+    assert headers[0].value == "ateam"
+    assert headers[2].value == ["sequence alignment"]
+    assert len(predictions) == 43
+    first = predictions[0]
+    assert (first.target, first.term, first.score, first.model) == ("T96060020120", "GO:0008270", 80, 1)
+    assert not hasattr(first, "__dict__")
+
+
+def test_zip_members(test_data_path):
+    records = list(iter_records("{}end_to_end_data/valid/go_and_do.zip".format(test_data_path)))
+    assert len(set(record.filename for record in records)) == 2
+    assert all(0 <= record.score <= 100 for record in records if isinstance(record, PredictionRecord))
+
+
+def test_members_read_as_the_checker_reads_them(tmpdir):
+    archive = str(tmpdir.join("ateam.zip"))
+    with zipfile.ZipFile(archive, "w") as files:
+        files.writestr("ateam_1_9606.txt", "\nAUTHOR ateam\nMODEL 1\nKEYWORDS sequence alignment.\n"
+                                           "T96060000001\tGO:0000001\t0.50\nEND\n\n")
+        files.writestr("__MACOSX/._ateam_1_9606.txt", "not a prediction file")
+    assert cafa_checker(archive) is True
+    records = list(iter_records(archive))
+    assert [record.line_num for record in records] == [1, 2, 3, 4, 5]
+
+
+def test_error_matches_checker(test_data_path):
+    with open("{}end_to_end_data/valid/ateam_1_go.txt".format(test_data_path)) as in_handle:
+        lines = in_handle.readlines()
+    lines[5] = "T96060020120\tGO:0008270\t1.80\n"
+    seen = []
+    with pytest.raises(InvalidRecordError) as error:
+        for record in iter_file_records(lines, "ateam_1_9606.txt"):
+            seen.append(record)
+    assert error.value.errmsg == go(lines, "ateam_1_9606.txt")[1]
+    assert error.value.line_num == 6
+    # the records before the error were yielded as the file streamed by
+    assert len(seen) == 5
+
+
+def test_section_order_reported_when_the_file_ends():
+    lines = ["AUTHOR ateam\n", "KEYWORDS sequence alignment.\n", "MODEL 1\n", "T96060000001 GO:0000001 0.50\n",
+             "END\n"]
+    records = iter_file_records(lines, "ateam_1_9606.txt")
+    assert [next(records).kind for _ in range(3)] == ["author", "keywords", "model"]
+    assert next(records).target == "T96060000001"
+    assert next(records).kind == "end"
+    with pytest.raises(InvalidRecordError) as error:
+        next(records)
+    assert error.value.errmsg == go(lines, "ateam_1_9606.txt")[1]
+    assert "Sections found in the file: [author, keywords, model, go_prediction, end]" in error.value.errmsg
+
+
+def _fixture_files(test_data_path):
+    """ (name, kind, lines) of every prediction file under test_data, zip members included """
+    for directory, _, names in sorted(os.walk(test_data_path)):
+        for name in sorted(names):
+            path = os.path.join(directory, name)
+            # the disorder_ontology files are DO files whatever their names say
+            kind = "do" if os.path.basename(directory) == "disorder_ontology" else None
+            if zipfile.is_zipfile(path):
+                with zipfile.ZipFile(path) as files:
+                    for member in files.namelist():
+                        if member.endswith("/") or "__MACOSX" in member:
+                            continue
+                        text = files.read(member).decode("utf-8", "replace")
+                        yield member.split("/")[-1], kind, text.splitlines(True)
+            elif name.endswith(".txt"):
+                with open(path) as in_handle:
+                    yield name, kind, in_handle.readlines()
+
+
+def test_same_result_as_the_checkers(test_data_path):
+    checked = []
+    for name, kind, lines in _fixture_files(test_data_path):
+        kind = kind or prediction_kind(name)
+        if kind not in CHECKERS:
+            continue
+        validator = RecordValidator(name, kind)
+        try:
+            for line in lines:
+                validator.feed(line)
+            result = validator.finish()
+        except InvalidRecordError as error:
+            result = (False, error.errmsg)
+        assert result == CHECKERS[kind](lines, name), name
+        checked.append(result[0])
+    # most of the fixtures are invalid files, one per kind of error
+    assert checked.count(False) >= 15
+
+
+def test_binding_site_records():
+    lines = [
+        "AUTHOR ateam\n",
+        "MODEL 1\n",
+        "KEYWORDS sequence alignment.\n",
+        ">T123567\n",
+        "RNA\n",
+        "0.00, 0.10, 1.00\n",
+        "DNA\n",
+        "0.50, 0.51, 0.52\n",
+        "END\n",
+    ]
+    records = [record for record in iter_file_records(lines, "ateam_1_9606_binding.txt")
+               if isinstance(record, BindingSiteRecord)]
+    assert [(record.target, record.binding_type, record.scores) for record in records] == [
+        ("T123567", "RNA", [0, 10, 100]),
+        ("T123567", "DNA", [50, 51, 52]),
+    ]
@@ -0,0 +1,64 @@
+from cafa_ruleset import load_ruleset
+from cafa_edition_checker import cafa_checker
+from cafa_go_format_checker import cafa_checker as go_checker
+
+
+def test_section_order_dfa():
+    rules = load_ruleset("cafa4")
+    assert rules.section_order_ok(["author", "model", "keywords", "accuracy", "prediction", "end"])
+    assert rules.section_order_ok(["author", "model", "prediction", "end"])
+    assert not rules.section_order_ok(["author", "model", "accuracy", "prediction", "end"])
+    assert not rules.section_order_ok(["author", "model", "prediction"])
+    assert rules.legal_states("go_prediction")[2] == ["author", "model", "go_prediction", "end"]
+
+
+def test_combined_prediction_line_pattern():
+    line = load_ruleset("cafa4").prediction_line("go")
+    assert line.match("T96060020120\tGO:0008270\t0.80\n")
+    assert line.match("T96060020120 GO:0008270 1.00")
+    assert not line.match("T96060020120\tGO:0008270\t1.01")
+    assert not line.match("T96060020120\tGO:0008270\t0.8")
+    assert not line.match("T96060020120\tHP:0008270\t0.80")
+
+
+def test_compiled_once_per_process():
+    assert load_ruleset("cafa2") is load_ruleset("cafa2")
+    assert load_ruleset("cafa2") is not load_ruleset("cafa4")
+
+
+def test_edition_checker(test_data_path):
+    filepath = "{}end_to_end_data/valid/ateam_1_go.txt".format(test_data_path)
+    with open(filepath) as read_handle:
+        is_valid, message = cafa_checker(read_handle, "ateam_1_go.txt")
+    assert is_valid is True
+    assert "passed the CAFA 4 GO prediction format checker" in message
+
+    # CAFA 2 allowed HP terms in the same file as GO terms
+    lines = ["AUTHOR ateam\n", "MODEL 1\n", "T96060020120 HP:0008270 0.80\n", "END\n"]
+    assert cafa_checker(lines, "ateam_1_9606.txt", edition="cafa2")[0] is True
+    assert cafa_checker(lines, "ateam_1_9606.txt", edition="cafa4")[0] is False
+
+
+def test_edition_checker_reports_what_the_cafa4_checker_reports():
+    header = ["AUTHOR ateam\n", "MODEL 1\n"]
+    prediction = "T96060000001 GO:0000001 0.50\n"
+    for lines in (
+        header + ["ACCURACY 1 PR=0.50; RC=0.50\n", prediction, "END\n"],
+        header + ["ACCURACY 1 PR=0.50; RC=0.50\n"] + ["bad line\n"] * 10,
+        header + ["ACCURACY 1 PR=0.50; RC=0.50\n"] * 4 + [prediction, "END\n"],
+        ["AUTHOR ateam\n"] + ["MODEL 1\n", "KEYWORDS sequence alignment.\n", prediction] * 4 + ["END\n"],
+    ):
+        assert cafa_checker(lines, "ateam_1_9606.txt") == go_checker(lines, "ateam_1_9606.txt")
+    is_valid, message = cafa_checker(header + ["ACCURACY 1 PR=0.50; RC=0.50\n", prediction, "END\n"], "ateam_1_9606.txt")
+    assert is_valid is False
+    assert "Sections found in the file: [author, model, accuracy, go_prediction, end]" in message
+
+
+def test_edition_checker_accepts_what_the_fast_path_does_not():
+    lines = ["AUTHOR ateam\n", "MODEL 1\n", "KEYWORDS sequence alignment.\n", " T100000001 GO:0000001 0.50\n",
+             "T100000001\x0bGO:0000002\x0c0.50\n", "END\n"]
+    assert go_checker(lines, "ateam_1_9606.txt")[0] is True
+    for edition in ("cafa4", "cafa2"):
+        assert cafa_checker(lines, "ateam_1_9606.txt", edition=edition)[0] is True
+    assert "Cannot be > 1" in cafa_checker(lines[:3] + ["T100000001 GO:0000001 1.50\n", "END\n"],
+                                           "ateam_1_9606.txt")[1]
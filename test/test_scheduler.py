@@ -0,0 +1,132 @@
+import json
+import os
+import shutil
+import urllib.request
+from cafa4_format_checker import submission_team
+from cafa_metrics import ValidationMetrics
+import cafa_scheduler
+from cafa_scheduler import FairScheduler, IntakeWatcher, Job, validate_job
+
+
+def job(name, size):
+    return Job(name, name, size, submission_team(name))
+
+
+def test_submission_team():
+    assert submission_team("ateam_1_9606.zip") == "ateam"
+    assert submission_team("TC_bteam_2_9606.txt") == "bteam"
+    assert submission_team("cteam_1_9606_binding.txt") == "cteam"
+    assert submission_team("intake/upload.zip") == "upload"
+
+
+def test_shortest_first_within_and_across_teams():
+    scheduler = FairScheduler()
+    for name, size in (("big_1_9606.zip", 50000), ("small_1_9606.zip", 10), ("small_2_9606.zip", 5)):
+        scheduler.add(job(name, size))
+    assert [scheduler.pop().name for _ in range(3)] == ["small_2_9606.zip", "small_1_9606.zip", "big_1_9606.zip"]
+    assert scheduler.pop() is None
+
+
+def test_many_small_files_do_not_starve_other_teams():
+    scheduler = FairScheduler()
+    for model in range(100):
+        scheduler.add(job("flood_{}_9606.zip".format(model), 10))
+    scheduler.add(job("other_1_9606.zip", 30))
+    order = [scheduler.pop().name for _ in range(101)]
+    # the other team's job goes once the flooding team has used its share, not after all 100 files
+    assert order.index("other_1_9606.zip") <= 4
+
+
+def test_idle_team_does_not_bank_credit():
+    scheduler = FairScheduler()
+    for model in range(10):
+        scheduler.add(job("early_{}_9606.zip".format(model), 100))
+    for _ in range(5):
+        scheduler.pop()
+    for model in range(5):
+        scheduler.add(job("late_{}_9606.zip".format(model), 100))
+    order = [scheduler.pop().team for _ in range(10)]
+    # the late team is interleaved with the early one instead of running all five of its jobs first
+    assert order[:4].count("late") == 2
+
+
+def test_watch_folder_once(test_data_path, tmpdir):
+    watch_dir = tmpdir.mkdir("intake")
+    results_dir = str(tmpdir.join("results"))
+    shutil.copy("{}end_to_end_data/valid/ateam_1_go.txt".format(test_data_path), str(watch_dir))
+    watch_dir.join("ateam_2_9606.txt").write("AUTHOR ateam\nMODEL 2\nKEYWORDS sequence alignment.\nT1 GO:1 2.00\nEND\n")
+    watch_dir.join("notes.pdf").write("ignored")
+
+    results = IntakeWatcher(str(watch_dir), results_dir, workers=2).run(once=True)
+    assert sorted((result["file"], result["valid"]) for result in results) == [
+        ("ateam_1_go.txt", True),
+        ("ateam_2_9606.txt", False),
+    ]
+    with open(os.path.join(results_dir, "ateam_2_9606.txt.json")) as in_handle:
+        result = json.load(in_handle)
+    assert result["team"] == "ateam"
+    assert "incorrecly formatted" in result["report"]
+    # results are not recomputed
+    assert IntakeWatcher(str(watch_dir), results_dir, workers=1).run(once=True) == []
+
+
+def test_growing_files_wait_for_next_poll(tmpdir):
+    watch_dir = tmpdir.mkdir("intake")
+    watcher = IntakeWatcher(str(watch_dir), str(tmpdir.join("results")))
+    watch_dir.join("ateam_1_9606.zip").write("partial")
+    assert watcher.poll() == 0
+    assert watcher.poll() == 1
+    assert len(watcher.scheduler) == 1
+
+
+def test_metrics_are_served(test_data_path, tmpdir):
+    watch_dir = tmpdir.mkdir("intake")
+    shutil.copy("{}end_to_end_data/valid/ateam_1_go.txt".format(test_data_path), str(watch_dir))
+    watch_dir.join("ateam_2_9606.txt").write("AUTHOR ateam\nMODEL 2\nKEYWORDS sequence alignment.\nT1 GO:1 2.00\nEND\n")
+    metrics = ValidationMetrics()
+    server = metrics.serve(0, "127.0.0.1")
+    try:
+        IntakeWatcher(str(watch_dir), str(tmpdir.join("results")), workers=2, metrics=metrics).run(once=True)
+        url = "http://127.0.0.1:{}/metrics".format(server.server_address[1])
+        with urllib.request.urlopen(url, timeout=10) as response:
+            text = response.read().decode("utf-8")
+    finally:
+        server.shutdown()
+    assert 'cafa_files_validated_total{type="GO/HPO Prediction",result="passed"} 1' in text
+    assert 'cafa_files_validated_total{type="GO/HPO Prediction",result="failed"} 1' in text
+    assert 'cafa_lines_validated_total{type="GO/HPO Prediction"} 51' in text
+    assert text.endswith("# EOF\n")
+
+
+def test_replaced_submissions_are_validated_again(test_data_path, tmpdir):
+    watch_dir = tmpdir.mkdir("intake")
+    results_dir = str(tmpdir.join("results"))
+    submission = watch_dir.join("ateam_1_9606.txt")
+    submission.write("AUTHOR ateam\nMODEL 1\nKEYWORDS sequence alignment.\nT1 GO:1 2.00\nEND\n")
+    assert [result["valid"] for result in IntakeWatcher(str(watch_dir), results_dir, workers=1).run(once=True)] == [False]
+
+    watcher = IntakeWatcher(str(watch_dir), results_dir, workers=1)
+    assert watcher.poll(settle=False) == 0
+    shutil.copy("{}end_to_end_data/valid/ateam_1_go.txt".format(test_data_path), str(submission))
+    os.utime(str(submission), (1e9, 1e9))
+    assert [result["valid"] for result in watcher.run(once=True)] == [True]
+    assert watcher.poll(settle=False) == 0
+
+
+def crashing_job(path, *args):
+    if "crash" in path:
+        os._exit(1)
+    return validate_job(path, *args)
+
+
+def test_dead_worker_fails_its_job_and_the_pool_is_replaced(test_data_path, tmpdir, monkeypatch):
+    watch_dir = tmpdir.mkdir("intake")
+    watch_dir.join("crash_1_9606.txt").write("AUTHOR crash\n")
+    shutil.copy("{}end_to_end_data/valid/ateam_1_go.txt".format(test_data_path), str(watch_dir))
+    monkeypatch.setattr(cafa_scheduler, "validate_job", crashing_job)
+    results = IntakeWatcher(str(watch_dir), str(tmpdir.join("results")), workers=1).run(once=True)
+    assert [(result["file"], result["valid"]) for result in results] == [
+        ("crash_1_9606.txt", False),
+        ("ateam_1_go.txt", True),
+    ]
+    assert "terminated abruptly" in results[0]["report"]
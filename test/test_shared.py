@@ -0,0 +1,150 @@
+import contextlib
+import io
+import os
+import tempfile
+import time
+import zipfile
+import pytest
+from concurrent.futures import ProcessPoolExecutor
+import cafa_distributed
+import cafa_shared
+from cafa4_format_checker import cafa_checker, main
+from cafa_async import validate_member
+from cafa_deadline import Deadline
+from cafa_shared import SegmentReader, SharedSegment, inflate_member, validate_member_in_chunks
+
+
+def read_range(ref, start, end):
+    with SegmentReader(ref) as reader:
+        reader.seek(start)
+        return reader.read(end - start)
+
+
+def leftovers():
+    names = set(os.listdir(cafa_shared.SHM_DIR)) if os.path.isdir(cafa_shared.SHM_DIR) else set()
+    return names | set(name for name in os.listdir(tempfile.gettempdir()) if name.startswith(cafa_shared.FILE_PREFIX))
+
+
+@pytest.mark.parametrize("backing", ["shm", "file"])
+def test_workers_read_the_segment_in_place(backing):
+    before = leftovers()
+    data = bytes(range(256)) * 1000
+    with SharedSegment(len(data), backing) as segment:
+        segment.buf[:] = data
+        with ProcessPoolExecutor(2) as pool:
+            assert pool.submit(read_range, segment.ref, 1000, 5000).result() == data[1000:5000]
+        assert read_range(segment.ref, 255000, 300000) == data[255000:]
+    assert leftovers() == before
+
+
+def go_member(tmpdir, lines):
+    path = str(tmpdir.join("ateam.zip"))
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as out_zip:
+        out_zip.writestr("ateam_1_9606.txt", "\n".join(lines) + "\n")
+    return path
+
+
+def test_segment_is_removed_when_inflating_fails(tmpdir, monkeypatch):
+    path = go_member(tmpdir, ["AUTHOR ateam"] * 1000)
+    before = leftovers()
+
+    def broken(self, buffer):
+        raise zipfile.BadZipFile("Bad CRC-32")
+
+    monkeypatch.setattr(zipfile.ZipExtFile, "readinto", broken)
+    with pytest.raises(zipfile.BadZipFile):
+        inflate_member(path, "ateam_1_9606.txt")
+    assert leftovers() == before
+
+
+VALID = (["AUTHOR ateam", "MODEL 1", "KEYWORDS sequence alignment."]
+         + ["T{:011d}\tGO:{:07d}\t0.50".format(number // 10, number % 10) for number in range(3000)] + ["END"])
+
+
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_chunks_report_what_the_serial_checker_reports(tmpdir, executor):
+    cases = [
+        VALID,
+        VALID[:1500] + ["T00000000001\tGO:12\t0.50"] + VALID[1500:],
+        VALID[:2000] + [""] + VALID[2000:],
+        VALID[:-1],
+        VALID[:2500] + ["MODEL 2"] + VALID[2500:],
+        VALID[:1000] + ["MODEL 2", "KEYWORDS sequence alignment."] + VALID[1000:2000] + ["MODEL 3"] + VALID[2000:],
+        VALID[:1000] + ["MODEL 2", "ACCURACY 1 PR=0.50; RC=0.50"] + VALID[1000:2000] + ["ACCURACY 2 PR=0.5"]
+        + VALID[2000:],
+    ]
+    for lines in cases:
+        path = go_member(tmpdir, lines)
+        expected = validate_member(path, "ateam_1_9606.txt")
+        assert validate_member_in_chunks(path, "ateam_1_9606.txt", 3, executor, chunk_bytes=10000) == (
+            expected.file_type, expected.correct, expected.errmsg
+        )
+
+
+def test_cafa_checker_chunk_workers(tmpdir, monkeypatch):
+    monkeypatch.setattr(cafa_shared, "CHUNK_BYTES", 10000)
+    path = go_member(tmpdir, VALID[:1500] + ["T00000000001\tGO:12\t0.50"] + VALID[1500:])
+    reports = []
+    for options in ({}, {"chunk_workers": 2, "executor": "thread"}):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            result = cafa_checker(path, **options)
+        reports.append((result, out.getvalue()))
+    assert reports[0] == reports[1]
+    assert reports[0][0] is False and "line 1501" in reports[0][1]
+
+
+def test_chunk_workers_refuse_per_line_options(tmpdir, capsys):
+    path = go_member(tmpdir, VALID)
+    for option in (["--stats", "stats.json"], ["--sketches", "sketches.json"], ["--columnar-output", "columns"],
+                   ["--metrics-textfile", "cafa.prom"]):
+        for workers in ("--chunk-workers", "--binding-workers"):
+            with pytest.raises(SystemExit):
+                main([path, workers, "2"] + option)
+            assert "cannot be used with " + workers in capsys.readouterr().err
+
+
+def test_chunks_stop_at_the_deadline(tmpdir, monkeypatch):
+    path = go_member(tmpdir, VALID)
+    deadline = Deadline()
+    check_range = cafa_shared.check_range
+
+    def cancelling(*args):
+        deadline.cancel()
+        time.sleep(0.3)
+        return check_range(*args)
+
+    monkeypatch.setattr(cafa_shared, "check_range", cancelling)
+    before = leftovers()
+    file_type, correct, errmsg = validate_member_in_chunks(path, "ateam_1_9606.txt", 1, "thread", chunk_bytes=10000,
+                                                           deadline=deadline)
+    assert (file_type, correct) == (None, None)
+    assert errmsg.startswith("Inconclusive: validation of ateam_1_9606.txt stopped (cancelled)")
+    assert "Sections found so far: [author, model, keywords, go_prediction]" in errmsg
+    assert leftovers() == before
+
+
+def test_only_chunked_members_are_held_whole():
+    assert cafa_shared.is_chunked("ateam_1_9606.txt", 20000, chunk_bytes=10000)
+    assert not cafa_shared.is_chunked("ateam_1_9606.txt", 19999, chunk_bytes=10000)
+    assert not cafa_shared.is_chunked("ateam_1_9606_binding.txt", 20000, chunk_bytes=10000)
+    assert not cafa_shared.is_chunked("ateam_9606.txt", 20000, chunk_bytes=10000)
+
+
+def test_ranges_after_a_model_line_are_not_validated_again(tmpdir, monkeypatch):
+    path = go_member(tmpdir, VALID[:1000] + ["MODEL 2"] + VALID[1000:2000] + ["MODEL 3"] + VALID[2000:])
+    check_range = cafa_shared.check_range
+    again = []
+
+    def recording(ref, member, filename, kind, start, end, state=None, line_num=0, records=False):
+        if line_num:
+            again.append(start)
+        return check_range(ref, member, filename, kind, start, end, state, line_num, records)
+
+    monkeypatch.setattr(cafa_shared, "check_range", recording)
+    monkeypatch.setattr(cafa_distributed, "check_range", recording)
+    expected = validate_member(path, "ateam_1_9606.txt")
+    assert validate_member_in_chunks(path, "ateam_1_9606.txt", 2, "thread", chunk_bytes=10000) == (
+        expected.file_type, expected.correct, expected.errmsg
+    )
+    assert expected.correct is True and again == []
@@ -0,0 +1,77 @@
+import random
+from cafa4_format_checker import cafa_checker
+from cafa_similarity import PredictionSketch, load_sketches, main, similar_pairs
+
+
+def predictions(targets, terms=range(20), seed=0):
+    rng = random.Random(seed)
+    return ["T{:011d}\tGO:{:07d}\t{:.2f}".format(target, term, rng.randint(1, 100) / 100.0)
+            for target in targets for term in terms]
+
+
+def go_file(lines, model=1):
+    return "\n".join(["AUTHOR ateam", "MODEL %d" % model, "KEYWORDS sequence alignment."] + lines + ["END"]) + "\n"
+
+
+def sketch_of(lines):
+    sketch = PredictionSketch()
+    for line in lines:
+        sketch.add_line(line)
+    return sketch
+
+
+def test_jaccard_estimate():
+    shared = predictions(range(150))
+    a = sketch_of(shared + predictions(range(1000, 1050), seed=1))
+    b = sketch_of(shared + predictions(range(2000, 2050), seed=2))
+    # 3000 shared predictions out of 5000
+    assert abs(a.jaccard(b) - 0.6) < 0.15
+    assert a.jaccard(sketch_of(predictions(range(3000, 3200), seed=3))) < 0.1
+    # the order of the lines does not matter
+    assert a.jaccard(sketch_of(list(reversed(shared + predictions(range(1000, 1050), seed=1))))) == 1.0
+
+
+def test_small_files_merge_and_round_trip():
+    small = sketch_of(predictions(range(2), range(3)))
+    assert small.jaccard(sketch_of(predictions(range(2), range(3)))) == 1.0
+    assert small.jaccard(sketch_of(predictions(range(2), range(3), seed=5))) < 1.0
+
+    first, second = predictions(range(30)), predictions(range(30, 60))
+    merged = sketch_of(first).merge(sketch_of(second))
+    assert tuple(merged.minima) == tuple(sketch_of(first + second).minima)
+    assert merged.predictions == 1200
+    copy = PredictionSketch.from_dict(merged.to_dict())
+    assert copy.signature() == merged.signature() and copy.predictions == 1200
+
+
+def test_similar_pairs_across_models_and_teams(tmpdir):
+    shared = predictions(range(100))
+    files = {
+        "ateam_1_9606.txt": go_file(shared),
+        "ateam_2_9606.txt": go_file(predictions(range(500, 600), seed=7), model=2),
+        "bteam_1_9606.txt": go_file(shared[:-20] + predictions(range(900, 901), seed=8)),
+    }
+    sketches = {}
+    for name, content in files.items():
+        tmpdir.join(name).write(content)
+        assert cafa_checker(str(tmpdir.join(name)), sketches=sketches) is True
+    pairs = similar_pairs(sketches, threshold=0.8)
+    assert [(a, b) for _, a, b in pairs] == [("ateam_1_9606.txt", "bteam_1_9606.txt")]
+    assert pairs[0][0] > 0.9
+
+
+def test_scheduler_stores_sketches_for_the_batch_command(tmpdir, capsys):
+    from cafa_scheduler import IntakeWatcher
+
+    watch_dir = tmpdir.mkdir("incoming")
+    shared = predictions(range(50))
+    watch_dir.join("ateam_1_9606.txt").write(go_file(shared))
+    watch_dir.join("bteam_1_9606.txt").write(go_file(shared))
+    watch_dir.join("cteam_1_9606.txt").write(go_file(predictions(range(50), seed=4)))
+    results_dir = str(tmpdir.join("results"))
+    IntakeWatcher(str(watch_dir), results_dir, workers=2, sketch=True).run(once=True)
+    assert len(load_sketches([results_dir])) == 3
+
+    pairs = main([results_dir, "--threshold", "0.9"])
+    assert [(a[0], b[0]) for _, a, b in pairs] == [("ateam_1_9606.txt", "bteam_1_9606.txt")]
+    assert capsys.readouterr().out.startswith("1.000\tateam_1_9606.txt\tateam_1_9606.txt\tbteam_1_9606.txt")
@@ -0,0 +1,56 @@
+import json
+from cafa_stats import HyperLogLog, SubmissionStats, TDigest
+
+
+def prediction_lines(targets, per_target, score="0.50", model="1"):
+    lines = ["AUTHOR ateam\n", "MODEL {}\n".format(model)]
+    for target in targets:
+        for term in range(per_target):
+            lines.append("T{:011d}\tGO:{:07d}\t{}\n".format(target, term, score))
+    lines.append("END\n")
+    return lines
+
+
+def test_hyperloglog_estimate_and_merge():
+    first = HyperLogLog()
+    second = HyperLogLog()
+    for i in range(20000):
+        first.add(b"T%d" % i)
+        second.add(b"T%d" % (i + 10000))
+    assert abs(first.count() - 20000) < 20000 * 0.03
+    first.merge(second)
+    assert abs(first.count() - 30000) < 30000 * 0.03
+
+
+def test_tdigest_quantiles():
+    digest = TDigest()
+    for value in range(1, 10001):
+        digest.add(value)
+    assert abs(digest.quantile(0.5) - 5000) < 150
+    assert abs(digest.quantile(0.99) - 9900) < 50
+
+
+def test_stats_collected_while_lines_stream_by():
+    stats = SubmissionStats()
+    lines = prediction_lines(range(100), 10)
+    assert list(stats.track(lines)) == lines
+    summary = stats.summary()
+    assert summary["predictions"] == 1000
+    assert summary["distinct_targets"] == 100
+    assert summary["distinct_terms"] == 10
+    assert summary["predictions_per_target"]["median"] == 10
+    assert summary["confidence_histograms"]["1"] == {"0.50": 1000}
+    assert summary["flat_target_share"] == 1.0
+    json.dumps(summary)
+
+
+def test_merged_chunks_match_a_single_pass():
+    whole = SubmissionStats()
+    list(whole.track(prediction_lines(range(200), 5)))
+    first = SubmissionStats()
+    list(first.track(prediction_lines(range(100), 5)))
+    second = SubmissionStats()
+    list(second.track(prediction_lines(range(100, 200), 5)))
+    # round trip one side through its serialized state, as a worker process would
+    merged = first.merge(SubmissionStats.from_dict(json.loads(json.dumps(second.to_dict()))))
+    assert merged.summary() == whole.summary()
@@ -0,0 +1,101 @@
+import zipfile
+from cafa4_format_checker import cafa_checker
+from cafa_trace import Tracer, chrome_trace, read_spans
+
+
+def go_file(n_targets=10, model=1, bad_line=None):
+    lines = ["AUTHOR ateam", "MODEL %d" % model, "KEYWORDS sequence alignment."]
+    lines += ["T{:011d}\tGO:0000001\t0.50".format(target) for target in range(n_targets)]
+    if bad_line is not None:
+        lines.insert(bad_line, "T00000000001\tGO:0000001\t1.50")
+    return "\n".join(lines + ["END"]) + "\n"
+
+
+def traced_archive(tmpdir, **tracer_options):
+    path = str(tmpdir.join("ateam.zip"))
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("ateam_1_9606.txt", go_file(100))
+        archive.writestr("ateam_2_9606.txt", go_file(model=2, bad_line=5))
+    spans_path = str(tmpdir.join("spans.jsonl"))
+    tracer = Tracer(spans_path, **tracer_options)
+    result = cafa_checker(path, tracer=tracer)
+    tracer.close()
+    return result, read_spans(spans_path)
+
+
+def test_spans_follow_the_validation_phases(tmpdir):
+    result, spans = traced_archive(tmpdir)
+    assert result is False
+    by_id = dict((span["span_id"], span) for span in spans)
+
+    def parent(span):
+        return by_id[span["parent_span_id"]]["name"]
+
+    root, = [span for span in spans if span["parent_span_id"] is None]
+    assert root["name"] == "submission" and root["attributes"]["valid"] is False
+    assert len(set(span["trace_id"] for span in spans)) == 1
+    for span in spans:
+        assert span["start_time_unix_nano"] <= span["end_time_unix_nano"]
+        if span is not root:
+            assert span["start_time_unix_nano"] >= root["start_time_unix_nano"]
+    expected_parents = {"open": "submission", "zip_directory": "submission", "member": "submission",
+                        "report": "submission", "decompress": "member", "file_name_check": "member",
+                        "section": "file_name_check"}
+    for span in spans:
+        if span is not root:
+            assert parent(span) == expected_parents[span["name"]]
+
+    members = [span["attributes"] for span in spans if span["name"] == "member"]
+    assert [member["member"] for member in members] == ["ateam_1_9606.txt", "ateam_2_9606.txt"]
+    checks = [span["attributes"] for span in spans if span["name"] == "file_name_check"]
+    assert [check["correct"] for check in checks] == [True, False]
+    decompress = [span["attributes"] for span in spans if span["name"] == "decompress"]
+    assert decompress[0]["bytes"] == members[0]["bytes"]
+
+
+def test_sections_end_where_validation_stopped(tmpdir):
+    _, spans = traced_archive(tmpdir)
+    by_id = dict((span["span_id"], span) for span in spans)
+    sections = {}
+    for span in spans:
+        if span["name"] == "section":
+            file_name = by_id[span["parent_span_id"]]["attributes"]["file"]
+            sections.setdefault(file_name, []).append((span["attributes"]["section"], span["attributes"]["lines"]))
+            assert span["end_time_unix_nano"] <= by_id[span["parent_span_id"]]["end_time_unix_nano"]
+    assert sections["ateam_1_9606.txt"] == [("author", 1), ("model", 1), ("keywords", 1), ("prediction", 100),
+                                            ("end", 1)]
+    # the checker stopped at the sixth line, the first with an error
+    assert sections["ateam_2_9606.txt"] == [("author", 1), ("model", 1), ("keywords", 1), ("prediction", 3)]
+
+
+def test_unsampled_submissions_are_not_recorded(tmpdir):
+    result, spans = traced_archive(tmpdir, sample_rate=0.5, rng=lambda: 0.75)
+    assert result is False and spans == []
+    _, spans = traced_archive(tmpdir, sample_rate=0.5, rng=lambda: 0.25)
+    assert spans
+
+
+def test_chrome_trace_events(tmpdir):
+    _, spans = traced_archive(tmpdir)
+    events = chrome_trace(spans)["traceEvents"]
+    assert len(events) == len(spans)
+    assert events[0]["name"] == "submission" and all(event["ph"] == "X" for event in events)
+    decompress = [event for event in events if event["name"] == "decompress"][0]
+    submission = events[0]
+    # the reader thread gets its own track
+    assert decompress["tid"] != submission["tid"] and decompress["pid"] == submission["pid"]
+
+
+def test_scheduler_workers_share_the_spans_file(tmpdir):
+    from cafa_scheduler import IntakeWatcher
+
+    watch_dir = tmpdir.mkdir("incoming")
+    for team in ("ateam", "bteam", "cteam"):
+        watch_dir.join(team + "_1_9606.txt").write(go_file(50))
+    spans_path = str(tmpdir.join("spans.jsonl"))
+    tracer = Tracer(spans_path)
+    results = IntakeWatcher(str(watch_dir), str(tmpdir.join("results")), workers=2, tracer=tracer).run(once=True)
+    tracer.close()
+    assert [result["valid"] for result in results] == [True, True, True]
+    roots = [span for span in read_spans(spans_path) if span["name"] == "submission"]
+    assert len(roots) == 3 and len(set(span["trace_id"] for span in roots)) == 3